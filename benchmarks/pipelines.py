@@ -0,0 +1,455 @@
+""" Measures the throughput and memory use of each mergesvp pipeline. Test
+data at a realistic scale is generated in a temporary folder, each pipeline
+is timed several times and then run once more with tracemalloc to measure its
+peak memory use. The World Ocean Atlas is replaced with a stub so synthetic
+SVP runs measure mergesvp rather than the atlas. Results are written to a
+JSON file so they can be compared between versions.
+
+    python benchmarks/pipelines.py run -o results.json
+    python benchmarks/pipelines.py compare base.json results.json -t 0.1
+"""
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import click
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+# benchmark the mergesvp checkout this script belongs to
+sys.path.insert(0, str(ROOT))
+
+from mergesvp.lib import ssminterface
+from mergesvp.lib.carisprocess import \
+    group_by_depth_speed, \
+    merge_caris_svp_process
+from mergesvp.lib.parsers import CarisSvpParser, L0SvpParser
+from mergesvp.lib.svpprofile import SvpProfile
+from mergesvp.lib.syntheticprocess import synthetic_svp_process
+from mergesvp.lib.tracklines import TracklineIndex, TracklinesParser
+
+START = datetime(2020, 8, 1)
+TRACKLINES_DATE_FORMAT = r'%d/%m/%y'
+
+
+class BenchmarkData:
+    """ Generates the test data used by the benchmarks. Sizes are those of a
+    typical survey, multiplied by `scale`.
+    """
+
+    def __init__(self, folder: Path, scale: float, seed: int = 0) -> None:
+        self.folder = folder
+        self.rng = random.Random(seed)
+
+        self.caris_files = max(1, int(20 * scale))
+        self.caris_profiles_per_file = 100
+        self.caris_levels = 200
+        # fraction of CARIS profiles that duplicate an earlier profile
+        self.duplicate_ratio = 0.25
+        self.l0_files = max(1, int(500 * scale))
+        self.l0_levels = 500
+        # one trackline point per second
+        self.trackline_points = max(2, int(200000 * scale))
+        self.interpolations = max(1, int(100000 * scale))
+        self.synthetic_svps = max(1, int(5000 * scale))
+
+        self.caris_folder = folder / 'caris'
+        self.l0_folder = folder / 'l0'
+        self.tracklines_file = folder / 'tracklines.csv'
+        self.output_folder = folder / 'output'
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+
+        self.caris_paths = self._write_caris_files()
+        self.l0_paths = self._write_l0_files()
+        self._write_tracklines()
+
+    def _random_profile(self, levels: int) -> List[Tuple[float, float]]:
+        speed = self.rng.uniform(1480, 1540)
+        profile = []
+        for i in range(levels):
+            speed += self.rng.uniform(-0.5, 0.5)
+            profile.append((round(i * 0.5, 3), round(speed, 3)))
+        return profile
+
+    def _write_caris_files(self) -> List[Path]:
+        """ Writes CARIS files in the folder structure read by the
+        merge-caris-svp command"""
+        writer = CarisSvpParser()
+        paths = []
+        profiles = []
+        timestamp = START
+        for i in range(self.caris_files):
+            svps = []
+            for _ in range(self.caris_profiles_per_file):
+                if len(profiles) > 0 and \
+                        self.rng.random() < self.duplicate_ratio:
+                    profile = self.rng.choice(profiles)
+                else:
+                    profile = self._random_profile(self.caris_levels)
+                    profiles.append(profile)
+                svps.append(SvpProfile(
+                    timestamp=timestamp,
+                    latitude=self.rng.uniform(-20, -10),
+                    longitude=self.rng.uniform(140, 150),
+                    depth_speed=profile
+                ))
+                timestamp += timedelta(minutes=30)
+            path = self.caris_folder / f'line_{i:04d}_ssp' / 'svp'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer.write_many(path, svps)
+            paths.append(path)
+        return paths
+
+    def _write_l0_files(self) -> List[Path]:
+        self.l0_folder.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for i in range(self.l0_files):
+            timestamp = START + timedelta(hours=i)
+            lines = [
+                f"Now: {timestamp.strftime('%d/%m/%Y %H:%M:%S')}",
+                "Battery Level: 1.4V",
+                "MiniSVP: S/N 34826",
+                "Site info: BENCHMARK",
+                "Calibrated: 10/01/2011",
+                "Latitude: -12 14 35 S",
+                "Longitude: 130 55 40 E",
+                "Mode: P2.000000e-1",
+                "Tare: 10.0854",
+                "Pressure units: dBar",
+            ]
+            for (depth, speed) in self._random_profile(self.l0_levels):
+                temperature = self.rng.uniform(20, 30)
+                lines.append(
+                    f"{depth:06.3f}\t{temperature:06.3f}\t{speed:08.3f}")
+            path = self.l0_folder / f'svp_{i:05d}.txt'
+            path.write_text('\n'.join(lines) + '\n')
+            paths.append(path)
+        return paths
+
+    def _write_tracklines(self) -> None:
+        latitude = -16.0
+        longitude = 146.0
+        with self.tracklines_file.open('w') as f:
+            f.write("Date,Time,Line,Longitude,Latitude,Depth\n")
+            for i in range(self.trackline_points):
+                timestamp = START + timedelta(seconds=i)
+                latitude += self.rng.uniform(-0.0001, 0.0002)
+                longitude += self.rng.uniform(-0.0001, 0.0002)
+                f.write(
+                    f"{timestamp.strftime('%d/%m/%y,%H:%M:%S.%f')[:-3]},"
+                    f"L{i // 10000},{longitude:.7f},{latitude:.7f},50\n"
+                )
+
+    @property
+    def trackline_hours(self) -> float:
+        return (self.trackline_points - 1) / 3600
+
+
+def _stub_atlas_query(
+        latitude: float,
+        longitude: float,
+        timestamp: datetime) -> List[Tuple[float, float]]:
+    """ Generates a profile that varies with location, in place of querying
+    the World Ocean Atlas"""
+    return [
+        (
+            float(depth),
+            1500.0 + latitude * 0.1 + longitude * 0.01 - depth * 0.01
+        )
+        for depth in range(0, 500, 10)
+    ]
+
+
+@contextmanager
+def stub_atlas():
+    query = ssminterface._query_ssm_synthetic_svp
+    ssminterface._query_ssm_synthetic_svp = _stub_atlas_query
+    try:
+        yield
+    finally:
+        ssminterface._query_ssm_synthetic_svp = query
+
+
+def bench_caris_parse(data: BenchmarkData) -> Callable[[], int]:
+    def run() -> int:
+        parser = CarisSvpParser()
+        return sum(len(parser.read_many(path)) for path in data.caris_paths)
+    return run
+
+
+def bench_l0_parse(data: BenchmarkData) -> Callable[[], int]:
+    def run() -> int:
+        parser = L0SvpParser()
+        for path in data.l0_paths:
+            parser.read(path)
+        return len(data.l0_paths)
+    return run
+
+
+def bench_dedup_grouping(data: BenchmarkData) -> Callable[[], int]:
+    parser = CarisSvpParser()
+    svps = [svp for path in data.caris_paths for svp in parser.read_many(path)]
+
+    def run() -> int:
+        group_by_depth_speed(svps)
+        return len(svps)
+    return run
+
+
+def bench_trackline_parse(data: BenchmarkData) -> Callable[[], int]:
+    def run() -> int:
+        parser = TracklinesParser()
+        parser.date_format = TRACKLINES_DATE_FORMAT
+        tracklines = parser.read(data.tracklines_file)
+        return sum(len(tl.points) for tl in tracklines)
+    return run
+
+
+def bench_trackline_interpolate(data: BenchmarkData) -> Callable[[], int]:
+    parser = TracklinesParser()
+    parser.date_format = TRACKLINES_DATE_FORMAT
+    tracklines = parser.read(data.tracklines_file)
+    rng = random.Random(1)
+    duration = data.trackline_points - 1
+    times = [
+        START + timedelta(seconds=rng.uniform(0, duration))
+        for _ in range(data.interpolations)
+    ]
+
+    def run() -> int:
+        index = TracklineIndex(tracklines)
+        for timestamp in times:
+            index.get_lerp_point(timestamp)
+        return len(times)
+    return run
+
+
+def bench_caris_write(data: BenchmarkData) -> Callable[[], int]:
+    parser = CarisSvpParser()
+    svps = [svp for path in data.caris_paths for svp in parser.read_many(path)]
+    output = data.output_folder / 'caris_write.txt'
+
+    def run() -> int:
+        CarisSvpParser().write_many(output, svps)
+        return len(svps)
+    return run
+
+
+def bench_merge_caris(data: BenchmarkData) -> Callable[[], int]:
+    output = data.output_folder / 'merge_caris.txt'
+
+    def run() -> int:
+        with output.open('w') as f:
+            merge_caris_svp_process(data.caris_folder, f, False)
+        return len(data.caris_paths) * data.caris_profiles_per_file
+    return run
+
+
+def bench_synthetic(data: BenchmarkData) -> Callable[[], int]:
+    output = data.output_folder / 'synthetic.txt'
+    time_gap = data.trackline_hours / data.synthetic_svps
+
+    def run() -> int:
+        with stub_atlas(), output.open('w') as f:
+            synthetic_svp_process(
+                tracklines=[data.tracklines_file],
+                output=f,
+                time_gap=time_gap,
+                generate_summary=True,
+                date_format=TRACKLINES_DATE_FORMAT,
+                persistent_cache_size=0
+            )
+        return data.synthetic_svps
+    return run
+
+
+BENCHMARKS: Dict[str, Callable[[BenchmarkData], Callable[[], int]]] = {
+    'caris-parse': bench_caris_parse,
+    'l0-parse': bench_l0_parse,
+    'dedup-grouping': bench_dedup_grouping,
+    'trackline-parse': bench_trackline_parse,
+    'trackline-interpolate': bench_trackline_interpolate,
+    'caris-write': bench_caris_write,
+    'merge-caris-svp': bench_merge_caris,
+    'synthetic-svp': bench_synthetic,
+}
+
+
+def run_benchmark(run: Callable[[], int], repeat: int) -> Dict:
+    """ Times `run` `repeat` times, then runs it once more with tracemalloc
+    to measure its peak memory use (tracemalloc slows it down, so this run
+    isn't timed). Output printed by the pipelines is discarded.
+    """
+    wall = []
+    cpu = []
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            items = run()
+            cpu.append(time.process_time() - cpu_start)
+            wall.append(time.perf_counter() - wall_start)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    median = statistics.median(wall)
+    return {
+        'items': items,
+        'wall_min': min(wall),
+        'wall_median': median,
+        'cpu_median': statistics.median(cpu),
+        'items_per_second': items / median if median > 0 else None,
+        'peak_memory': peak_memory,
+    }
+
+
+def get_commit() -> str:
+    """ Gets the git commit of the checkout being benchmarked, if known"""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group()
+def cli():
+    pass
+
+
+@click.command()
+@click.option(
+    '-o', '--output',
+    type=click.File('w'),
+    default='-',
+    help="Output location for the JSON results. Defaults to stdout."
+)
+@click.option(
+    '-r', '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help="Number of times each benchmark is timed. Defaults to 3"
+)
+@click.option(
+    '-s', '--scale',
+    default=1.0,
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Multiplies the size of the generated test data, use a smaller value "
+        "for a quick run. Defaults to 1"
+    )
+)
+@click.option(
+    '-b', '--benchmark',
+    'names',
+    multiple=True,
+    type=click.Choice(list(BENCHMARKS)),
+    help="Benchmark to run, may be given multiple times. Defaults to all"
+)
+def run(output, repeat, scale, names):
+    """ Runs the pipeline benchmarks """
+    names = list(names) if len(names) > 0 else list(BENCHMARKS)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='mergesvp-bench-') as folder:
+        click.echo("Generating test data", err=True)
+        data = BenchmarkData(Path(folder), scale)
+        for name in names:
+            result = {
+                'name': name,
+                **run_benchmark(BENCHMARKS[name](data), repeat)
+            }
+            results.append(result)
+            click.echo(
+                f"{name:<22} {result['wall_median']:8.3f} s "
+                f"{result['peak_memory'] / 1024 / 1024:8.1f} MB",
+                err=True
+            )
+
+    json.dump(
+        {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'scale': scale,
+            'results': results,
+        },
+        output,
+        indent=4
+    )
+    output.write('\n')
+
+
+@click.command()
+@click.argument('base', type=click.File('r'))
+@click.argument('new', type=click.File('r'))
+@click.option(
+    '-t', '--threshold',
+    default=None,
+    type=click.FloatRange(min=0),
+    help=(
+        "Exit with an error if the median time of any benchmark increased by "
+        "more than this fraction (eg; 0.1 for 10%)"
+    )
+)
+def compare(base, new, threshold):
+    """ Compares the results of two benchmark runs """
+    base_results = json.load(base)
+    new_results = json.load(new)
+    if base_results['scale'] != new_results['scale']:
+        click.echo(
+            "Warning: results were generated at different scales", err=True)
+
+    base_by_name = {r['name']: r for r in base_results['results']}
+    click.echo(
+        f"{'benchmark':<22} {'base (s)':>10} {'new (s)':>10} {'change':>8} "
+        f"{'base (MB)':>10} {'new (MB)':>10}"
+    )
+    slower = []
+    for result in new_results['results']:
+        base_result = base_by_name.get(result['name'])
+        if base_result is None:
+            continue
+        change = result['wall_median'] / base_result['wall_median'] - 1
+        click.echo(
+            f"{result['name']:<22} "
+            f"{base_result['wall_median']:10.3f} "
+            f"{result['wall_median']:10.3f} "
+            f"{change:+8.1%} "
+            f"{base_result['peak_memory'] / 1024 / 1024:10.1f} "
+            f"{result['peak_memory'] / 1024 / 1024:10.1f}"
+        )
+        if threshold is not None and change > threshold:
+            slower.append(result['name'])
+
+    if len(slower) > 0:
+        raise click.ClickException(
+            f"Slower by more than {threshold:.0%}: {', '.join(slower)}")
+
+
+cli.add_command(run)
+cli.add_command(compare)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,105 @@
+""" Measures the startup time of each mergesvp command. Each command is run
+with `--help` several times in a new Python process, and the timings are
+written to a JSON file so they can be compared between versions.
+
+    python benchmarks/startup.py -o startup.json
+"""
+from pathlib import Path
+from typing import Dict, List
+import click
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    [],
+    ['merge-raw-svp'],
+    ['merge-caris-svp'],
+    ['supplement-svp'],
+    ['synthetic-svp'],
+    ['cache', 'stats'],
+]
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def time_command(command: List[str], repeat: int) -> Dict:
+    """ Runs `mergesvp <command> --help` `repeat` times, returns the timings
+    (seconds)"""
+    args = [sys.executable, '-m', 'mergesvp.mergesvp'] + command + ['--help']
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            args,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True
+        )
+        timings.append(time.perf_counter() - start)
+    return {
+        'command': ' '.join(command) if len(command) > 0 else '(none)',
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+    }
+
+
+@click.command()
+@click.option(
+    '-o', '--output',
+    type=click.File('w'),
+    default='-',
+    help="Output location for the JSON results. Defaults to stdout."
+)
+@click.option(
+    '-r', '--repeat',
+    default=5,
+    type=click.IntRange(min=1),
+    help="Number of times each command is run. Defaults to 5"
+)
+@click.option(
+    '-m', '--max-time',
+    default=None,
+    type=float,
+    help=(
+        "Exit with an error if the median startup time (seconds) of any "
+        "command exceeds this value"
+    )
+)
+def startup(output, repeat, max_time):
+    """ Measures the startup time of each mergesvp command """
+    results = []
+    for command in COMMANDS:
+        result = time_command(command, repeat)
+        results.append(result)
+        click.echo(
+            f"{result['command']:<20} {result['median'] * 1000:8.1f} ms",
+            err=True
+        )
+
+    json.dump(
+        {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'results': results,
+        },
+        output,
+        indent=4
+    )
+    output.write('\n')
+
+    if max_time is not None:
+        slow = [r['command'] for r in results if r['median'] > max_time]
+        if len(slow) > 0:
+            raise click.ClickException(
+                f"Startup time exceeded {max_time}s: {', '.join(slow)}")
+
+
+if __name__ == '__main__':
+    startup()
@@ -0,0 +1,139 @@
+""" Code for extracting the region of the World Ocean Atlas covered by a
+tracklines dataset. Synthetic SVPs can then be generated from this extract,
+without the full atlas or network access.
+"""
+
+import click
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from mergesvp.lib.atlasgrid import \
+    SEARCH_RADIUS, \
+    get_region, \
+    load_woa18_region
+from mergesvp.lib.errors import SvpMissingDataException
+from mergesvp.lib.ssminterface import \
+    WOA18_GRID_STEP, \
+    get_atlas_cell, \
+    get_ssm_atlas
+from mergesvp.lib.tracklinecache import load_tracklines_files
+
+
+def get_months(start: datetime, end: datetime) -> List[int]:
+    """ Gets the months (1-12) between the start and end dates"""
+    months = set()
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month) and len(months) < 12:
+        months.add(month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return sorted(months)
+
+
+class AtlasExtractProcessor:
+    """ Extracts the atlas grid for the bounding box of the tracklines, and
+    the months they cover, into an atlas extract file.
+    """
+
+    def __init__(
+            self,
+            tracklines_input: List[Path],
+            output: Path,
+            date_format: str = r'%d/%m/%y',
+            padding: float = 1.0,
+            all_months: bool = False,
+            use_trackline_cache: bool = False,
+            jobs: int = 1) -> None:
+        self.tracklines_input = tracklines_input
+        self.output = output
+        self.date_format = date_format
+        # distance (degrees) the extract extends beyond the tracklines
+        self.padding = padding
+        # include every month, not just those covered by the tracklines
+        self.all_months = all_months
+        self.use_trackline_cache = use_trackline_cache
+        self.jobs = jobs
+
+    def process(self):
+        tracklines = load_tracklines_files(
+            self.tracklines_input,
+            self.date_format,
+            use_cache=self.use_trackline_cache,
+            jobs=self.jobs
+        )
+        tracklines = [tl for tl in tracklines if len(tl.points) != 0]
+        if len(tracklines) == 0:
+            raise SvpMissingDataException("No trackline points were found")
+
+        start = min(tl.start for tl in tracklines)
+        end = max(tl.points[-1].timestamp for tl in tracklines)
+        # all columns are used, rather than the minimum and maximum
+        # longitude, so that surveys crossing the antimeridian are handled
+        cells = set(
+            get_atlas_cell(pt.latitude, pt.longitude, start)[:2]
+            for tl in tracklines
+            for pt in tl.points
+        )
+        # always include the cells that may be searched when a cell has
+        # no data
+        padding = max(math.ceil(self.padding / WOA18_GRID_STEP), SEARCH_RADIUS)
+        lat_range, lon_range = get_region(
+            [cell[0] for cell in cells],
+            [cell[1] for cell in cells],
+            padding
+        )
+        months = list(range(1, 13)) if self.all_months \
+            else get_months(start, end)
+
+        # make sure the atlas is present, this may download it
+        atlas = get_ssm_atlas()
+        grid = load_woa18_region(
+            atlas.data_folder, lat_range, lon_range, months)
+        grid.save(self.output)
+
+        size_mb = self.output.stat().st_size / 1024 / 1024
+        click.echo(
+            f"Extracted {grid.shape[0]} x {grid.shape[1]} grid cells for "
+            f"months {', '.join(str(m) for m in months)} "
+            f"to {self.output} ({size_mb:.2f} MB)"
+        )
+
+
+def atlas_extract_process(
+        tracklines: List[Path],
+        output: Path,
+        date_format: str = r'%d/%m/%y',
+        padding: float = 1.0,
+        all_months: bool = False,
+        use_trackline_cache: bool = False,
+        jobs: int = 1) -> None:
+    """
+    Main entry point for extracting the region of the World Ocean Atlas
+    covered by a tracklines dataset into an atlas extract file.
+
+    Args:
+        tracklines: Paths to CSV files including trackline data
+        output: location of the atlas extract file
+        date_format: python format string to parse date (eg '%d/%m/%y')
+        padding: distance (degrees) the extract extends beyond the
+            tracklines
+        all_months: include all months rather than only those covered by
+            the tracklines
+        use_trackline_cache: cache the parsed tracklines in a binary file
+            alongside the tracklines file, and use it in later runs
+        jobs: number of worker processes used, 0 uses all available CPUs
+
+    Returns:
+        None
+    """
+    processor = AtlasExtractProcessor(
+        tracklines_input=tracklines,
+        output=output,
+        date_format=date_format,
+        padding=padding,
+        all_months=all_months,
+        use_trackline_cache=use_trackline_cache,
+        jobs=jobs
+    )
+    processor.process()
@@ -0,0 +1,433 @@
+"""
+Batch generation of synthetic SVPs from the World Ocean Atlas 2018 (WOA18)
+temperature and salinity grids. Rather than querying the atlas through SSM
+one position at a time, the region of the grid covering all positions is read
+once and the sound speed profiles of all positions are calculated together.
+
+A region of the grid can also be saved to a compact atlas extract file, so
+that synthetic SVPs can be generated without the full atlas.
+
+Requires numpy and gsw, and netCDF4 to read the WOA18 files (all
+dependencies of SSM).
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+from mergesvp.lib.ssminterface import \
+    WOA18_GRID_LAT_0, \
+    WOA18_GRID_LON_0, \
+    WOA18_GRID_STEP
+
+# grid cells are identified by their latitude and longitude index within
+# the global WOA18 quarter degree grid, see `ssminterface.get_atlas_cell`
+WOA18_GRID_ROWS = 720
+WOA18_GRID_COLUMNS = 1440
+
+EXTRACT_MAGIC = b'MSVPATL1'
+
+# if a grid cell has no data (eg; it is land) the nearest cell with data
+# within this many cells is used
+SEARCH_RADIUS = 2
+
+
+def _season(month: int) -> int:
+    """ Gets the WOA18 time period of the season that includes the month.
+    Seasons are 13 (Jan-Mar), 14 (Apr-Jun), 15 (Jul-Sep) and 16 (Oct-Dec)
+    """
+    return 13 + (month - 1) // 3
+
+
+def sound_speed(
+        depths: np.ndarray,
+        temperature: np.ndarray,
+        salinity: np.ndarray,
+        latitudes: np.ndarray,
+        longitudes: np.ndarray) -> np.ndarray:
+    """ Calculates the sound speed (TEOS-10) of each depth (rows) for many
+    locations (columns). Temperature (in-situ, degrees C) and salinity
+    (practical salinity) arrays are indexed by [depth, location].
+    """
+    import gsw
+
+    latitudes = latitudes[np.newaxis, :]
+    longitudes = longitudes[np.newaxis, :]
+    pressure = gsw.p_from_z(-depths[:, np.newaxis], latitudes)
+    absolute_salinity = gsw.SA_from_SP(
+        salinity, pressure, longitudes, latitudes)
+    conservative_temperature = gsw.CT_from_t(
+        absolute_salinity, temperature, pressure)
+    return gsw.sound_speed(
+        absolute_salinity, conservative_temperature, pressure)
+
+
+class AtlasGrid:
+    """ Temperature and salinity for a rectangular region of the WOA18 grid,
+    for one or more months. Arrays are indexed by [depth, row, column] and
+    use NaN where there is no data. `lat_idx0` and `lon_idx0` are the global
+    grid indexes of the first row and column. Columns wrap around at the
+    antimeridian, so a region may continue past the last global column.
+    """
+
+    def __init__(
+            self,
+            lat_idx0: int,
+            lon_idx0: int,
+            depths: Dict[int, np.ndarray],
+            temperature: Dict[int, np.ndarray],
+            salinity: Dict[int, np.ndarray]) -> None:
+        self.lat_idx0 = lat_idx0
+        self.lon_idx0 = lon_idx0
+        # all keyed by month
+        self.depths = depths
+        self.temperature = temperature
+        self.salinity = salinity
+
+    @property
+    def months(self) -> List[int]:
+        return sorted(self.depths.keys())
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """ Number of rows (latitudes) and columns (longitudes)"""
+        grid = next(iter(self.temperature.values()))
+        return grid.shape[1:]
+
+    def save(self, filename: Path) -> None:
+        """ Saves the grid to an atlas extract file, see `load_atlas_extract`
+        """
+        header = json.dumps({
+            'lat_idx0': self.lat_idx0,
+            'lon_idx0': self.lon_idx0,
+            'shape': list(self.shape),
+            'months': [
+                {'month': month, 'depths': self.depths[month].tolist()}
+                for month in self.months
+            ],
+        }).encode('utf-8')
+        header_end = len(EXTRACT_MAGIC) + 4 + len(header)
+        padding = b'\0' * (-header_end % 8)
+
+        tmp_file = filename.with_name(filename.name + '.tmp')
+        with tmp_file.open('wb') as f:
+            f.write(EXTRACT_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(padding)
+            for month in self.months:
+                for values in (self.temperature[month], self.salinity[month]):
+                    f.write(values.astype('<f4').tobytes())
+        os.replace(tmp_file, filename)
+
+    def _find_cell(
+            self,
+            has_data: np.ndarray,
+            lat_idx: int,
+            lon_idx: int) -> Tuple[int, int]:
+        """ Gets the local row and column for a global grid cell. If this
+        cell has no data the nearest cell (within the search radius) that
+        does is used. Returns None if there is no data nearby.
+        """
+        rows, columns = has_data.shape
+        # the grid may cross the antimeridian, so columns wrap around
+        wraps = columns == WOA18_GRID_COLUMNS
+        row = lat_idx - self.lat_idx0
+        column = (lon_idx - self.lon_idx0) % WOA18_GRID_COLUMNS
+        if 0 <= row < rows and column < columns and has_data[row, column]:
+            return (row, column)
+
+        nearest = None
+        nearest_dist = None
+        for i in range(row - SEARCH_RADIUS, row + SEARCH_RADIUS + 1):
+            for j in range(column - SEARCH_RADIUS, column + SEARCH_RADIUS + 1):
+                local_j = j % WOA18_GRID_COLUMNS if wraps else j
+                if not (
+                        0 <= i < rows and
+                        0 <= local_j < columns and
+                        has_data[i, local_j]):
+                    continue
+                dist = (i - row) ** 2 + (j - column) ** 2
+                if nearest is None or dist < nearest_dist:
+                    nearest = (i, local_j)
+                    nearest_dist = dist
+        return nearest
+
+    def profiles(
+            self,
+            cells: Iterable[Tuple[int, int, int]]
+            ) -> List[List[Tuple[float, float]]]:
+        """ Gets the depth/speed profile for each grid cell (latitude index,
+        longitude index, and month; see `ssminterface.get_atlas_cell`).
+        Profiles of all cells within the same month are calculated together.
+        None is returned for cells that have no data.
+        """
+        cells = list(cells)
+        results = [None] * len(cells)
+
+        for month in set(cell[2] for cell in cells):
+            if month not in self.depths:
+                continue
+            temperature = self.temperature[month]
+            salinity = self.salinity[month]
+            depths = self.depths[month]
+            # only cells with surface data are valid
+            has_data = ~(np.isnan(temperature[0]) | np.isnan(salinity[0]))
+
+            indexes = []
+            rows = []
+            columns = []
+            for (i, (lat_idx, lon_idx, cell_month)) in enumerate(cells):
+                if cell_month != month:
+                    continue
+                local_cell = self._find_cell(has_data, lat_idx, lon_idx)
+                if local_cell is None:
+                    continue
+                indexes.append(i)
+                rows.append(local_cell[0])
+                columns.append(local_cell[1])
+            if len(indexes) == 0:
+                continue
+
+            rows = np.array(rows)
+            columns = np.array(columns)
+            latitudes = WOA18_GRID_LAT_0 + \
+                (rows + self.lat_idx0) * WOA18_GRID_STEP
+            longitudes = WOA18_GRID_LON_0 + \
+                ((columns + self.lon_idx0) % WOA18_GRID_COLUMNS) * \
+                WOA18_GRID_STEP
+            speeds = sound_speed(
+                depths,
+                temperature[:, rows, columns].astype(np.float64),
+                salinity[:, rows, columns].astype(np.float64),
+                latitudes,
+                longitudes
+            )
+
+            # each profile ends at the first depth without data (the seafloor)
+            valid = ~np.isnan(speeds)
+            num_samples = np.cumprod(valid, axis=0).sum(axis=0)
+            for (k, i) in enumerate(indexes):
+                n = num_samples[k]
+                results[i] = list(zip(
+                    depths[:n].tolist(),
+                    speeds[:n, k].tolist()
+                ))
+
+        return results
+
+
+def load_atlas_extract(filename: Path) -> AtlasGrid:
+    """ Loads an atlas extract file written by `AtlasGrid.save`. The grids
+    are memory mapped, so only the parts of the file that are used are read.
+
+    The file includes an 8 byte magic string, the 4 byte (little endian)
+    length of the JSON header, the JSON header (grid location, shape, and
+    the depths of each month), padding to an 8 byte boundary, and then the
+    temperature and salinity float32 arrays of each month.
+    """
+    with filename.open('rb') as f:
+        if f.read(len(EXTRACT_MAGIC)) != EXTRACT_MAGIC:
+            raise SyntheticSvpGenerationException(
+                f"{filename} is not an atlas extract file")
+        header_len = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+    offset = len(EXTRACT_MAGIC) + 4 + header_len
+    offset += -offset % 8
+    rows, columns = header['shape']
+
+    depths = {}
+    temperature = {}
+    salinity = {}
+    for month_header in header['months']:
+        month = month_header['month']
+        depths[month] = np.array(month_header['depths'], dtype=np.float64)
+        shape = (len(depths[month]), rows, columns)
+        size = shape[0] * rows * columns * 4
+        temperature[month] = np.memmap(
+            filename, dtype='<f4', mode='r', offset=offset, shape=shape)
+        salinity[month] = np.memmap(
+            filename, dtype='<f4', mode='r', offset=offset + size, shape=shape)
+        offset += 2 * size
+
+    return AtlasGrid(
+        lat_idx0=header['lat_idx0'],
+        lon_idx0=header['lon_idx0'],
+        depths=depths,
+        temperature=temperature,
+        salinity=salinity
+    )
+
+
+def find_woa18_files(data_folder: Path) -> Dict[Tuple[str, int], Path]:
+    """ Finds the WOA18 quarter degree netCDF files within the data folder
+    (or any of its subfolders). Files are keyed by variable ('t' for
+    temperature, 's' for salinity) and time period (1-12 are months, 13-16
+    are seasons).
+    """
+    files = {}
+    pattern = os.path.join(str(data_folder), '**', 'woa18_*_04.nc')
+    for filename in glob.glob(pattern, recursive=True):
+        # eg; woa18_decav_t01_04.nc
+        code = Path(filename).stem.split('_')[-2]
+        if len(code) != 3 or code[0] not in 'ts' or not code[1:].isdigit():
+            continue
+        files[(code[0], int(code[1:]))] = Path(filename)
+    return files
+
+
+def _read_woa18_variable(
+        filename: Path,
+        variable: str,
+        lat_range: Tuple[int, int],
+        lon_range: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """ Reads the depths and values of a variable (eg; 't_an') for the range
+    of global grid rows and columns from a WOA18 netCDF file. The end of the
+    column range may be past the last column of the grid if the region
+    crosses the antimeridian, the columns then continue from the first
+    column of the grid.
+    """
+    import netCDF4
+
+    if lon_range[1] > WOA18_GRID_COLUMNS:
+        lon_ranges = [
+            (lon_range[0], WOA18_GRID_COLUMNS),
+            (0, lon_range[1] - WOA18_GRID_COLUMNS)
+        ]
+    else:
+        lon_ranges = [lon_range]
+
+    with netCDF4.Dataset(str(filename)) as dataset:
+        # files may not cover the whole globe, so work out where they start
+        lats = dataset.variables['lat']
+        lons = dataset.variables['lon']
+        row0 = int(round((float(lats[0]) - WOA18_GRID_LAT_0) / WOA18_GRID_STEP))
+        col0 = int(round((float(lons[0]) - WOA18_GRID_LON_0) / WOA18_GRID_STEP))
+        if lat_range[0] < row0 or lat_range[1] - row0 > len(lats) or any(
+                start < col0 or end - col0 > len(lons)
+                for (start, end) in lon_ranges):
+            raise SyntheticSvpGenerationException(
+                f"WOA18 file {filename} does not cover the survey area")
+
+        depths = np.asarray(dataset.variables['depth'][:], dtype=np.float64)
+        values = np.concatenate([
+            dataset.variables[variable][
+                0,
+                :,
+                lat_range[0] - row0:lat_range[1] - row0,
+                start - col0:end - col0
+            ]
+            for (start, end) in lon_ranges
+        ], axis=-1)
+        values = np.ma.filled(values.astype(np.float32), np.nan)
+    return (depths, values)
+
+
+def load_woa18_region(
+        data_folder: Path,
+        lat_range: Tuple[int, int],
+        lon_range: Tuple[int, int],
+        months: Iterable[int]) -> AtlasGrid:
+    """ Loads a region of the WOA18 grid (range of global grid rows and
+    columns, end exclusive) for each of the months. Monthly data only extends
+    to 1500m, so each month is extended with deeper data from its season
+    where available.
+    """
+    files = find_woa18_files(data_folder)
+    if len(files) == 0:
+        raise SyntheticSvpGenerationException(
+            f"No WOA18 files were found in {data_folder}")
+
+    depths = {}
+    temperature = {}
+    salinity = {}
+    for month in sorted(set(months)):
+        month_data = []
+        for (code, variable) in (('t', 't_an'), ('s', 's_an')):
+            if (code, month) not in files:
+                raise SyntheticSvpGenerationException(
+                    f"WOA18 data for month {month} was not found in "
+                    f"{data_folder}")
+            month_depths, values = _read_woa18_variable(
+                files[(code, month)], variable, lat_range, lon_range)
+
+            season_file = files.get((code, _season(month)))
+            if season_file is not None:
+                season_depths, season_values = _read_woa18_variable(
+                    season_file, variable, lat_range, lon_range)
+                deeper = season_depths > month_depths[-1]
+                month_depths = np.concatenate(
+                    (month_depths, season_depths[deeper]))
+                values = np.concatenate((values, season_values[deeper]))
+            month_data.append((month_depths, values))
+
+        depths[month] = month_data[0][0]
+        temperature[month] = month_data[0][1]
+        salinity[month] = month_data[1][1]
+
+    return AtlasGrid(
+        lat_idx0=lat_range[0],
+        lon_idx0=lon_range[0],
+        depths=depths,
+        temperature=temperature,
+        salinity=salinity
+    )
+
+
+def get_region(
+        lat_idxs: Iterable[int],
+        lon_idxs: Iterable[int],
+        padding: int = SEARCH_RADIUS) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """ Gets the range of global grid rows and columns (end exclusive) that
+    covers all the grid cells, plus `padding` cells on each side.
+
+    Columns wrap around at the antimeridian, so the column range is the
+    smallest range that covers all the columns. If this range crosses the
+    antimeridian its end is past the last column of the grid (eg; (1430,
+    1450) covers columns 1430 to 1439 and 0 to 9).
+    """
+    lat_idxs = list(lat_idxs)
+    lon_idxs = sorted(set(idx % WOA18_GRID_COLUMNS for idx in lon_idxs))
+    lat_range = (
+        max(min(lat_idxs) - padding, 0),
+        min(max(lat_idxs) + padding + 1, WOA18_GRID_ROWS)
+    )
+
+    # the range starts after the largest gap between the columns
+    gaps = [
+        (lon_idxs[(i + 1) % len(lon_idxs)] - lon_idx) % WOA18_GRID_COLUMNS
+        for (i, lon_idx) in enumerate(lon_idxs)
+    ]
+    largest = max(range(len(gaps)), key=lambda i: gaps[i])
+    start = lon_idxs[(largest + 1) % len(lon_idxs)]
+    width = WOA18_GRID_COLUMNS - gaps[largest] + 1 if len(lon_idxs) > 1 else 1
+    width += 2 * padding
+    if width >= WOA18_GRID_COLUMNS:
+        lon_range = (0, WOA18_GRID_COLUMNS)
+    else:
+        start = (start - padding) % WOA18_GRID_COLUMNS
+        lon_range = (start, start + width)
+    return (lat_range, lon_range)
+
+
+def load_woa18_grid(
+        data_folder: Path,
+        cells: Iterable[Tuple[int, int, int]]) -> AtlasGrid:
+    """ Loads the region of the WOA18 grid needed to generate profiles for the
+    grid cells (latitude index, longitude index, month).
+    """
+    cells = list(cells)
+    if len(cells) == 0:
+        raise SyntheticSvpGenerationException("No grid cells to load")
+
+    # include the cells that may be searched when a cell has no data
+    lat_range, lon_range = get_region(
+        [c[0] for c in cells], [c[1] for c in cells])
+    return load_woa18_region(
+        data_folder, lat_range, lon_range, [c[2] for c in cells])
@@ -6,8 +6,12 @@ import os
 from pathlib import Path
 from typing import List, TextIO, Tuple
 
+from mergesvp.lib.compression import open_file, strip_compression_suffix
+from mergesvp.lib.outputs import CarisSink, SvpSink, write_outputs
 from mergesvp.lib.svpprofile import SvpProfile
 from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.metrics import add_files_read, add_metric
+from mergesvp.lib.profiling import stage
 from mergesvp.lib.utils import format_timedelta, sort_svp_list
 
 
@@ -18,7 +22,12 @@ def _filter_folder(path: Path, filter:str) -> bool:
 
 
 def find_svp_files(current_path: Path, folder_filter: str) -> List[Path]:
-    svp_paths = current_path.glob("**/svp")
+    # svp files may also be compressed (eg; svp.gz)
+    svp_paths = (
+        svp_path
+        for svp_path in current_path.glob("**/svp*")
+        if strip_compression_suffix(svp_path.name) == 'svp'
+    )
     # glob returns a generator, convert this to a list as it will allow
     # us to better display progress (we'll know its length)
     svp_path_list =  list(svp_paths)
@@ -97,17 +106,43 @@ def group_by_depth_speed(svps: List[SvpProfile]) -> List[List[SvpProfile]]:
     return svp_groups
 
 
+GROUP_SUMMARY_HEADER = "Group number, SVP filename, Timestamp\n"
+DT_SUMMARY_HEADER = "Timestamp, delta time, SVP filename and timestamp\n"
+
+
+def _format_group_summary(i: int, svp_group: List[SvpProfile]) -> str:
+    """ Formats the grouping summary lines of a single group"""
+    lines = []
+    for svp in svp_group:
+        ts = svp.timestamp.strftime('%Y/%m/%d %H:%M:%S')
+        lines.append(f"{i}, {svp.filename}, {ts}\n")
+    return ''.join(lines)
+
+
+def _format_dt_summary(svp: SvpProfile, last_svp: SvpProfile) -> str:
+    """ Formats the time summary line of a SVP, `last_svp` is the SVP before
+    it (if any)"""
+    fn_ts = svp.timestamp.strftime('%Y%m%d_%H%M%S')
+    svp_fn_ts = f'{svp.filename}_{fn_ts}'
+
+    dt = "n/a"
+    if last_svp is not None:
+        delta_time = svp.timestamp - last_svp.timestamp
+        dt = format_timedelta(delta_time)
+
+    ts = svp.timestamp.strftime('%Y/%m/%d %H:%M:%S')
+
+    return f"{ts}, {dt}, {svp_fn_ts}\n"
+
+
 def write_grouping_summary_data(
     svp_groups: List[List[SvpProfile]], output: TextIO) -> None:
     """ Writes grouping and filename information to a CSV file. Includes all
     file names, and what group they belong to
     """
-    output.write("Group number, SVP filename, Timestamp\n")
+    output.write(GROUP_SUMMARY_HEADER)
     for (i, svp_group) in enumerate(svp_groups):
-        for svp in svp_group:
-            ts = svp.timestamp.strftime('%Y/%m/%d %H:%M:%S')
-            txt = f"{i}, {svp.filename}, {ts}\n"
-            output.write(txt)
+        output.write(_format_group_summary(i, svp_group))
 
 
 def write_dt_summary_data(
@@ -115,58 +150,109 @@ def write_dt_summary_data(
     """ Writes CSV file containing the filename (with timestamp suffix) and
     the time stamp of each SVP
     """
-    output.write("Timestamp, delta time, SVP filename and timestamp\n")
+    output.write(DT_SUMMARY_HEADER)
     last_svp = None
     for svp in svps:
+        output.write(_format_dt_summary(svp, last_svp))
+        last_svp = svp
 
-        fn_ts = svp.timestamp.strftime('%Y%m%d_%H%M%S')
-        svp_fn_ts = f'{svp.filename}_{fn_ts}'
 
-        dt = "n/a"
-        if last_svp is not None:
-            delta_time = svp.timestamp - last_svp.timestamp
-            dt = format_timedelta(delta_time)
+class GroupSummarySink(SvpSink):
+    """ Writes the grouping summary CSV file (see
+    `write_grouping_summary_data`) as the unique SVPs are written. Each SVP
+    written must be the first SVP of one of `svp_groups`, and all the SVPs of
+    its group are included.
+    """
 
-        ts = svp.timestamp.strftime('%Y/%m/%d %H:%M:%S')
+    def __init__(self, path: Path, svp_groups: List[List[SvpProfile]]) -> None:
+        self.path = path
+        # group number and group, keyed by the first SVP of each group
+        self._groups = {
+            id(svp_group[0]): (i, svp_group)
+            for (i, svp_group) in enumerate(svp_groups)
+        }
+        self._output = None
 
-        txt = f"{ts}, {dt}, {svp_fn_ts}\n"
-        output.write(txt)
+    def open(self) -> None:
+        self._output = open_file(self.path, 'w')
+        self._output.write(GROUP_SUMMARY_HEADER)
 
-        last_svp = svp
+    def write(self, svp: SvpProfile) -> None:
+        (i, svp_group) = self._groups[id(svp)]
+        self._output.write(_format_group_summary(i, svp_group))
+
+    def close(self, flush: bool = True) -> None:
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+
+
+class TimeSummarySink(SvpSink):
+    """ Writes the time summary CSV file (see `write_dt_summary_data`)"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._output = None
+        self._last_svp = None
+
+    def open(self) -> None:
+        self._output = open_file(self.path, 'w')
+        self._output.write(DT_SUMMARY_HEADER)
+        self._last_svp = None
+
+    def write(self, svp: SvpProfile) -> None:
+        self._output.write(_format_dt_summary(svp, self._last_svp))
+        self._last_svp = svp
+
+    def close(self, flush: bool = True) -> None:
+        if self._output is not None:
+            self._output.close()
+            self._output = None
 
 
 def merge_caris_svp_process(
         path: Path,
         output: TextIO,
         fail_on_error: bool,
-        folder_filter: str = None) -> None:
+        folder_filter: str = None,
+        jobs: int = 1) -> None:
     
-    svp_paths = find_svp_files(path, folder_filter)
-    svps = load_svps(svp_paths, fail_on_error)
-
-    svps_sorted = sort_svp_list(svps)
-
-    # group all the svps that have the same depth vs speed data
-    svp_groups = group_by_depth_speed(svps_sorted)
+    with stage('discover SVP files') as discover_stage:
+        svp_paths = find_svp_files(path, folder_filter)
+        discover_stage.items += len(svp_paths)
+    add_metric('files_discovered', len(svp_paths))
+    with stage('parse SVP files') as parse_stage:
+        svps = load_svps(svp_paths, fail_on_error)
+        parse_stage.items += len(svps)
+    add_files_read(svp_paths)
+    add_metric('profiles_parsed', len(svps))
+
+    with stage('group duplicate SVPs') as group_stage:
+        svps_sorted = sort_svp_list(svps)
+
+        # group all the svps that have the same depth vs speed data
+        svp_groups = group_by_depth_speed(svps_sorted)
+        group_stage.items += len(svps_sorted)
 
     # we can include only one of each SVP is we get the first SVP from each
     # group of SVPs. Each group of SVPs share the same depth vs speed data, but
     # may have a different time/location/filename
     svp_no_dups = [svp_group[0] for svp_group in svp_groups]
-
-    # now write output file
-    writer = CarisSvpParser()
-    writer.show_progress = True
-    output_path = Path(os.path.realpath(output.name))
-    writer.write_many(output_path, svp_no_dups)
-
-    summary_group_file = output.name + '_group_summary.csv'
-    with open(summary_group_file, 'w') as summary_group_output:
-        write_grouping_summary_data(svp_groups, summary_group_output)
-
-    summary_dt_file = output.name + '_time_summary.csv'
-    with open(summary_dt_file, 'w') as summary_group_output:
-        write_dt_summary_data(svp_no_dups, summary_group_output)
+    add_metric('duplicates_removed', len(svps) - len(svp_no_dups))
+
+    # now write output file, and the summary files in the same pass
+    with stage('write output') as write_stage:
+        output_path = Path(os.path.realpath(output.name))
+        sinks = [
+            CarisSink(output_path, jobs),
+            GroupSummarySink(
+                output.name + '_group_summary.csv', svp_groups),
+            TimeSummarySink(output.name + '_time_summary.csv'),
+        ]
+        with click.progressbar(
+                svp_no_dups, label="Writing merged SVP file") as svps_iter:
+            write_stage.items += write_outputs(svps_iter, sinks)
+    add_metric('profiles_written', len(svp_no_dups))
 
     # print some summary info to StdOut
     click.echo(f"{len(svp_paths)} SVP files were found in folder structure")
@@ -0,0 +1,181 @@
+"""
+Checkpoint files for long running synthetic SVP processes. Each synthetic
+profile is appended to a checkpoint file alongside the output as soon as it
+has been generated. If the process fails it can be resumed, and the profiles
+already in the checkpoint are reused rather than generated again. The
+checkpoint is removed once the output has been written.
+
+Checkpoint files are JSON lines. The first line records the settings used to
+generate the profiles, each following line is one synthetic profile.
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+import click
+import json
+
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+
+CHECKPOINT_SUFFIX = '_checkpoint.jsonl'
+CHECKPOINT_VERSION = 1
+
+
+def get_checkpoint_path(output: Path) -> Path:
+    return Path(str(output) + CHECKPOINT_SUFFIX)
+
+
+class SvpCheckpoint:
+    """ Journals synthetic profiles to a checkpoint file. `settings` are the
+    process settings that affect the generated profiles, a checkpoint is only
+    resumed if it was written with the same settings.
+
+    Used as a context manager; the checkpoint file is removed if the body
+    completes without an exception, and kept otherwise so that the process
+    can be resumed.
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            settings: Dict,
+            resume: bool = False) -> None:
+        self.path = path
+        self.settings = {'version': CHECKPOINT_VERSION, **settings}
+        self.resume = resume
+        # (latitude, longitude, profile) loaded from an existing checkpoint,
+        # keyed by timestamp
+        self.completed: Dict[datetime, Tuple] = {}
+        self._file = None
+
+    def _load(self) -> int:
+        """ Loads the profiles from an existing checkpoint file into
+        `self.completed`. Returns the length (bytes) of the file that was
+        read; a partially written last line is ignored.
+        """
+        valid_length = 0
+        with self.path.open('rb') as f:
+            header = f.readline()
+            try:
+                settings = json.loads(header)
+            except ValueError:
+                settings = None
+            if settings != self.settings:
+                raise SyntheticSvpGenerationException(
+                    f"Checkpoint {self.path} was not created with the same "
+                    "settings and can not be resumed"
+                )
+            valid_length = len(header)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                timestamp = datetime.fromisoformat(record['timestamp'])
+                self.completed[timestamp] = (
+                    record['latitude'],
+                    record['longitude'],
+                    [tuple(depth_speed) for depth_speed in record['profile']]
+                )
+                valid_length += len(line)
+        return valid_length
+
+    def open(self) -> None:
+        if self.resume and self.path.is_file():
+            valid_length = self._load()
+            # new profiles are appended after the last complete line
+            with self.path.open('r+b') as f:
+                f.truncate(valid_length)
+            self._file = self.path.open('a', encoding='utf-8')
+            click.echo(
+                f"Resuming from checkpoint {self.path}, "
+                f"{len(self.completed)} synthetic SVPs already generated"
+            )
+        else:
+            self._file = self.path.open('w', encoding='utf-8')
+            self._file.write(json.dumps(self.settings) + '\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def add(
+            self,
+            timestamp: datetime,
+            latitude: float,
+            longitude: float,
+            profile: List[Tuple[float, float]]) -> None:
+        """ Appends a synthetic profile to the checkpoint file. Each profile
+        is flushed so that at most the profile being written is lost if the
+        process is killed.
+        """
+        record = {
+            'timestamp': timestamp.isoformat(),
+            'latitude': latitude,
+            'longitude': longitude,
+            # atlas profiles may hold numpy values
+            'profile': [
+                [float(depth), float(speed)] for (depth, speed) in profile
+            ],
+        }
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def _get_completed(
+            self,
+            latitude: float,
+            longitude: float,
+            timestamp: datetime) -> List[Tuple[float, float]]:
+        """ Gets the checkpointed profile for a position, or None if there
+        isn't one"""
+        completed = self.completed.get(timestamp)
+        if completed is None or completed[:2] != (latitude, longitude):
+            return None
+        return completed[2]
+
+    def iter_profiles(
+            self,
+            positions: List[Tuple[float, float, datetime]],
+            generate: Callable[[List[Tuple[float, float, datetime]]], Iterator]
+            ) -> Iterator[List[Tuple[float, float]]]:
+        """ Yields the synthetic profile for each position (latitude,
+        longitude, timestamp), in order. Profiles for timestamps already in
+        the checkpoint (at the same location) are reused, all other positions
+        are passed to `generate` and the profiles it yields are added to the
+        checkpoint.
+        """
+        profiles = [
+            self._get_completed(*position) for position in positions
+        ]
+        generated = generate([
+            position
+            for (position, profile) in zip(positions, profiles)
+            if profile is None
+        ])
+        try:
+            for ((latitude, longitude, timestamp), profile) in \
+                    zip(positions, profiles):
+                if profile is None:
+                    profile = next(generated)
+                    self.add(timestamp, latitude, longitude, profile)
+                yield profile
+        finally:
+            if hasattr(generated, 'close'):
+                generated.close()
+
+    def __enter__(self) -> 'SvpCheckpoint':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.remove()
+        else:
+            self.close()
@@ -0,0 +1,214 @@
+"""
+Transparent reading and writing of compressed files. Files are read and
+written as a stream, so compressed inputs are never decompressed to a
+temporary file.
+
+When reading, the compression is detected from the first bytes of the file
+(so a compressed file without the usual extension is still read); when
+writing it is given by the extension of the filename (eg; `output.txt.gz`).
+gzip, bz2, and xz are supported by the standard library, zstd requires the
+optional `zstandard` package.
+
+Compressing large outputs can take longer than generating them, so output
+may be compressed by multiple threads (see `configure_compression`). zstd
+supports this natively; gzip output is written as a series of independently
+compressed members (as pigz does) that any gzip reader decompresses as a
+single stream.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Dict, Tuple
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+# extension and magic bytes of each supported compression
+COMPRESSIONS: Dict[str, Tuple[str, bytes]] = {
+    'gzip': ('.gz', b'\x1f\x8b'),
+    'bz2': ('.bz2', b'BZh'),
+    'xz': ('.xz', b'\xfd7zXZ\x00'),
+    'zstd': ('.zst', b'\x28\xb5\x2f\xfd'),
+}
+COMPRESSION_SUFFIXES = tuple(ext for (ext, _) in COMPRESSIONS.values())
+MAGIC_LENGTH = max(len(magic) for (_, magic) in COMPRESSIONS.values())
+
+# amount of uncompressed data (bytes) compressed by each thread at a time
+# when compressing gzip output with multiple threads
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+# number of threads used to compress output files, 0 uses all available
+# CPUs. Set via `configure_compression`
+compress_threads = 1
+
+
+def configure_compression(threads: int) -> None:
+    global compress_threads
+    compress_threads = threads
+
+
+def _get_compress_threads() -> int:
+    if compress_threads == 0:
+        return os.cpu_count()
+    return compress_threads
+
+
+def get_compression_from_name(path: Path) -> str:
+    """ Gets the compression of a file from its extension, or None if it
+    is not compressed"""
+    name = str(path).lower()
+    for (compression, (ext, _)) in COMPRESSIONS.items():
+        if name.endswith(ext):
+            return compression
+    return None
+
+
+def get_compression_from_content(path: Path) -> str:
+    """ Gets the compression of an existing file from its first bytes, or
+    None if it is not compressed"""
+    with Path(path).open('rb') as f:
+        start = f.read(MAGIC_LENGTH)
+    for (compression, (_, magic)) in COMPRESSIONS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def strip_compression_suffix(name: str) -> str:
+    """ Removes the compression extension (if any) from a filename, eg;
+    `output.txt.gz` becomes `output.txt`"""
+    compression = get_compression_from_name(name)
+    if compression is None:
+        return name
+    return name[:-len(COMPRESSIONS[compression][0])]
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "The zstandard package is required to read and write zstd "
+            "compressed files (pip install zstandard)"
+        )
+    return zstandard
+
+
+class _ParallelGzipWriter(io.RawIOBase):
+    """ Writes gzip data compressed by multiple threads. Data is split into
+    blocks that are each compressed as a separate gzip member, and written
+    in order."""
+
+    def __init__(self, path: Path, threads: int) -> None:
+        super().__init__()
+        self._file = Path(path).open('wb')
+        self._threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._buffer = bytearray()
+        # compressed blocks not yet written, in order
+        self._pending = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def _submit(self, data: bytes) -> None:
+        # zlib releases the GIL, so blocks are compressed in parallel. mtime
+        # is fixed so the same data always gives the same output
+        self._pending.append(
+            self._executor.submit(gzip.compress, data, mtime=0))
+
+    def _write_pending(self, max_pending: int) -> None:
+        while len(self._pending) > max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= GZIP_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:GZIP_BLOCK_SIZE]))
+            del self._buffer[:GZIP_BLOCK_SIZE]
+        # limit the amount of compressed data held in memory
+        self._write_pending(self._threads * 2)
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if len(self._buffer) > 0 or len(self._pending) == 0:
+                self._submit(bytes(self._buffer))
+            self._write_pending(0)
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+            super().close()
+
+
+class _NamedTextIOWrapper(io.TextIOWrapper):
+    """ Text wrapper with the name of the (compressed) file, not all
+    compressed file objects have a name"""
+
+    def __init__(self, buffer: IO[bytes], name: str, **kwargs) -> None:
+        super().__init__(buffer, **kwargs)
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+
+def _open_binary(path: Path, mode: str, compression: str) -> IO[bytes]:
+    if compression == 'gzip':
+        threads = _get_compress_threads()
+        if mode == 'wb' and threads > 1:
+            return _ParallelGzipWriter(path, threads)
+        return gzip.open(path, mode)
+    elif compression == 'bz2':
+        return bz2.open(path, mode)
+    elif compression == 'xz':
+        return lzma.open(path, mode)
+    elif compression == 'zstd':
+        zstandard = _import_zstandard()
+        if mode == 'rb':
+            return zstandard.open(path, mode)
+        threads = _get_compress_threads()
+        # 0 compresses in the calling thread
+        compressor = zstandard.ZstdCompressor(
+            threads=threads if threads > 1 else 0)
+        return zstandard.open(path, mode, cctx=compressor)
+    return Path(path).open(mode)
+
+
+def open_file(
+        path: Path,
+        mode: str = 'r',
+        buffering: int = -1) -> IO:
+    """ Opens a file that may be compressed. Use in place of `Path.open`.
+
+    Args:
+        path: file to open
+        mode: 'r', 'w', 'rb' or 'wb'. Files read are decompressed if their
+            content is compressed, files written are compressed if the
+            filename has a compression extension (eg; '.gz')
+        buffering: buffer size of uncompressed (plain) files, as for `open`
+
+    Returns:
+        File object, text or binary depending on `mode`
+    """
+    path = Path(path)
+    if 'r' in mode:
+        compression = get_compression_from_content(path)
+    else:
+        compression = get_compression_from_name(path)
+
+    if compression is None:
+        return path.open(mode, buffering=buffering)
+
+    binary_mode = mode[0] + 'b'
+    binary_file = _open_binary(path, binary_mode, compression)
+    if isinstance(binary_file, _ParallelGzipWriter):
+        binary_file = io.BufferedWriter(binary_file, GZIP_BLOCK_SIZE)
+    if 'b' in mode:
+        return binary_file
+    return _NamedTextIOWrapper(binary_file, str(path))
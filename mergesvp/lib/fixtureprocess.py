@@ -0,0 +1,352 @@
+""" Code for generating large input datasets (survey folders of CARIS SVP
+files, merged CARIS files, tracklines files, and L0/L2 casts with an SVP list)
+for load testing. All data is generated from a seed, so the same seed always
+produces the same files.
+
+Formatting every value of GB sized files individually is slow, so profile
+bodies are formatted once into a small pool of text blocks that are reused.
+Each unique profile differs from the others by the speed of its first level.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, List, TextIO, Tuple
+import click
+import os
+import random
+
+from mergesvp.lib.utils import dateformat_to_pythondateformat
+
+FIXTURES = ['survey', 'caris', 'tracklines', 'casts']
+TRACKLINES_DATE_FORMATS = ['dmy', 'mdy', 'ymd']
+
+START = datetime(2020, 1, 1)
+# number of distinct profile bodies that profiles are built from
+BODY_POOL_SIZE = 64
+# number of sections/rows formatted before they are written to the file
+WRITE_CHUNK_SIZE = 1000
+
+
+def _format_dms(val: float) -> str:
+    """ Formats a latitude or longitude as used in CARIS section headers
+    (eg; -12:14:35.00)"""
+    sign = '-' if val < 0 else ''
+    val = abs(val)
+    degrees = int(val)
+    minutes = int((val - degrees) * 60)
+    seconds = (val - degrees - minutes / 60) * 3600
+    return f"{sign}{degrees}:{minutes:02d}:{seconds:05.2f}"
+
+
+class FixtureProcessor:
+    """ Generates the load testing fixtures. Sizes are multiplied by `scale`,
+    so a scale of 10 generates roughly 10 times the data.
+    """
+
+    def __init__(
+            self,
+            output: Path,
+            seed: int = 0,
+            scale: float = 1.0,
+            fixtures: List[str] = FIXTURES,
+            levels: int = 200,
+            duplicate_ratio: float = 0.2,
+            jobs: int = 1) -> None:
+        self.output = output
+        self.seed = seed
+        self.scale = scale
+        self.fixtures = fixtures
+        # number of depth levels in each profile
+        self.levels = levels
+        # fraction of profiles that duplicate an earlier profile
+        self.duplicate_ratio = duplicate_ratio
+        self.jobs = jobs
+
+        self.survey_files = self._scaled(2000)
+        self.survey_profiles_per_file = 5
+        self.caris_sections = self._scaled(100000)
+        self.trackline_rows = self._scaled(1000000)
+        self.casts = self._scaled(1000)
+
+    def _scaled(self, count: int) -> int:
+        return max(1, int(count * self.scale))
+
+    def _rng(self, fixture: str) -> random.Random:
+        """ Each fixture has its own random number generator, so it is the
+        same whichever other fixtures are generated"""
+        return random.Random(f"{self.seed}:{fixture}")
+
+    def _body_pool(
+            self,
+            rng: random.Random,
+            line_format: str) -> List[str]:
+        """ Formats the depth levels (excluding the first) of several
+        random profiles. `line_format` is formatted with the depth, speed
+        and temperature of each level.
+        """
+        pool = []
+        for _ in range(BODY_POOL_SIZE):
+            speed = rng.uniform(1480, 1540)
+            temperature = rng.uniform(15, 30)
+            lines = []
+            for level in range(1, self.levels):
+                speed += rng.uniform(-0.5, 0.5)
+                temperature += rng.uniform(-0.05, 0.02)
+                lines.append(line_format.format(
+                    depth=level * 0.5, speed=speed, temperature=temperature))
+            pool.append(''.join(lines))
+        return pool
+
+    def _profile_ids(self, rng: random.Random, count: int) -> List[int]:
+        """ Gets the id of the profile to use for each of `count` profiles,
+        including duplicates of earlier profiles"""
+        ids = []
+        next_id = 0
+        for _ in range(count):
+            if next_id > 0 and rng.random() < self.duplicate_ratio:
+                ids.append(rng.randrange(next_id))
+            else:
+                ids.append(next_id)
+                next_id += 1
+        return ids
+
+    def _write_caris_sections(
+            self,
+            output: TextIO,
+            rng: random.Random,
+            pool: List[str],
+            profile_ids: List[int],
+            start: datetime) -> None:
+        latitude = rng.uniform(-20, -10)
+        longitude = rng.uniform(140, 150)
+        timestamp = start
+        chunk = []
+        for profile_id in profile_ids:
+            latitude += rng.uniform(-0.01, 0.01)
+            longitude += rng.uniform(-0.01, 0.01)
+            chunk.append(
+                f"Section {timestamp.strftime('%Y-%j %H:%M:%S')} "
+                f"{_format_dms(latitude)} {_format_dms(longitude)}\n"
+                f"0.000000 {1400 + profile_id * 0.0001:.6f}\n"
+            )
+            chunk.append(pool[profile_id % BODY_POOL_SIZE])
+            timestamp += timedelta(minutes=10)
+            if len(chunk) >= WRITE_CHUNK_SIZE:
+                output.write(''.join(chunk))
+                chunk = []
+        output.write(''.join(chunk))
+
+    def write_survey(self, folder: Path) -> None:
+        """ Writes a survey folder structure of CARIS `svp` files, as read by
+        the merge-caris-svp command. Duplicate profiles are spread across
+        files."""
+        rng = self._rng('survey')
+        pool = self._body_pool(rng, "{depth:.6f} {speed:.6f}\n")
+        profile_ids = self._profile_ids(
+            rng, self.survey_files * self.survey_profiles_per_file)
+        start = START
+        for i in range(self.survey_files):
+            path = folder / f'line_{i:05d}_ssp' / 'svp'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            file_ids = profile_ids[
+                i * self.survey_profiles_per_file:
+                (i + 1) * self.survey_profiles_per_file
+            ]
+            with path.open('w') as output:
+                output.write("[SVP_VERSION_2]\nsvp\n")
+                self._write_caris_sections(
+                    output, rng, pool, file_ids, start)
+            start += timedelta(hours=1)
+
+    def write_caris(self, path: Path) -> None:
+        """ Writes a single merged CARIS file"""
+        rng = self._rng('caris')
+        pool = self._body_pool(rng, "{depth:.6f} {speed:.6f}\n")
+        profile_ids = self._profile_ids(rng, self.caris_sections)
+        with path.open('w') as output:
+            output.write(f"[SVP_VERSION_2]\n{path.name}\n")
+            self._write_caris_sections(output, rng, pool, profile_ids, START)
+
+    def write_tracklines(self, path: Path, date_format: str) -> None:
+        """ Writes a tracklines CSV file with one point per second, a new
+        trackline starts every 10000 points"""
+        rng = self._rng(f'tracklines-{date_format}')
+        python_date_format = dateformat_to_pythondateformat(date_format)
+        # the date of each day and the time of each second are formatted once
+        times = [
+            f"{h:02d}:{m:02d}:{s:02d}.000"
+            for h in range(24) for m in range(60) for s in range(60)
+        ]
+        line_ids = [
+            f"L{i:04d}" for i in range(self.trackline_rows // 10000 + 1)]
+        row_format = "%s,%s,%s,%.7f,%.7f,50.0\n"
+        latitude = rng.uniform(-20, -10)
+        longitude = rng.uniform(140, 150)
+        random = rng.random
+        with path.open('w') as output:
+            output.write("Date,Time,Line,Longitude,Latitude,Depth\n")
+            chunk = []
+            day = None
+            for i in range(self.trackline_rows):
+                if i % 86400 == 0:
+                    day = (START + timedelta(days=i // 86400)) \
+                        .strftime(python_date_format)
+                latitude += (random() - 0.5) * 0.0002
+                longitude += (random() - 0.5) * 0.0002
+                chunk.append(row_format % (
+                    day, times[i % 86400], line_ids[i // 10000],
+                    longitude, latitude))
+                if len(chunk) >= WRITE_CHUNK_SIZE:
+                    output.write(''.join(chunk))
+                    chunk = []
+            output.write(''.join(chunk))
+
+    def write_casts(self, folder: Path, svp_format: str) -> None:
+        """ Writes L0 or L2 cast files, and the SVP list file used by the
+        merge-raw-svp command to read them"""
+        rng = self._rng(f'casts-{svp_format}')
+        cast_folder = folder / svp_format.upper()
+        cast_folder.mkdir(parents=True, exist_ok=True)
+        if svp_format == 'l0':
+            pool = self._body_pool(
+                rng, "{depth:06.3f}\t{temperature:06.3f}\t{speed:08.3f}\n")
+            suffix = '.TXT'
+        else:
+            pool = self._body_pool(rng, "{depth:.2f} {speed:.2f}\n")
+            suffix = '.asvp'
+
+        list_lines = ["Filename,Date,Latitude,Longitude\n"]
+        timestamp = START
+        for i in range(self.casts):
+            latitude = rng.uniform(-20, -10)
+            longitude = rng.uniform(140, 150)
+            filename = f'V{i:06d}{suffix}'
+            if svp_format == 'l0':
+                header = (
+                    f"Now: {timestamp.strftime('%d/%m/%Y %H:%M:%S')}\n"
+                    "Battery Level: 1.4V\n"
+                    "MiniSVP: S/N 34826\n"
+                    "Site info: FIXTURE\n"
+                    "Calibrated: 10/01/2011\n"
+                    f"Latitude: {_format_dms(latitude).replace(':', ' ')}\n"
+                    f"Longitude: {_format_dms(longitude).replace(':', ' ')}\n"
+                    "Mode: P2.000000e-1\n"
+                    "Tare: 10.0854\n"
+                    "Pressure units: dBar\n"
+                    f"00.000\t25.000\t{1400 + i * 0.001:08.3f}\n"
+                )
+            else:
+                header = (
+                    f"( SoundVelocity  1.0 0 {timestamp.strftime('%Y%m%d%H%M')}"
+                    f" {latitude:.8f} {longitude:.8f} -1 0 0 SSM_2021.1.7 P "
+                    f"{self.levels:04d} )\n"
+                    f"0.00 {1400 + i * 0.01:.2f}\n"
+                )
+            (cast_folder / filename).write_text(
+                header + pool[i % BODY_POOL_SIZE])
+            list_lines.append(
+                f"{filename},{timestamp.strftime('%d/%m/%Y %H:%M:%S')},"
+                f"{latitude:.8f},{longitude:.8f}\n"
+            )
+            timestamp += timedelta(hours=1)
+
+        list_file = folder / f'svp_list_{svp_format}.csv'
+        list_file.write_text(''.join(list_lines))
+
+    def _get_tasks(self) -> List[Tuple[str, Callable, Tuple]]:
+        """ Gets the description, function and arguments of each file (or
+        folder of files) to write"""
+        tasks = []
+        if 'survey' in self.fixtures:
+            tasks.append((
+                f"survey of {self.survey_files} svp files",
+                self.write_survey,
+                (self.output / 'survey',)
+            ))
+        if 'caris' in self.fixtures:
+            tasks.append((
+                f"merged CARIS file of {self.caris_sections} sections",
+                self.write_caris,
+                (self.output / 'merged_caris.txt',)
+            ))
+        if 'tracklines' in self.fixtures:
+            for date_format in TRACKLINES_DATE_FORMATS:
+                tasks.append((
+                    f"{date_format} tracklines file of "
+                    f"{self.trackline_rows} rows",
+                    self.write_tracklines,
+                    (self.output / f'tracklines_{date_format}.csv',
+                        date_format)
+                ))
+        if 'casts' in self.fixtures:
+            for svp_format in ['l0', 'l2']:
+                tasks.append((
+                    f"{self.casts} {svp_format.upper()} casts",
+                    self.write_casts,
+                    (self.output / 'casts', svp_format)
+                ))
+        return tasks
+
+    def process(self):
+        self.output.mkdir(parents=True, exist_ok=True)
+        tasks = self._get_tasks()
+        for (description, _, _) in tasks:
+            click.echo(f"Writing {description}")
+
+        jobs = self.jobs
+        if jobs == 0:
+            jobs = os.cpu_count()
+        jobs = min(jobs, len(tasks))
+
+        # each task has its own random number generator, so the files are
+        # the same whether they are written in parallel or not
+        if jobs <= 1:
+            for (_, fn, args) in tasks:
+                fn(*args)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(fn, *args) for (_, fn, args) in tasks]
+                for future in futures:
+                    future.result()
+
+
+def generate_fixtures_process(
+        output: Path,
+        seed: int = 0,
+        scale: float = 1.0,
+        fixtures: List[str] = FIXTURES,
+        levels: int = 200,
+        duplicate_ratio: float = 0.2,
+        jobs: int = 1) -> None:
+    """
+    Main entry point for generating large input datasets for load testing.
+
+    Args:
+        output: folder the fixtures are written to
+        seed: seed of the random data, the same seed always generates the
+            same fixtures
+        scale: multiplies the size of the fixtures (at a scale of 1; 2000
+            survey svp files, a 100k section CARIS file, 1M row tracklines
+            files, and 1000 casts)
+        fixtures: the fixtures to generate, see `FIXTURES`
+        levels: number of depth levels in each profile
+        duplicate_ratio: fraction of CARIS profiles that duplicate an
+            earlier profile
+        jobs: number of worker processes used to write the files, 0 will use
+            all available CPUs
+
+    Returns:
+        None
+    """
+    processor = FixtureProcessor(
+        output=output,
+        seed=seed,
+        scale=scale,
+        fixtures=fixtures,
+        levels=levels,
+        duplicate_ratio=duplicate_ratio,
+        jobs=jobs
+    )
+    processor.process()
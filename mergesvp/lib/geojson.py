@@ -2,7 +2,18 @@
 an external dependency.
 """
 
-from typing import Dict
+from pathlib import Path
+from typing import Dict, List, TextIO
+import json
+
+from mergesvp.lib.compression import open_file
+
+# formats supported by GeojsonWriter; indented (as json.dumps with indent=2),
+# compact (no whitespace), or newline-delimited (one compact feature per
+# line, without the enclosing FeatureCollection)
+GEOJSON_FORMATS = ['indent', 'compact', 'ndjson']
+# size (bytes) of the write buffer of files opened by GeojsonWriter
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 
 class GeojsonFeature:
@@ -79,3 +90,113 @@ class GeojsonRoot:
 
     def to_geojson(self) -> Dict:
         return self.feature_collection.to_geojson()
+
+
+def _round_coordinates(coordinates: List, precision: int) -> List:
+    """ Rounds the values of a (possibly nested) list of coordinates"""
+    if len(coordinates) > 0 and isinstance(coordinates[0], list):
+        return [_round_coordinates(c, precision) for c in coordinates]
+    return [None if c is None else round(c, precision) for c in coordinates]
+
+
+class GeojsonWriter:
+    """ Writes a FeatureCollection one feature at a time, so that the
+    complete collection never needs to be held in memory. Use as a context
+    manager, or call `close` once all features have been written.
+
+    The indent format is identical to `json.dumps(indent=2)` of
+    `GeojsonRoot.to_geojson()`. Coordinates are rounded to `precision`
+    decimal places if given.
+    """
+
+    def __init__(
+            self,
+            output: TextIO,
+            format: str = 'indent',
+            precision: int = None) -> None:
+        if format not in GEOJSON_FORMATS:
+            raise ValueError(f"Unknown GeoJSON format {format}")
+        self.output = output
+        self.format = format
+        self.precision = precision
+        self.count = 0
+        self._owns_output = False
+        self._closed = False
+
+    @classmethod
+    def open(
+            cls,
+            path: Path,
+            format: str = 'indent',
+            precision: int = None) -> 'GeojsonWriter':
+        """ Opens a buffered file at `path` to write to, compressed if
+        `path` has a compression extension"""
+        writer = cls(
+            open_file(path, 'w', buffering=WRITE_BUFFER_SIZE),
+            format,
+            precision
+        )
+        writer._owns_output = True
+        return writer
+
+    def __enter__(self) -> 'GeojsonWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(flush=exc_type is None)
+
+    def _feature_dict(self, feature: GeojsonFeature) -> Dict:
+        feature_dict = feature.to_geojson()
+        if self.precision is not None:
+            geometry = feature_dict['geometry']
+            geometry['coordinates'] = _round_coordinates(
+                geometry['coordinates'], self.precision)
+        return feature_dict
+
+    def write_feature(self, feature: GeojsonFeature) -> None:
+        feature_dict = self._feature_dict(feature)
+        if self.format == 'ndjson':
+            self.output.write(
+                json.dumps(feature_dict, separators=(',', ':')) + '\n')
+        elif self.format == 'compact':
+            if self.count == 0:
+                self.output.write(
+                    '{"type":"FeatureCollection","features":[')
+            else:
+                self.output.write(',')
+            self.output.write(json.dumps(feature_dict, separators=(',', ':')))
+        else:
+            if self.count == 0:
+                self.output.write(
+                    '{\n  "type": "FeatureCollection",\n  "features": [\n')
+            else:
+                self.output.write(',\n')
+            feature_str = json.dumps(feature_dict, indent=2)
+            self.output.write('    ' + feature_str.replace('\n', '\n    '))
+        self.count += 1
+
+    def write_features(self, features) -> None:
+        for feature in features:
+            self.write_feature(feature)
+
+    def close(self, flush: bool = True) -> None:
+        """ Ends the FeatureCollection, and closes the file if it was opened
+        by this writer. If `flush` is False (eg; after an error) the
+        FeatureCollection is not ended, so an incomplete output is not
+        mistaken for a complete one.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if flush and self.format == 'compact':
+            if self.count == 0:
+                self.output.write('{"type":"FeatureCollection","features":[')
+            self.output.write(']}')
+        elif flush and self.format == 'indent':
+            if self.count == 0:
+                self.output.write(
+                    '{\n  "type": "FeatureCollection",\n  "features": []\n}')
+            else:
+                self.output.write('\n  ]\n}')
+        if self._owns_output:
+            self.output.close()
@@ -0,0 +1,192 @@
+"""
+Run metrics for monitoring, enabled with the `--metrics` option. Processes
+add to the counters below as they run (eg; files read, profiles parsed,
+duplicates removed), and at the end of the command the metrics are written
+as either a JSON document or a Prometheus textfile (for the node exporter
+textfile collector).
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+import json
+import time
+
+METRICS_FORMATS = ['json', 'prometheus']
+# prefix of all metric names in the Prometheus format
+PROMETHEUS_PREFIX = 'mergesvp_'
+
+# type and description of each metric
+METRICS = {
+    'files_discovered': ('counter', "Input files found"),
+    'files_read': ('counter', "Input files read"),
+    'bytes_read': ('counter', "Size (bytes) of the input files read"),
+    'profiles_parsed': ('counter', "SVP profiles read from the input files"),
+    'duplicates_removed': ('counter', "Duplicate SVP profiles removed"),
+    'trackline_points_read': ('counter', "Trackline points read"),
+    'synthetic_profiles_generated': (
+        'counter', "Synthetic SVP profiles generated"),
+    'profiles_written': ('counter', "SVP profiles written to the output"),
+    'atlas_cache_hits': (
+        'counter', "Synthetic SVP profiles found in a cache, by cache"),
+    'atlas_cache_misses': (
+        'counter', "Synthetic SVP profiles not found in a cache, by cache"),
+    'warnings': ('counter', "Warnings, by category"),
+    'duration_seconds': ('gauge', "Time (seconds) taken to run the command"),
+    'profiles_parsed_per_second': (
+        'gauge', "SVP profiles read per second"),
+    'synthetic_profiles_per_second': (
+        'gauge', "Synthetic SVP profiles generated per second"),
+    'bytes_read_per_second': (
+        'gauge', "Bytes of input files read per second"),
+}
+
+# rates included in the output, name of the rate and the metric it is based
+# on
+RATES = [
+    ('profiles_parsed_per_second', 'profiles_parsed'),
+    ('synthetic_profiles_per_second', 'synthetic_profiles_generated'),
+    ('bytes_read_per_second', 'bytes_read'),
+]
+
+
+class RunMetrics:
+    """ Metrics of a single run of a command. Each metric may have several
+    values, one for each set of labels (eg; warnings by category).
+    """
+
+    def __init__(self, command: str = None) -> None:
+        self.command = command
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        # values of each metric, keyed by metric name then labels
+        self.values: Dict[str, Dict[Tuple, float]] = {}
+
+    def add(self, name: str, value: float = 1, **labels) -> None:
+        """ Adds to the value of a metric"""
+        metric_values = self.values.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        metric_values[key] = metric_values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self.values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def get(self, name: str, **labels) -> float:
+        return self.values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def merge(self, other: 'RunMetrics') -> None:
+        """ Adds all the values of another set of metrics to these (eg; the
+        metrics of a worker process)"""
+        for (name, metric_values) in other.values.items():
+            for (key, value) in metric_values.items():
+                self.add(name, value, **dict(key))
+
+    def total(self, name: str) -> float:
+        """ Sum of the values of a metric for all labels"""
+        return sum(self.values.get(name, {}).values())
+
+    def finish(self) -> None:
+        """ Records the duration of the run and the throughput rates"""
+        duration = time.perf_counter() - self._start
+        self.set('duration_seconds', duration)
+        for (rate_name, name) in RATES:
+            if name in self.values and duration > 0:
+                self.set(rate_name, self.total(name) / duration)
+
+    def to_dict(self) -> Dict:
+        metrics = {}
+        for (name, metric_values) in self.values.items():
+            if list(metric_values.keys()) == [()]:
+                metrics[name] = metric_values[()]
+            else:
+                # labelled values, keyed by the label values
+                metrics[name] = {
+                    ','.join(str(v) for (_, v) in key): value
+                    for (key, value) in sorted(metric_values.items())
+                }
+        return {
+            'command': self.command,
+            'started': self.started.isoformat(),
+            'metrics': metrics,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for (name, metric_values) in self.values.items():
+            (metric_type, description) = METRICS.get(name, ('gauge', name))
+            full_name = PROMETHEUS_PREFIX + name
+            if metric_type == 'counter':
+                full_name += '_total'
+            lines.append(f"# HELP {full_name} {description}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for (key, value) in sorted(metric_values.items()):
+                labels = [('command', self.command)] + list(key)
+                labels_str = ','.join(
+                    f'{label}="{_escape_label(str(label_value))}"'
+                    for (label, label_value) in labels
+                    if label_value is not None
+                )
+                lines.append(
+                    f"{full_name}{{{labels_str}}} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+# metrics of the current run. Processes always add to this, it is only
+# written if the `--metrics` option is given
+metrics = RunMetrics()
+
+
+def start_metrics(command: str) -> RunMetrics:
+    global metrics
+    metrics = RunMetrics(command)
+    return metrics
+
+
+def add_metric(name: str, value: float = 1, **labels) -> None:
+    metrics.add(name, value, **labels)
+
+
+def merge_metrics(other: RunMetrics) -> None:
+    metrics.merge(other)
+
+
+def add_files_read(paths: Iterable[Path]) -> None:
+    """ Adds the number and total size of the files read"""
+    for path in paths:
+        metrics.add('files_read')
+        metrics.add('bytes_read', Path(path).stat().st_size)
+
+
+def add_cache_metrics(svp_cache, persistent_cache) -> None:
+    """ Adds the hits and misses of the synthetic SVP caches"""
+    caches = [('memory', svp_cache), ('persistent', persistent_cache)]
+    for (cache_name, cache) in caches:
+        if cache is None:
+            continue
+        metrics.add('atlas_cache_hits', cache.hits, cache=cache_name)
+        metrics.add('atlas_cache_misses', cache.misses, cache=cache_name)
+
+
+def write_metrics(path: Path, format: str = 'json') -> None:
+    """ Writes the metrics of the current run. The file is written to a
+    temporary file first and then renamed, so a monitoring system never
+    reads a partially written file.
+    """
+    metrics.finish()
+    if format == 'prometheus':
+        text = metrics.to_prometheus()
+    else:
+        text = json.dumps(metrics.to_dict(), indent=4) + '\n'
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text)
+    tmp_path.replace(path)
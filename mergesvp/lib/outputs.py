@@ -0,0 +1,111 @@
+"""
+Output stage that writes SVPs to several outputs in a single pass. Each
+output is a sink (eg; the CARIS file, a GeoJSON summary) that is given the
+SVPs one at a time, so the SVPs are only traversed once and may come from a
+generator without all of them being held in memory.
+"""
+from abc import ABC, abstractmethod
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Iterable, List
+
+from mergesvp.lib.geojson import GeojsonWriter
+from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.svpprofile import SvpProfile
+
+
+class SvpSink(ABC):
+    """ Base class for the outputs written by `write_outputs`. Sinks are
+    opened before the first SVP is written and closed after the last, or
+    when writing fails. May also be used as a context manager.
+    """
+
+    def open(self) -> None:
+        pass
+
+    @abstractmethod
+    def write(self, svp: SvpProfile) -> None:
+        pass
+
+    def close(self, flush: bool = True) -> None:
+        """ Closes the output, `flush` is False if writing failed"""
+        pass
+
+    def __enter__(self) -> 'SvpSink':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(flush=exc_type is None)
+
+
+class CarisSink(SvpSink):
+    """ Writes SVPs to a CARIS file, see `CarisSvpWriter`"""
+
+    def __init__(self, path: Path, jobs: int = 1) -> None:
+        self.path = path
+        # number of worker processes used to format the output, 0 uses all
+        # available CPUs
+        self.jobs = jobs
+        self._writer = None
+
+    def open(self) -> None:
+        parser = CarisSvpParser()
+        parser.jobs = self.jobs
+        self._writer = parser.open_writer(self.path)
+
+    def write(self, svp: SvpProfile) -> None:
+        self._writer.write(svp)
+
+    def close(self, flush: bool = True) -> None:
+        if self._writer is not None:
+            self._writer.close(flush)
+            self._writer = None
+
+
+class GeojsonSink(SvpSink):
+    """ Writes the location of each SVP as a GeoJSON point, the same as
+    `svps_to_geojson_file`"""
+
+    def __init__(
+            self,
+            path: Path,
+            format: str = 'indent',
+            precision: int = None) -> None:
+        self.path = path
+        self.format = format
+        self.precision = precision
+        self._writer = None
+
+    def open(self) -> None:
+        self._writer = GeojsonWriter.open(
+            self.path, self.format, self.precision)
+
+    def write(self, svp: SvpProfile) -> None:
+        self._writer.write_feature(svp.to_geojson_object())
+
+    def close(self, flush: bool = True) -> None:
+        if self._writer is not None:
+            self._writer.close(flush)
+            self._writer = None
+
+
+def write_outputs(svps: Iterable[SvpProfile], sinks: List[SvpSink]) -> int:
+    """ Writes the SVPs to all of the sinks in a single pass.
+
+    Args:
+        svps: SVPs to write, may be a generator
+        sinks: outputs each SVP is written to, in the order given
+
+    Returns:
+        Number of SVPs written
+    """
+    count = 0
+    with ExitStack() as stack:
+        for sink in sinks:
+            stack.enter_context(sink)
+        for svp in svps:
+            for sink in sinks:
+                sink.write(svp)
+            count += 1
+    return count
@@ -1,12 +1,50 @@
 from asyncore import read
 from pathlib import Path
-from typing import List, TextIO, Iterable
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, TextIO, Iterable, Tuple
 from datetime import datetime
 import click
+import os
 
+from mergesvp.lib.compression import open_file, strip_compression_suffix
 from mergesvp.lib.errors import ParserNotImplemeneted, SvpParsingException
 from mergesvp.lib.svpprofile import SvpProfile, SvpProfileFormat
-from mergesvp.lib.utils import dms_to_decimal, decimal_to_dms
+from mergesvp.lib.utils import \
+    dms_to_decimal, \
+    format_caris_section_headers, \
+    parse_caris_section_headers
+from mergesvp.lib.warningsummary import add_warning
+
+# number of SVPs formatted together when writing CARIS files
+WRITE_CHUNK_SIZE = 1000
+
+
+def _get_caris_chunk_data(svps: List[SvpProfile]) -> Tuple:
+    """ Gets the data of a chunk of SVPs needed to format them, this is
+    sent to worker processes so excludes everything else in the SVPs"""
+    return (
+        [svp.timestamp for svp in svps],
+        [svp.latitude for svp in svps],
+        [svp.longitude for svp in svps],
+        [svp.depth_speed for svp in svps],
+    )
+
+
+def _format_caris_chunk(chunk_data: Tuple) -> str:
+    """ Formats the CARIS sections of a chunk of SVPs (see
+    `_get_caris_chunk_data`)"""
+    (timestamps, latitudes, longitudes, depth_speeds) = chunk_data
+    headers = format_caris_section_headers(timestamps, latitudes, longitudes)
+    lines = []
+    for (header, depth_speed) in zip(headers, depth_speeds):
+        lines.append(header)
+        lines.extend([
+            f"{depth:.6f} {speed:.6f}\n"
+            for (depth, speed) in depth_speed
+        ])
+    return ''.join(lines)
+
 
 class SvpParser:
     """ Base class for all parsers that read or write SvpProfiles
@@ -40,16 +78,24 @@ class L0SvpParser(SvpParser):
         super().__init__()
         self.supports_many_svps = False
 
-    def _validate_L0(self, svp: SvpProfile) -> None:
+    def _validate_L0(self, svp: SvpProfile, filename: Path = None) -> None:
         """ Runs a few checks of the data included in the SvpProfile object,
         includes warnings if anything seems missing.
         """
         if svp.latitude is None:
-            svp.warnings.append("Missing latitude, please check file header info")
+            self._add_warning(
+                svp, filename, "Missing latitude, please check file header info")
         if svp.longitude is None:
-            svp.warnings.append("Missing longitude, please check file header info")
+            self._add_warning(
+                svp, filename, "Missing longitude, please check file header info")
         if svp.timestamp is None:
-            svp.warnings.append("Missing date, please check file header info")
+            self._add_warning(
+                svp, filename, "Missing date, please check file header info")
+
+    def _add_warning(
+            self, svp: SvpProfile, filename: Path, msg: str) -> None:
+        svp.warnings.append(msg)
+        add_warning('svp_parse', msg, filename)
 
     ## example L0 header lines
     # Now: 28/05/2015 23:49:31
@@ -127,17 +173,21 @@ class L0SvpParser(SvpParser):
                     self._parse_l0_body_line(line, svp)
 
             except Exception as ex:
-                svp.warnings.append(f"Failed to parse line number {i+1}")
+                # bad lines are only counted, a damaged file may have
+                # millions of them
+                add_warning(
+                    'svp_parse', "Failed to parse line", filename,
+                    sample=i + 1)
                 if self.fail_on_error:
                     msg = f"error parsing file {filename} at line {i+1}"
                     raise SvpParsingException(msg)
 
-        self._validate_L0(svp)
+        self._validate_L0(svp, filename)
         return svp
 
     def _read_l0(self, filename: Path) -> SvpProfile:
         """Reads a L0 formatted SVP file"""
-        with filename.open('r') as file:
+        with open_file(filename) as file:
             lines = file.read().splitlines()
             return self._parse_l0(lines, filename)
 
@@ -182,7 +232,7 @@ class L2SvpParser(SvpParser):
         """Reads a L2 formatted SVP file"""
         svp = SvpProfile()
 
-        with filename.open('r') as file:
+        with open_file(filename) as file:
             lines = file.read().splitlines()
             for (i, line) in enumerate(lines):
                 if i == 0:
@@ -210,61 +260,40 @@ class CarisSvpParser(SvpParser):
 
         self._current_line_number = None
         self._current_filename = None
+        # number of worker processes used to format the output when writing,
+        # 0 uses all available CPUs. The output is the same for any number
+        self.jobs = 1
 
     def _write_header(self, output: TextIO) -> None:
         """Writes the header information to output, in this case it is a single
-        text line followed by the filename itself"""
+        text line followed by the filename itself (of the uncompressed file
+        if the output is compressed)"""
         lines = [
             "[SVP_VERSION_2]\n",
-            Path(output.name).name + "\n"
+            strip_compression_suffix(Path(output.name).name) + "\n"
         ]
         output.writelines(lines)
 
 
-    def __formatted_dms(self, val: float) -> str:
-        dms = decimal_to_dms(val)
-        return f"{dms[0]}:{dms[1]}:{dms[2]}"
-
-
-    def _get_caris_svp_lines(self, svp: SvpProfile) -> List[str]:
-
-        # example SVP section header line
-        # Section 2015-148 23:49:31 -12:14:35.00 130:55:40.00
-        date_str = svp.timestamp.strftime('%Y-%j %H:%M:%S')
-        lat_str = self.__formatted_dms(svp.latitude)
-        lng_str = self.__formatted_dms(svp.longitude)
-        header_line = f"Section {date_str} {lat_str} {lng_str}\n"
-
-        svp_lines = [
-            f"{depth:.6f} {speed:.6f}\n"
-            for (depth, speed) in svp.depth_speed
-        ]
-
-        svp_lines.insert(0, header_line)
-        return svp_lines
-
-
-    def _write_all_svps(
-            self,
-            svps: Iterable[SvpProfile],
-            output: TextIO) -> None:
-
-        # loop through each of the SVPs we have and write them to the same
-        # output
-        for svp in svps:
-            lines = self._get_caris_svp_lines(svp)
-            output.writelines(lines)
+    def open_writer(self, path: Path) -> 'CarisSvpWriter':
+        """ Opens a CARIS file for writing SVPs one at a time, see
+        `CarisSvpWriter`"""
+        output = open_file(path, 'w')
+        try:
+            self._write_header(output)
+        except BaseException:
+            output.close()
+            raise
+        return CarisSvpWriter(output, self.jobs)
 
 
     def write_many(self, path: Path, svps: List[SvpProfile]) -> None:
-        with path.open(mode='w') as output:
-            # write header to file
-            self._write_header(output)
+        with self.open_writer(path) as writer:
             if self.show_progress:
                 with click.progressbar(svps, label="Writing merged SVP file") as svps_iter:
-                    self._write_all_svps(svps_iter, output)
+                    writer.write_many(svps_iter)
             else:
-                self._write_all_svps(svps, output)
+                writer.write_many(svps)
 
 
     def _read_section_header(
@@ -300,6 +329,9 @@ class CarisSvpParser(SvpParser):
 
     def _read_many(self, lines: List[str]) -> List[SvpProfile]:
         svps = []
+        # section header line (and line number) of each SVP, these are
+        # parsed together once all lines have been read
+        headers = []
         # the active SVP that data is being read into
         svp = None
         for (i, line) in enumerate(lines):
@@ -309,7 +341,7 @@ class CarisSvpParser(SvpParser):
                 svp = SvpProfile()
                 svp.filename = self._current_filename
                 svps.append(svp)
-                self._read_section_header(svp, line)
+                headers.append((line, i + 1))
             elif svp is None:
                 # then we haven't yet read a 'Section' from the SVP file, so skip
                 # these lines till we do. There is a single '[SVP_VERSION_2]' file,
@@ -318,16 +350,97 @@ class CarisSvpParser(SvpParser):
             else:
                 self._parse_body_line(svp, line)
 
+        try:
+            (timestamps, latitudes, longitudes) = \
+                parse_caris_section_headers([line for (line, _) in headers])
+        except (ValueError, IndexError):
+            # parse each header individually to raise the error of the first
+            # invalid header
+            for (svp, (line, line_number)) in zip(svps, headers):
+                self._current_line_number = line_number
+                self._read_section_header(svp, line)
+            raise
+        for (svp, timestamp, latitude, longitude) in zip(
+                svps, timestamps, latitudes, longitudes):
+            svp.timestamp = timestamp
+            svp.latitude = latitude
+            svp.longitude = longitude
+
         return svps
 
 
     def read_many(self, path: Path) -> List[SvpProfile]:
         self._current_filename = str(path)
-        with path.open('r') as file:
+        with open_file(path) as file:
             lines = file.read().splitlines()
             return self._read_many(lines)
 
 
+class CarisSvpWriter:
+    """ Writes the sections of a CARIS file one SVP at a time, the header
+    must already have been written (see `CarisSvpParser.open_writer`). The
+    output file is closed when the writer is closed.
+
+    SVPs are written in chunks so that the section headers of each chunk can
+    be formatted together. If `jobs` is more than 1 the chunks are formatted
+    by worker processes and written in order; up to two chunks per worker are
+    queued, so the workers format the next chunks while the previous ones are
+    written. The output is the same for any number of jobs.
+    """
+
+    def __init__(self, output: TextIO, jobs: int = 1) -> None:
+        self.output = output
+        self.jobs = os.cpu_count() if jobs == 0 else jobs
+        self._chunk: List[SvpProfile] = []
+        # formatted chunks not yet written, in order
+        self._pending = deque()
+        self._executor = None
+        if self.jobs > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs)
+
+    def _write_pending(self, max_pending: int) -> None:
+        while len(self._pending) > max_pending:
+            self.output.write(self._pending.popleft().result())
+
+    def _write_chunk(self) -> None:
+        chunk_data = _get_caris_chunk_data(self._chunk)
+        self._chunk = []
+        if self._executor is None:
+            self.output.write(_format_caris_chunk(chunk_data))
+            return
+        self._pending.append(
+            self._executor.submit(_format_caris_chunk, chunk_data))
+        self._write_pending(self.jobs * 2 - 1)
+
+    def write(self, svp: SvpProfile) -> None:
+        self._chunk.append(svp)
+        if len(self._chunk) >= WRITE_CHUNK_SIZE:
+            self._write_chunk()
+
+    def write_many(self, svps: Iterable[SvpProfile]) -> None:
+        for svp in svps:
+            self.write(svp)
+
+    def close(self, flush: bool = True) -> None:
+        """ Writes the remaining SVPs and closes the output, or only closes
+        it if `flush` is False (eg; after an error)"""
+        try:
+            if flush:
+                if len(self._chunk) > 0:
+                    self._write_chunk()
+                self._write_pending(0)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+            self.output.close()
+
+    def __enter__(self) -> 'CarisSvpWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(flush=exc_type is None)
+
+
 def get_svp_parser(format: SvpProfileFormat) -> SvpParser:
     """Factory type function that returns a function that is able to
     read the SVP format given"""
@@ -343,7 +456,7 @@ def get_svp_parser(format: SvpProfileFormat) -> SvpParser:
 
 def get_svp_profile_format(filename: Path) -> SvpProfileFormat:
     """ Attempts to get the type of SVP file from the given path"""
-    with filename.open('r') as file:
+    with open_file(filename) as file:
         first_line = file.readline()
 
         if first_line.startswith('Now:'):
@@ -359,3 +472,4 @@ def get_svp_profile_format(filename: Path) -> SvpProfileFormat:
         else:
             raise SvpParsingException(
                 f'Could not identify SVP file type of {filename}')
+
@@ -0,0 +1,117 @@
+"""
+Helpers for running the stages of a process concurrently. Stages are
+connected by bounded queues, so a fast stage can't get too far ahead of a
+slow one (and hold too much in memory), and the time taken approaches that
+of the slowest stage rather than the sum of all stages.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+import queue
+import threading
+
+# maximum number of items held in the queue between two stages
+DEFAULT_QUEUE_SIZE = 64
+
+# marks the end of the items in a queue
+_END = object()
+
+
+class _StageError:
+    """ Wraps an exception raised by a stage so it can be re-raised by the
+    next stage"""
+
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+def iter_in_background(
+        iterable: Iterable,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        name: str = 'mergesvp-stage') -> Iterator:
+    """ Iterates over `iterable` (typically a generator that does some slow
+    work for each item) in a background thread. Items are passed back
+    through a queue holding at most `maxsize` items, so the background thread
+    can work ahead of the consumer while it processes each item. Exceptions
+    raised by the iterable are raised by this iterator. If the consumer
+    stops early the iterable is closed, if it has a `close` method.
+    """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        # time out regularly so that the producer stops if the consumer does
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    # the consumer stopped early. Generators can only be
+                    # closed by the thread running them, so the iterable is
+                    # closed here to run its cleanup (eg; finally blocks)
+                    # before the consumer finishes
+                    close = getattr(iterable, 'close', None)
+                    if close is not None:
+                        close()
+                    return
+        except BaseException as ex:
+            put(_StageError(ex))
+            return
+        put(_END)
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class BackgroundTasks:
+    """ Runs tasks (eg; writing summary files) in background threads. When
+    used as a context manager all tasks are waited for on exit, and the first
+    exception raised by a task is raised.
+    """
+
+    def __init__(self, max_workers: int = 1) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='mergesvp-background'
+        )
+        self._futures: List[Future] = []
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def wait(self) -> None:
+        """ Waits for all submitted tasks to finish, raises the exception of
+        the first task that failed"""
+        futures = self._futures
+        self._futures = []
+        for future in futures:
+            future.result()
+
+    def __enter__(self) -> 'BackgroundTasks':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,235 @@
+"""
+Persistent on-disk cache of synthetic SVP profiles. Generating synthetic
+profiles from the World Ocean Atlas is slow, and the same survey areas are
+often processed many times. Profiles are stored in a SQLite database keyed
+on the atlas name, grid cell and time bin so that later runs can reuse them.
+"""
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_FILENAME = 'synthetic_svps.sqlite'
+# default maximum size (MB) of the profiles stored in the cache
+DEFAULT_MAX_SIZE = 256
+# number of least recently used profiles read at a time when evicting
+EVICT_BATCH_SIZE = 64
+
+
+def get_cache_folder() -> Path:
+    """ Gets the folder the persistent cache is stored in. This can be set
+    with the `MERGESVP_CACHE_DIR` environment variable, otherwise the
+    platform specific user cache folder is used.
+    """
+    if 'MERGESVP_CACHE_DIR' in os.environ:
+        return Path(os.environ['MERGESVP_CACHE_DIR'])
+    if sys.platform == 'win32' and 'LOCALAPPDATA' in os.environ:
+        return Path(os.environ['LOCALAPPDATA']) / 'mergesvp' / 'cache'
+    if 'XDG_CACHE_HOME' in os.environ:
+        return Path(os.environ['XDG_CACHE_HOME']) / 'mergesvp'
+    return Path.home() / '.cache' / 'mergesvp'
+
+
+def get_cache_path() -> Path:
+    return get_cache_folder() / CACHE_FILENAME
+
+
+class PersistentSvpCache:
+    """ SQLite backed cache of synthetic SVP profiles. When the total size
+    of the stored profiles exceeds `max_size` (MB) the least recently used
+    profiles are removed.
+    """
+
+    def __init__(self, path: Path, max_size: float = DEFAULT_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit mode, each profile is saved as soon as it is added so
+        # that nothing is lost if the process is killed. Profiles may be
+        # generated in a background thread, so access is serialised by a
+        # lock rather than restricted to the creating thread
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            str(path), isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS profiles ('
+            ' atlas TEXT NOT NULL,'
+            ' lat_idx INTEGER NOT NULL,'
+            ' lon_idx INTEGER NOT NULL,'
+            ' time_bin INTEGER NOT NULL,'
+            ' depth BLOB NOT NULL,'
+            ' speed BLOB NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (atlas, lat_idx, lon_idx, time_bin))'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS profiles_last_used '
+            'ON profiles (last_used)'
+        )
+        # running total of the profile sizes, kept up to date as profiles
+        # are added and removed so the size of the cache can be checked
+        # without summing every row
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache_info ('
+            ' name TEXT PRIMARY KEY,'
+            ' value INTEGER NOT NULL)'
+        )
+        with self._transaction():
+            # caches created before the running total was added
+            self._connection.execute(
+                "INSERT OR IGNORE INTO cache_info "
+                "SELECT 'total_size', COALESCE(SUM(size), 0) FROM profiles"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _add_total_size(self, delta: int) -> None:
+        self._connection.execute(
+            "UPDATE cache_info SET value=value+? WHERE name='total_size'",
+            (delta,)
+        )
+
+    def total_size(self) -> int:
+        """ Gets the total size (bytes) of the stored profiles"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT value FROM cache_info WHERE name='total_size'"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def get(
+            self,
+            atlas: str,
+            cell: Tuple[int, int, int]) -> List[Tuple[float, float]]:
+        """ Gets the profile for the atlas grid cell and time bin (see
+        `ssminterface.get_atlas_cell`), or None if it is not cached.
+        """
+        with self._lock:
+            key = (atlas, *cell)
+            row = self._connection.execute(
+                'SELECT depth, speed FROM profiles '
+                'WHERE atlas=? AND lat_idx=? AND lon_idx=? AND time_bin=?',
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._connection.execute(
+                'UPDATE profiles SET last_used=? '
+                'WHERE atlas=? AND lat_idx=? AND lon_idx=? AND time_bin=?',
+                (time.time(), *key)
+            )
+            depths = array('d')
+            depths.frombytes(row[0])
+            speeds = array('d')
+            speeds.frombytes(row[1])
+            return list(zip(depths, speeds))
+
+    def put(
+            self,
+            atlas: str,
+            cell: Tuple[int, int, int],
+            profile: List[Tuple[float, float]]) -> None:
+        """ Adds a profile to the cache, removing the least recently used
+        profiles if the cache exceeds its maximum size.
+        """
+        with self._lock:
+            depths = array('d', [depth for (depth, _) in profile]).tobytes()
+            speeds = array('d', [speed for (_, speed) in profile]).tobytes()
+            size = len(depths) + len(speeds)
+            with self._transaction():
+                row = self._connection.execute(
+                    'SELECT size FROM profiles '
+                    'WHERE atlas=? AND lat_idx=? AND lon_idx=? AND time_bin=?',
+                    (atlas, *cell)
+                ).fetchone()
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO profiles '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (atlas, *cell, depths, speeds, size, time.time())
+                )
+                self._add_total_size(size - (row[0] if row else 0))
+            self.evict()
+
+    def evict(self) -> int:
+        """ Removes the least recently used profiles until the cache is within
+        its maximum size. Returns the number of profiles removed.
+        """
+        with self._lock:
+            max_bytes = self.max_size * 1024 * 1024
+            removed = 0
+            while self.total_size() > max_bytes:
+                with self._transaction():
+                    excess = self.total_size() - max_bytes
+                    # only the oldest profiles are read, using the index on
+                    # last_used
+                    rows = self._connection.execute(
+                        'SELECT rowid, size FROM profiles '
+                        'ORDER BY last_used LIMIT ?',
+                        (EVICT_BATCH_SIZE,)
+                    ).fetchall()
+                    if len(rows) == 0:
+                        break
+                    to_remove = []
+                    freed = 0
+                    for (rowid, size) in rows:
+                        if freed >= excess:
+                            break
+                        to_remove.append((rowid,))
+                        freed += size
+                    self._connection.executemany(
+                        'DELETE FROM profiles WHERE rowid=?', to_remove)
+                    self._add_total_size(-freed)
+                removed += len(to_remove)
+            return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            with self._transaction():
+                self._connection.execute('DELETE FROM profiles')
+                self._connection.execute(
+                    "UPDATE cache_info SET value=0 WHERE name='total_size'")
+            self._connection.execute('VACUUM')
+
+    def stats(self) -> Dict:
+        """ Gets the number of profiles, and their total size, stored for
+        each atlas"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT atlas, COUNT(*), COALESCE(SUM(size), 0) FROM profiles '
+                'GROUP BY atlas ORDER BY atlas'
+            ).fetchall()
+            return {
+                atlas: {'profiles': count, 'size': size}
+                for (atlas, count, size) in rows
+            }
+
+    def summary(self) -> str:
+        return (
+            f"Persistent synthetic SVP cache: {self.hits} hits, "
+            f"{self.misses} misses"
+        )
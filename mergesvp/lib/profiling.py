@@ -0,0 +1,174 @@
+"""
+Per stage timing and memory profiling, enabled with the `--profile` option.
+Processes wrap each of their stages (eg; reading, grouping, writing) in a
+`stage` context manager. When profiling is enabled the wall time, CPU time,
+peak memory (from tracemalloc) and number of items processed are recorded
+for each stage; otherwise `stage` does nothing.
+
+CPU time is that of the whole process, so it includes any background threads
+running during a stage but not worker processes. Tracing memory allocations
+slows processing, so the times of a profiled run are longer than a normal
+run.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+import click
+import json
+import threading
+import time
+import tracemalloc
+
+
+class Stage:
+    """ Measurements of a single stage. Stages that run more than once are
+    combined, the times and items are totals and the memory is the highest
+    peak.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        # highest memory (bytes) allocated while the stage was running
+        self.peak_memory = 0
+        # number of items (eg; SVPs, trackline points) processed
+        self.items = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory': self.peak_memory,
+            'items': self.items,
+        }
+
+
+class Profiler:
+    """ Records the measurements of each stage, in the order they first
+    ran"""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Stage] = {}
+        # stages currently running, the last is the innermost
+        self._running: List[Stage] = []
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = 0
+
+    def start(self) -> None:
+        tracemalloc.start()
+
+    def stop(self) -> None:
+        self.wall_time = time.perf_counter() - self._start
+        self.cpu_time = time.process_time() - self._cpu_start
+        # the peak is reset by each stage
+        self.peak_memory = max(
+            [tracemalloc.get_traced_memory()[1]] +
+            [stage.peak_memory for stage in self.stages.values()]
+        )
+        tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = Stage(name)
+            self.stages[name] = stage
+        # the peak is reset for each stage, so record the peak reached so far
+        # by the enclosing stage first
+        if len(self._running) > 0:
+            parent = self._running[-1]
+            parent.peak_memory = max(
+                parent.peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._running.append(stage)
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_time += time.perf_counter() - start
+            stage.cpu_time += time.process_time() - cpu_start
+            stage.calls += 1
+            self._running.pop()
+            # peak isn't reset here, so this also counts towards the
+            # enclosing stage
+            stage.peak_memory = max(
+                stage.peak_memory, tracemalloc.get_traced_memory()[1])
+
+    def to_dict(self) -> Dict:
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory': self.peak_memory,
+            'stages': [stage.to_dict() for stage in self.stages.values()],
+        }
+
+    def summary(self) -> str:
+        """ Table of the measurements of each stage"""
+        lines = [
+            f"{'Stage':<30} {'Wall (s)':>9} {'CPU (s)':>9} "
+            f"{'Peak (MB)':>10} {'Items':>10}"
+        ]
+        rows = [
+            (stage.name, stage.wall_time, stage.cpu_time,
+                stage.peak_memory, stage.items)
+            for stage in self.stages.values()
+        ]
+        rows.append(
+            ('Total', self.wall_time, self.cpu_time, self.peak_memory, None))
+        for (name, wall_time, cpu_time, peak_memory, items) in rows:
+            items_str = '' if items is None else str(items)
+            lines.append(
+                f"{name:<30} {wall_time:9.3f} {cpu_time:9.3f} "
+                f"{peak_memory / 1024 / 1024:10.1f} {items_str:>10}"
+            )
+        return '\n'.join(lines)
+
+
+# the active profiler, None when profiling is disabled
+profiler: Profiler = None
+
+
+def start_profiling() -> Profiler:
+    global profiler
+    profiler = Profiler()
+    profiler.start()
+    return profiler
+
+
+def stop_profiling(report: Path) -> None:
+    """ Stops profiling, and writes the JSON report and a summary table (to
+    stderr)"""
+    global profiler
+    if profiler is None:
+        return
+    profiler.stop()
+    with report.open('w') as f:
+        json.dump(profiler.to_dict(), f, indent=4)
+        f.write('\n')
+    click.echo(profiler.summary(), err=True)
+    click.echo(f"Profile report written to {report}", err=True)
+    profiler = None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Stage]:
+    """ Profiles the code run within this context as a stage of the process.
+    The number of items processed can be added to the yielded stage. Stages
+    are only recorded when run in the main thread.
+    """
+    if profiler is None or \
+            threading.current_thread() is not threading.main_thread():
+        # measurements are discarded
+        yield Stage(name)
+        return
+    with profiler.stage(name) as profiled_stage:
+        yield profiled_stage
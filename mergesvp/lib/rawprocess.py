@@ -11,9 +11,12 @@ from datetime import datetime
 from typing import BinaryIO, TextIO, List, Tuple
 from pathlib import Path
 
+from mergesvp.lib.compression import COMPRESSION_SUFFIXES
 from mergesvp.lib.errors import SvpMissingDataException
 from mergesvp.lib.svpprofile import SvpProfile
 from mergesvp.lib.parsers import CarisSvpParser, get_svp_profile_format, get_svp_parser
+from mergesvp.lib.metrics import add_files_read, add_metric
+from mergesvp.lib.profiling import stage
 from mergesvp.lib.svplist import SvpSource, parse_svp_line
 from mergesvp.lib.utils import trim_to_longest_dive
 
@@ -40,18 +43,17 @@ def find_svp_profile_file(filename: str, base_folder: Path) -> Path:
     locations. Raises `SvpMissingDataException` if the SVP profile
     file listed in the SVP source CSV file cannot be found.
     """
-    # first check the base folder, then L0, then L2
-    if (base_folder / filename).exists():
-        return base_folder / filename
-    elif (base_folder / 'L0' / filename).exists():
-        return base_folder / 'L0' / filename
-    elif (base_folder / 'L2' / filename).exists():
-        return base_folder / 'L2' / filename
-    else:
-        raise SvpMissingDataException(
-            f'Could not find SVP profile file "{filename}" '
-            f'under folder {base_folder}'
-        )
+    # first check the base folder, then L0, then L2. In each folder the
+    # file may also have been compressed (eg; V000003.TXT.gz)
+    for folder in [base_folder, base_folder / 'L0', base_folder / 'L2']:
+        for suffix in ('',) + COMPRESSION_SUFFIXES:
+            path = folder / (filename + suffix)
+            if path.exists():
+                return path
+    raise SvpMissingDataException(
+        f'Could not find SVP profile file "{filename}" '
+        f'under folder {base_folder}'
+    )
 
 
 def _get_svp(filename: Path, fail_on_error: bool) -> None:
@@ -92,32 +94,29 @@ def generate_merged_output(
         svp_source_list: List[SvpSource],
         base_folder: Path,
         output: TextIO,
-        fail_on_error: bool) -> None:
+        fail_on_error: bool,
+        jobs: int = 1) -> None:
     """Generates the merged SVP output file"""
     # iterate through each SvpSource object (effectivity each line of
     # the CSV file that gives us a SVP profile filename, date, and
     # location)
     svps = []
-    with click.progressbar(svp_source_list, label="Reading SVP files") as svp_sources:
+    with stage('parse SVP files') as parse_stage, \
+            click.progressbar(
+                svp_source_list, label="Reading SVP files") as svp_sources:
         for svp_source in svp_sources:
             svp_profile_fn = find_svp_profile_file(
                 svp_source.filename,
                 base_folder
             )
             svp = _get_svp(svp_profile_fn, fail_on_error)
+            add_files_read([svp_profile_fn])
             # append both the source info and the SVP profile data
             # when writing the merged file we use the src data for lat/lng/date
             src_and_svp = (svp_source, svp)
             svps.append(src_and_svp)
-
-    if not fail_on_error:
-        # then no exceptions have been thrown, but there could be warning
-        # messages so show these to the user.
-        for (src, svp) in svps:
-            if svp.has_warning():
-                logger.warn(f"File {svp.filename} generated the following errors when parsing contents")
-                for msg in svp.warnings:
-                    logger.warn(f"    {msg}")
+        parse_stage.items += len(svps)
+    add_metric('profiles_parsed', len(svps))
 
     # update details of the SvpProfiles
     patch_svp_profiles(svps)
@@ -127,14 +126,26 @@ def generate_merged_output(
     # patched
     svps_only = [svp for (_, svp) in svps]
 
-    writer = CarisSvpParser()
-    writer.show_progress = True
-    output_path = Path(os.path.realpath(output.name))
-    writer.write_many(output_path, svps_only)
+    with stage('write output') as write_stage:
+        writer = CarisSvpParser()
+        writer.show_progress = True
+        writer.jobs = jobs
+        output_path = Path(os.path.realpath(output.name))
+        writer.write_many(output_path, svps_only)
+        write_stage.items += len(svps_only)
+    add_metric('profiles_written', len(svps_only))
 
 
-def merge_raw_svp_process(input: TextIO, output: TextIO, fail_on_error: bool) -> None:
-    svps = get_svp_list(input)
+def merge_raw_svp_process(
+        input: TextIO,
+        output: TextIO,
+        fail_on_error: bool,
+        jobs: int = 1) -> None:
+    with stage('read SVP list') as list_stage:
+        svps = get_svp_list(input)
+        list_stage.items += len(svps)
+    add_files_read([Path(input.name)])
+    add_metric('files_discovered', len(svps))
     
     # base folder is what we assume is root of all possible
     # locations for the SVP profile files. SVP profiles must be located
@@ -142,6 +153,6 @@ def merge_raw_svp_process(input: TextIO, output: TextIO, fail_on_error: bool) ->
     # Assume the base folder is the folder that the 
     base_folder = Path(input.name).parent
 
-    generate_merged_output(svps, base_folder, output, fail_on_error)
+    generate_merged_output(svps, base_folder, output, fail_on_error, jobs)
 
     header = None
@@ -2,20 +2,26 @@
 for generation of synthetic sound velocity profiles based on 
 World Ocean Atlas data.
 https://github.com/hydroffice/hyo2_soundspeed
+
+Sound Speed Manager (hyo2) is slow to import, so it is only imported when an
+atlas is first needed.
 """
 
 import os
 import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Tuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Hashable, Iterator, List, Tuple
 
 from mergesvp.lib.errors import SyntheticSvpGenerationException
-from hyo2.ssm2.lib.atlas.abstract import AbstractAtlas
-from hyo2.ssm2.lib.atlas.woa18 import Woa18, AbstractAtlas
-from hyo2.abc2.lib.progress.cli_progress import CliProgress
-
+from mergesvp.lib.profilecache import PersistentSvpCache, get_cache_path
 
-logging.basicConfig()
+if TYPE_CHECKING:
+    from hyo2.ssm2.lib.atlas.abstract import AbstractAtlas
+    from mergesvp.lib.atlasgrid import AtlasGrid
 
 
 def get_data_folder() -> str:
@@ -32,12 +38,145 @@ class Proj:
     require a project object with a progress attribute.
     """
     def __init__(self) -> None:
+        from hyo2.abc2.lib.progress.cli_progress import CliProgress
         self.progress = CliProgress()
 
 
+# name used to identify profiles generated from the SSM atlas in the
+# persistent cache
+ATLAS_NAME = 'woa18'
+# profiles generated by the batch engine are calculated differently to those
+# from SSM, so they are cached separately
+BATCH_ATLAS_NAME = 'woa18-batch'
+
+# 'ssm' queries the SSM atlas for each profile, 'batch' loads the WOA18 grid
+# for all positions once and calculates all profiles together
+ATLAS_ENGINES = ['ssm', 'batch']
+
+# The WOA18 atlas used by SSM is a quarter degree grid, with the first cell
+# centred at -89.875 latitude and -179.875 longitude. Profiles are provided
+# per month.
+WOA18_GRID_STEP = 0.25
+WOA18_GRID_LAT_0 = -89.875
+WOA18_GRID_LON_0 = -179.875
+
+
+def get_atlas_cell(
+        latitude: float,
+        longitude: float,
+        timestamp: datetime) -> Tuple[int, int, int]:
+    """ Gets the atlas grid cell (latitude index, longitude index) and time
+    bin (month) that the SSM atlas query will use for a location and time.
+    All queries that share the same cell return the same profile.
+    """
+    lat_idx = int(round((latitude - WOA18_GRID_LAT_0) / WOA18_GRID_STEP))
+    lon_idx = int(round((longitude - WOA18_GRID_LON_0) / WOA18_GRID_STEP))
+    return (lat_idx, lon_idx, timestamp.month)
+
+
+class SyntheticSvpCache:
+    """ Least recently used (LRU) cache of synthetic SVP profiles. Profiles
+    are keyed by the atlas grid cell and time bin, see `get_atlas_cell`.
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        # maximum number of profiles held in the cache, 0 disables caching
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._profiles = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def get(self, key: Hashable) -> List[Tuple[float, float]]:
+        """ Gets the profile for the key, or None if it is not cached"""
+        profile = self._profiles.get(key)
+        if profile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._profiles.move_to_end(key)
+        # return a copy so that callers can't modify the cached profile
+        return list(profile)
+
+    def put(self, key: Hashable, profile: List[Tuple[float, float]]) -> None:
+        if self.max_size <= 0:
+            return
+        self._profiles[key] = tuple(profile)
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.max_size:
+            # remove the least recently used profile
+            self._profiles.popitem(last=False)
+
+    def clear(self) -> None:
+        self._profiles.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def summary(self) -> str:
+        return (
+            f"Synthetic SVP cache: {self.hits} hits, {self.misses} misses"
+        )
+
+
+svp_cache = SyntheticSvpCache()
+
+
+def configure_svp_cache(max_size: int) -> SyntheticSvpCache:
+    """ Sets the maximum size of the synthetic SVP cache, and resets its
+    contents and hit/miss counters.
+    """
+    svp_cache.max_size = max_size
+    svp_cache.clear()
+    return svp_cache
+
+
+# persistent (on disk) cache of profiles shared across runs, None if the
+# persistent cache is disabled
+persistent_cache = None
+
+
+def configure_persistent_cache(
+        max_size: float,
+        path: Path = None) -> PersistentSvpCache:
+    """ Enables the persistent cache of synthetic SVP profiles, limited to
+    `max_size` MB. A size of 0 disables the persistent cache. Returns the
+    cache, or None if it is disabled.
+    """
+    global persistent_cache
+    if persistent_cache is not None:
+        persistent_cache.close()
+        persistent_cache = None
+
+    if max_size > 0:
+        if path is None:
+            path = get_cache_path()
+        persistent_cache = PersistentSvpCache(path, max_size)
+    return persistent_cache
+
+
+# regional extract of the atlas grid (an `atlasgrid.AtlasGrid`) used in
+# place of the full atlas, None if an extract is not used
+atlas_extract = None
+
+
+def configure_atlas_extract(path: Path) -> 'AtlasGrid':
+    """ Uses the atlas extract file (see the `extract-atlas` command) to
+    generate all synthetic SVPs, rather than the full WOA18 atlas. A path of
+    None stops using an extract.
+    """
+    global atlas_extract
+    atlas_extract = None
+    if path is not None:
+        from mergesvp.lib.atlasgrid import load_atlas_extract
+        atlas_extract = load_atlas_extract(path)
+    return atlas_extract
+
+
 atlas_singleton = None
 
-def get_ssm_atlas() -> AbstractAtlas:
+def get_ssm_atlas() -> 'AbstractAtlas':
     """ Returns an atlas object that can be used to generate synthetic
     velocity profiles.
     """
@@ -47,6 +186,8 @@ def get_ssm_atlas() -> AbstractAtlas:
     if atlas_singleton is not None:
         return atlas_singleton
 
+    from hyo2.ssm2.lib.atlas.woa18 import Woa18
+
     atlas = Woa18(
         data_folder=get_data_folder(),
         prj=Proj()
@@ -64,13 +205,213 @@ def get_ssm_atlas() -> AbstractAtlas:
     return atlas_singleton
 
 
+def _get_cached_svp(
+        key: Tuple[int, int, int],
+        atlas: str = ATLAS_NAME) -> List[Tuple[float, float]]:
+    """ Gets the profile for the atlas cell from the in memory cache, or the
+    persistent cache. Returns None if it is not cached."""
+    svp_data = svp_cache.get((atlas, key))
+    if svp_data is None and persistent_cache is not None:
+        svp_data = persistent_cache.get(atlas, key)
+        if svp_data is not None:
+            svp_cache.put((atlas, key), svp_data)
+    return svp_data
+
+
+def _cache_svp(
+        key: Tuple[int, int, int],
+        svp_data: List[Tuple[float, float]],
+        atlas: str = ATLAS_NAME) -> None:
+    """ Adds a profile queried from the atlas to the caches"""
+    if persistent_cache is not None:
+        persistent_cache.put(atlas, key, svp_data)
+    svp_cache.put((atlas, key), svp_data)
+
+
 def get_ssm_synthetic_svp(
         latitude: float,
         longitude: float,
         timestamp: datetime) -> List[Tuple[float, float]]:
     """ Generates a synthetic SVP based on the given location and time. Will
-    raise a SyntheticSvpGenerationException if the process fails.
+    raise a SyntheticSvpGenerationException if the process fails. Profiles
+    are cached (in memory, and on disk if the persistent cache is enabled) by
+    atlas grid cell and time bin, so repeated queries within the same cell do
+    not query the atlas.
+    """
+    key = get_atlas_cell(latitude, longitude, timestamp)
+    svp_data = _get_cached_svp(key)
+    if svp_data is None:
+        svp_data = _query_ssm_synthetic_svp(latitude, longitude, timestamp)
+        _cache_svp(key, svp_data)
+    return svp_data
+
+
+def _init_worker() -> None:
+    """ Initialises a worker process with its own atlas instance"""
+    global atlas_singleton
+    atlas_singleton = None
+    get_ssm_atlas()
+
+
+def _query_ssm_synthetic_svp_worker(
+        position: Tuple[float, float, datetime]
+        ) -> List[Tuple[float, float]]:
+    latitude, longitude, timestamp = position
+    return _query_ssm_synthetic_svp(latitude, longitude, timestamp)
+
+
+def _query_ssm_synthetic_svps(
+        to_query: Dict[Tuple[int, int, int], Tuple[float, float, datetime]],
+        jobs: int) -> Iterator[Tuple[Tuple[int, int, int], List]]:
+    """ Queries the SSM atlas for the profile of each atlas cell, using
+    `jobs` worker processes. Yields each atlas cell and its profile.
+    """
+    if jobs <= 1:
+        for (key, position) in to_query.items():
+            yield (key, _query_ssm_synthetic_svp(*position))
+        return
+
+    # make sure the atlas is present (this may download it) before
+    # the workers start
+    get_ssm_atlas()
+    # use spawn rather than fork, the atlas holds open netCDF/HDF5
+    # files that are not safe to share with forked processes
+    executor = ProcessPoolExecutor(
+        max_workers=min(jobs, len(to_query)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker
+    )
+    with executor:
+        queried = executor.map(
+            _query_ssm_synthetic_svp_worker,
+            to_query.values()
+        )
+        yield from zip(to_query.keys(), queried)
+
+
+def _query_batch_synthetic_svps(
+        cells: List[Tuple[int, int, int]]
+        ) -> List[List[Tuple[float, float]]]:
+    """ Calculates the profiles of many atlas cells together from the WOA18
+    grid. None is returned for cells that have no data in the grid.
     """
+    # numpy, netCDF4 and gsw are only needed by the batch engine
+    from mergesvp.lib.atlasgrid import load_woa18_grid
+
+    # the SSM atlas is only used to make sure the WOA18 data is available
+    atlas = get_ssm_atlas()
+    grid = load_woa18_grid(atlas.data_folder, cells)
+    return grid.profiles(cells)
+
+
+def get_atlas_grid_profiles(
+        cells: List[Tuple[int, int, int]]
+        ) -> List[List[Tuple[float, float]]]:
+    """ Calculates the profiles of many atlas cells together from the WOA18
+    grid, or the atlas extract if one has been configured. SSM is not
+    queried and the profiles are not cached, so this is a cheap way to
+    compare cells before synthetic SVPs are generated. None is returned for
+    cells that have no data in the grid.
+    """
+    if atlas_extract is not None:
+        return atlas_extract.profiles(cells)
+    return _query_batch_synthetic_svps(cells)
+
+
+def iter_ssm_synthetic_svps(
+        positions: List[Tuple[float, float, datetime]],
+        jobs: int = 1,
+        engine: str = 'ssm') -> Iterator[List[Tuple[float, float]]]:
+    """ Generates synthetic SVPs for many positions (latitude, longitude,
+    and timestamp). Profiles are yielded in the same order as the positions,
+    each as soon as it is available. Cached profiles are used where
+    available.
+
+    With the 'ssm' engine the remaining atlas queries are run by `jobs`
+    worker processes (0 uses all available CPUs) that each create their own
+    atlas. The 'batch' engine calculates all remaining profiles together,
+    falling back to SSM for any cells that the batch engine has no data for.
+    If an atlas extract has been configured (see `configure_atlas_extract`)
+    all profiles are calculated from the extract.
+    """
+    if engine not in ATLAS_ENGINES:
+        raise ValueError(f"Unknown atlas engine {engine}")
+    if jobs == 0:
+        jobs = os.cpu_count()
+    # profiles from an atlas extract are calculated by the batch engine
+    if atlas_extract is not None:
+        engine = 'batch'
+
+    if jobs <= 1 and engine == 'ssm':
+        for (latitude, longitude, timestamp) in positions:
+            yield get_ssm_synthetic_svp(latitude, longitude, timestamp)
+        return
+
+    atlas = ATLAS_NAME if engine == 'ssm' else BATCH_ATLAS_NAME
+    keys = [get_atlas_cell(*position) for position in positions]
+    # profiles for each atlas cell, multiple positions may share a cell
+    cell_svps = {}
+    to_query = {}
+    for (key, position) in zip(keys, positions):
+        if key in cell_svps or key in to_query:
+            continue
+        svp_data = _get_cached_svp(key, atlas)
+        if svp_data is None:
+            to_query[key] = position
+        else:
+            cell_svps[key] = svp_data
+
+    if engine == 'batch' and len(to_query) != 0:
+        cells = list(to_query.keys())
+        if atlas_extract is not None:
+            batch_svps = atlas_extract.profiles(cells)
+        else:
+            batch_svps = _query_batch_synthetic_svps(cells)
+        for (key, svp_data) in zip(cells, batch_svps):
+            if svp_data is None or len(svp_data) == 0:
+                if atlas_extract is not None:
+                    # extracts are used when the full atlas is not
+                    # available, so there is no fallback
+                    latitude, longitude, _ = to_query[key]
+                    raise SyntheticSvpGenerationException(
+                        f"No atlas extract data near {latitude:.5f}, "
+                        f"{longitude:.5f} for month {key[2]}")
+                # no data in the grid, leave this cell for SSM
+                continue
+            _cache_svp(key, svp_data, atlas)
+            cell_svps[key] = svp_data
+            del to_query[key]
+
+        # the remaining cells are generated by SSM, so may have been cached
+        # by an earlier SSM query
+        for key in list(to_query.keys()):
+            svp_data = _get_cached_svp(key, ATLAS_NAME)
+            if svp_data is not None:
+                cell_svps[key] = svp_data
+                del to_query[key]
+
+    # cells are queried in the order they are first used by the positions, so
+    # the results are consumed as the positions that need them are reached.
+    # Nothing is queried (or started) until the first result is needed.
+    queried = _query_ssm_synthetic_svps(to_query, jobs)
+    try:
+        for key in keys:
+            while key not in cell_svps:
+                (queried_key, svp_data) = next(queried)
+                # always an SSM profile, even when the batch engine is used
+                _cache_svp(queried_key, svp_data, ATLAS_NAME)
+                cell_svps[queried_key] = svp_data
+            yield list(cell_svps[key])
+    finally:
+        # shuts down any worker processes if iteration stops early
+        queried.close()
+
+
+def _query_ssm_synthetic_svp(
+        latitude: float,
+        longitude: float,
+        timestamp: datetime) -> List[Tuple[float, float]]:
+    """ Queries the SSM atlas for a synthetic SVP"""
     atlas = get_ssm_atlas()
     profiles = atlas.query(lat=latitude, lon=longitude, dtstamp=timestamp)
 
@@ -2,9 +2,11 @@ from datetime import datetime
 from enum import Enum
 from typing import List, Tuple
 from pathlib import Path
-import json
 
-from mergesvp.lib.geojson import GeojsonFeature, GeojsonPointFeature, GeojsonRoot
+from mergesvp.lib.geojson import \
+    GeojsonFeature, \
+    GeojsonPointFeature, \
+    GeojsonWriter
 
 
 class SvpProfileFormat(Enum):
@@ -37,7 +39,8 @@ class SvpProfile:
             self.depth_speed = []
         else:
             self.depth_speed = depth_speed
-        # list of warning messages generated when parsing file
+        # list of warning messages generated when parsing file header info.
+        # Lines that fail to parse are only counted, see `warningsummary`
         self.warnings = []
 
     def has_warning(self) -> bool:
@@ -54,21 +57,12 @@ class SvpProfile:
 
 def svps_to_geojson_file(
         svps: List[SvpProfile],
-        output_file: Path) -> None:
-    """ Writes a list of SVPs to a geojson file
+        output_file: Path,
+        format: str = 'indent',
+        precision: int = None) -> None:
+    """ Writes a list of SVPs to a geojson file, see `GeojsonWriter` for the
+    format and precision
     """
-    geojson_object = GeojsonRoot()
-    for svp in svps:
-        geojson_object.feature_collection.add_feature(
-            svp.to_geojson_object()
-        )
-
-    geojson = geojson_object.to_geojson()
-
-    with output_file.open('w') as f:
-        f.write(
-            json.dumps(
-                geojson,
-                indent=2
-            )
-        )
+    with GeojsonWriter.open(output_file, format, precision) as writer:
+        for svp in svps:
+            writer.write_feature(svp.to_geojson_object())
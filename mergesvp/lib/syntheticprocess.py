@@ -5,43 +5,86 @@ data
 import click
 import os
 import time
+from contextlib import closing
 from pathlib import Path
-from typing import TextIO, List, Tuple
+from typing import Iterator, TextIO, List, Tuple
 from datetime import datetime, timedelta
 
-from mergesvp.lib.svpprofile import SvpProfile, svps_to_geojson_file
-from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.checkpoint import SvpCheckpoint, get_checkpoint_path
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+from mergesvp.lib.svpprofile import SvpProfile
+from mergesvp.lib.outputs import CarisSink, GeojsonSink, write_outputs
+from mergesvp.lib.pipeline import BackgroundTasks, iter_in_background
+from mergesvp.lib.metrics import \
+    add_cache_metrics, \
+    add_files_read, \
+    add_metric
+from mergesvp.lib.profiling import stage
 from mergesvp.lib.tracklines import \
     Trackline, \
-    TracklinesParser, \
-    tracklines_to_geojson_file, \
-    sort_tracklines
-from mergesvp.lib.ssminterface import get_ssm_synthetic_svp
-
-
-def get_synthetic_svp(
-        time: datetime,
-        trackline: Trackline) -> SvpProfile:
-    """ Generates a synthetic SVP for the given time based on the trackline
-    data.
+    TracklineIndex, \
+    TracklineNormalisationReport, \
+    join_tracklines, \
+    normalise_trackline_list, \
+    tracklines_to_geojson_file
+from mergesvp.lib.tracklinecache import load_tracklines_files
+from mergesvp.lib.utils import max_speed_difference
+from mergesvp.lib.warningsummary import add_warning
+from mergesvp.lib.ssminterface import \
+    configure_atlas_extract, \
+    configure_persistent_cache, \
+    configure_svp_cache, \
+    get_atlas_cell, \
+    get_atlas_grid_profiles, \
+    get_ssm_synthetic_svp, \
+    iter_ssm_synthetic_svps
+
+
+def _get_positions(
+        times: List[datetime],
+        trackline: Trackline) -> List[Tuple[float, float, datetime]]:
+    """ Gets the interpolated location (latitude, longitude, time) of each
+    time based on the trackline data"""
+    trackline_index = TracklineIndex([trackline])
+    lerp_points = [trackline_index.get_lerp_point(time) for time in times]
+    return [
+        (lerp_point.latitude, lerp_point.longitude, time)
+        for (lerp_point, time) in zip(lerp_points, times)
+    ]
+
+
+def _iter_position_svps(
+        positions: List[Tuple[float, float, datetime]],
+        jobs: int = 1,
+        engine: str = 'ssm',
+        checkpoint: SvpCheckpoint = None) -> Iterator[SvpProfile]:
+    """ Generates a synthetic SVP for each position (latitude, longitude,
+    timestamp), yielding each SVP as soon as it is available. Atlas queries
+    are run in `jobs` worker processes, or together if the 'batch' atlas
+    engine is used. If a checkpoint is given, profiles already in the
+    checkpoint are reused and new profiles are added to it.
     """
-    # get the interpolated location of this time based on the trackline
-    # data
-    lerp_point = trackline.get_lerp_point(time)
-
-    synthetic_svp = SvpProfile()
-    synthetic_svp.timestamp = time
-    synthetic_svp.latitude = lerp_point.latitude
-    synthetic_svp.longitude = lerp_point.longitude
-
-    svp_data = get_ssm_synthetic_svp(
-        latitude=lerp_point.latitude,
-        longitude=lerp_point.longitude,
-        timestamp=time
-    )
-    synthetic_svp.depth_speed = svp_data
-
-    return synthetic_svp
+    if checkpoint is None:
+        svps_data = iter_ssm_synthetic_svps(positions, jobs, engine)
+    else:
+        svps_data = checkpoint.iter_profiles(
+            positions,
+            lambda to_generate: iter_ssm_synthetic_svps(
+                to_generate, jobs, engine)
+        )
+    try:
+        for ((latitude, longitude, time), svp_data) in \
+                zip(positions, svps_data):
+            yield SvpProfile(
+                timestamp=time,
+                latitude=latitude,
+                longitude=longitude,
+                depth_speed=svp_data
+            )
+    finally:
+        # closes the checkpoint journal, and any worker processes, if
+        # iteration stops early
+        svps_data.close()
 
 
 class SyntheticSvpProcessor:
@@ -51,12 +94,25 @@ class SyntheticSvpProcessor:
 
     def __init__(
             self,
-            tracklines_input: Path,
+            tracklines_input: List[Path],
             output: TextIO,
             time_gap: float = 4,
             generate_summary: bool = False,
             fail_on_error: bool = False,
-            date_format: str = r'%d/%m/%y') -> None:
+            date_format: str = r'%d/%m/%y',
+            simplify_tolerance: float = 0,
+            use_trackline_cache: bool = False,
+            jobs: int = 1,
+            atlas_cache_size: int = 1024,
+            persistent_cache_size: float = 0,
+            atlas_engine: str = 'ssm',
+            atlas_extract: Path = None,
+            speed_tolerance: float = 0,
+            min_time_gap: float = 0.5,
+            max_time_gap: float = 12,
+            resume: bool = False,
+            geojson_format: str = 'indent',
+            geojson_precision: int = None) -> None:
         self.tracklines_input = tracklines_input
         self.output = output
         self.time_gap = time_gap
@@ -65,27 +121,47 @@ class SyntheticSvpProcessor:
         self.generate_summary = generate_summary
         self.fail_on_error = fail_on_error
         self.date_format = date_format
+        # tolerance (metres) used to simplify the tracklines summary
+        self.simplify_tolerance = simplify_tolerance
+        # should the parsed tracklines be cached alongside the tracklines file
+        self.use_trackline_cache = use_trackline_cache
+        # number of worker processes used to read tracklines and query the
+        # atlas, 0 uses all available CPUs
+        self.jobs = jobs
+        # number of synthetic profiles cached in memory, 0 disables the cache
+        self.atlas_cache_size = atlas_cache_size
+        # maximum size (MB) of the on disk cache of synthetic profiles shared
+        # across runs, 0 disables the persistent cache
+        self.persistent_cache_size = persistent_cache_size
+        # how synthetic profiles are generated from the atlas, see
+        # `ssminterface.ATLAS_ENGINES`
+        self.atlas_engine = atlas_engine
+        # regional atlas extract file used instead of the full atlas
+        self.atlas_extract = atlas_extract
+        # maximum change (m/s) in atlas sound speed between synthetic SVPs,
+        # 0 places SVPs every `time_gap` hours. If set SVPs are placed
+        # between `min_time_gap` and `max_time_gap` hours apart.
+        self.speed_tolerance = speed_tolerance
+        self.min_time_gap = min_time_gap
+        self.max_time_gap = max_time_gap
+        # reuse the synthetic profiles in the checkpoint file left by a
+        # previous run that failed
+        self.resume = resume
+        # format and coordinate precision of the geojson summary files, see
+        # `GeojsonWriter`
+        self.geojson_format = geojson_format
+        self.geojson_precision = geojson_precision
 
-        # list of SvpProfiles
-        self.svps = []
         # merged version of all tracklines loaded from the tracklines_input 
         self.trackline = []
-        # list of warning messages (str)
-        self.warnings = []
 
 
     def _validate_trackline(self):
+        # chronological order of the points is checked when the tracklines
+        # are normalised
         if len(self.trackline.points) < 2:
             raise RuntimeError("Trackline must include at least 2 points")
 
-        last_time = None
-        for pt in self.trackline.points:
-            if last_time is not None:
-                if last_time > pt.timestamp:
-                    raise RuntimeError(
-                        "Trackline points not in chronological order")
-            last_time = pt.timestamp
-
 
     def _get_svp_times(self) -> List[datetime]:
         """ Gets a list of datetimes for when synthetic SVPs should be
@@ -104,69 +180,269 @@ class SyntheticSvpProcessor:
         return svp_times
 
 
+    def _get_adaptive_svp_times(self) -> List[datetime]:
+        """ Gets a list of datetimes for when synthetic SVPs should be
+        generated, spaced by how much the atlas sound speed changes along
+        the trackline. The trackline is sampled every `min_time_gap` hours;
+        a sample becomes a synthetic SVP if it is in a different atlas grid
+        cell to the last SVP and its profile differs by more than
+        `speed_tolerance`, or if `max_time_gap` hours have passed since the
+        last SVP.
+
+        Profiles are compared using the selected atlas engine. With the
+        'ssm' engine a profile is only generated for each cell that is
+        compared (and is cached, so it is reused if the sample becomes an
+        SVP). The 'batch' engine, and atlas extracts, calculate the
+        profiles of all cells together from the atlas grid; if the grid is
+        not available SVPs are placed every `time_gap` hours instead.
+        """
+        if self.min_time_gap <= 0:
+            raise RuntimeError("Minimum time gap must be greater than 0")
+        start = self.trackline.points[0].timestamp
+        end = self.trackline.points[-1].timestamp
+        min_dt = timedelta(hours=self.min_time_gap)
+        max_dt = timedelta(hours=self.max_time_gap)
+
+        sample_times = []
+        current = start
+        while current <= end:
+            sample_times.append(current)
+            current += min_dt
+        positions = _get_positions(sample_times, self.trackline)
+        cells = [get_atlas_cell(*position) for position in positions]
+
+        profiles = {}
+        if self.atlas_engine != 'ssm' or self.atlas_extract is not None:
+            unique_cells = list(dict.fromkeys(cells))
+            try:
+                profiles = dict(zip(
+                    unique_cells,
+                    get_atlas_grid_profiles(unique_cells)
+                ))
+            except (SyntheticSvpGenerationException, ImportError) as ex:
+                add_warning(
+                    'adaptive_spacing',
+                    "Atlas grid is not available to compare profiles, "
+                    "synthetic SVPs are placed every time gap",
+                    sample=str(ex)
+                )
+                return self._get_svp_times()
+
+        def get_profile(i: int) -> List[Tuple[float, float]]:
+            cell = cells[i]
+            if cell not in profiles:
+                profiles[cell] = get_ssm_synthetic_svp(*positions[i])
+            return profiles[cell]
+
+        svp_times = [sample_times[0]]
+        last = 0
+        for i in range(1, len(sample_times)):
+            if sample_times[i] - sample_times[last] >= max_dt:
+                is_svp = True
+            elif cells[i] == cells[last]:
+                is_svp = False
+            else:
+                last_profile = get_profile(last)
+                profile = get_profile(i)
+                # cells without grid data are not compared, only profiles
+                # calculated the same way are compared
+                is_svp = bool(last_profile) and bool(profile) and \
+                    max_speed_difference(last_profile, profile) > \
+                    self.speed_tolerance
+            if is_svp:
+                svp_times.append(sample_times[i])
+                last = i
+
+        return svp_times
+
+
+    def _get_checkpoint(self, output_path: Path) -> SvpCheckpoint:
+        """ Gets the checkpoint that synthetic profiles are journaled to
+        while they are generated"""
+        return SvpCheckpoint(
+            get_checkpoint_path(output_path),
+            {
+                'command': 'synthetic-svp',
+                'atlas_engine': self.atlas_engine,
+                'atlas_extract': None if self.atlas_extract is None
+                else str(self.atlas_extract),
+            },
+            resume=self.resume
+        )
+
+
     def process(self):
-        # load the tracklines data. Location information for each synthetic SVP
-        # is derived from this data
-        parser = TracklinesParser()
-        parser.date_format = self.date_format
-        tracklines = parser.read(self.tracklines_input)
-        sort_tracklines(tracklines)
-        if self.generate_summary:
-            tl_geojson = Path(self.output.name + '_tracklines.geojson')
-            tracklines_to_geojson_file(tracklines, tl_geojson)
-
-        # merge all tracklines into a single trackline
-        # makes processing easier and gives more reasonable results as
-        # SVP location picking will not restart at the beginning of each arbitrary
-        # trackline
-        self.trackline = Trackline.merge_tracklines(tracklines)
-
-        # remove points on the trackline that have the same date and time, this
-        # breaks the interpolation process when calculating location.
-        self.trackline = Trackline.filter_duplicate_points(self.trackline)
-
-        # check trackline points are in the right order
-        self._validate_trackline()
-
-        svp_times = self._get_svp_times()
-
-        with click.progressbar(svp_times, label="Generating synthetic SVPs") as svp_ts:
-            self.svps = [
-                get_synthetic_svp(svp_time, self.trackline)
-                for svp_time in svp_ts
-            ]
-
-        if self.generate_summary:
-            svp_synth_geojson = Path(self.output.name + '_synth_svps.geojson')
-            svps_to_geojson_file(self.svps, svp_synth_geojson)
-
-        # now write output file
-        writer = CarisSvpParser()
-        writer.show_progress = True
-        output_path = Path(os.path.realpath(self.output.name))
-        writer.write_many(output_path, self.svps)
+        svp_cache = configure_svp_cache(self.atlas_cache_size)
+        persistent_cache = configure_persistent_cache(
+            self.persistent_cache_size)
+        configure_atlas_extract(self.atlas_extract)
+
+        # summary files are written in the background while the synthetic
+        # SVPs are generated
+        with BackgroundTasks() as background:
+            # load the tracklines data. Location information for each
+            # synthetic SVP is derived from this data
+            # tracklines read from the cache were normalised before they
+            # were cached, what this removed is added to the report as they
+            # are read
+            report = TracklineNormalisationReport()
+            with stage('read tracklines') as read_stage:
+                tracklines = load_tracklines_files(
+                    self.tracklines_input,
+                    self.date_format,
+                    use_cache=self.use_trackline_cache,
+                    jobs=self.jobs,
+                    report=report
+                )
+                read_stage.items += sum(len(tl.points) for tl in tracklines)
+            add_metric('files_discovered', len(self.tracklines_input))
+            add_files_read(self.tracklines_input)
+
+            # merge all tracklines into a single trackline
+            # makes processing easier and gives more reasonable results as
+            # SVP location picking will not restart at the beginning of each
+            # arbitrary trackline. This also removes points on the trackline
+            # that have the same date and time (breaks the interpolation
+            # process when calculating location) and checks the trackline
+            # points are in the right order.
+            with stage('normalise tracklines') as normalise_stage:
+                tracklines, report = normalise_trackline_list(
+                    tracklines, report)
+                self.trackline = join_tracklines(tracklines, report)
+                normalise_stage.items += len(self.trackline.points)
+            # includes the points removed before the tracklines were cached
+            add_metric('trackline_points_read', report.input_points)
+            click.echo(str(report))
+
+            # tracklines are not modified after they have been normalised
+            if self.generate_summary:
+                tl_geojson = Path(self.output.name + '_tracklines.geojson')
+                background.submit(
+                    tracklines_to_geojson_file,
+                    tracklines,
+                    tl_geojson,
+                    self.simplify_tolerance,
+                    self.geojson_format,
+                    self.geojson_precision
+                )
+
+            self._validate_trackline()
+
+            with stage('find SVP times') as times_stage:
+                if self.speed_tolerance > 0:
+                    svp_times = self._get_adaptive_svp_times()
+                else:
+                    svp_times = self._get_svp_times()
+                times_stage.items += len(svp_times)
+            click.echo(f"Generating {len(svp_times)} synthetic SVPs")
+
+            with stage('interpolate trackline') as interpolate_stage:
+                positions = _get_positions(svp_times, self.trackline)
+                interpolate_stage.items += len(positions)
+
+            # the atlas is queried in a background thread, and each synthetic
+            # SVP is written to the output file as soon as it is generated.
+            # Profiles are also journaled to a checkpoint file so a failed
+            # run can be resumed, the checkpoint is removed on success.
+            output_path = Path(os.path.realpath(self.output.name))
+            # the summary of the SVPs is written as they are generated, so
+            # they are not kept in memory
+            sinks = [CarisSink(output_path)]
+            if self.generate_summary:
+                sinks.append(GeojsonSink(
+                    Path(self.output.name + '_synth_svps.geojson'),
+                    self.geojson_format,
+                    self.geojson_precision
+                ))
+            # atlas queries and writing overlap, so are profiled together
+            with stage('generate and write SVPs') as generate_stage, \
+                    self._get_checkpoint(output_path) as checkpoint:
+                # the background thread is stopped before the checkpoint is
+                # closed, even if writing fails
+                with closing(iter_in_background(_iter_position_svps(
+                        positions,
+                        self.jobs,
+                        self.atlas_engine,
+                        checkpoint))) as svps, \
+                        click.progressbar(
+                            svps,
+                            length=len(positions),
+                            label="Generating synthetic SVPs") as svps_iter:
+                    num_written = write_outputs(svps_iter, sinks)
+                generate_stage.items += num_written
+            add_metric('synthetic_profiles_generated', num_written)
+            add_metric('profiles_written', num_written)
+            add_cache_metrics(svp_cache, persistent_cache)
+
+            click.echo(svp_cache.summary())
+            if persistent_cache is not None:
+                click.echo(persistent_cache.summary())
+
+            # time spent waiting for the summary files still being written
+            with stage('write summary files'):
+                background.wait()
 
 
 def synthetic_svp_process(
-        tracklines: Path,
+        tracklines: List[Path],
         output: TextIO,
         time_gap: float = 4,
         generate_summary: bool = False,
         fail_on_error: bool = False,
-        date_format: str = r'%d/%m/%y') -> None:
+        date_format: str = r'%d/%m/%y',
+        simplify_tolerance: float = 0,
+        use_trackline_cache: bool = False,
+        jobs: int = 1,
+        atlas_cache_size: int = 1024,
+        persistent_cache_size: float = 0,
+        atlas_engine: str = 'ssm',
+        atlas_extract: Path = None,
+        speed_tolerance: float = 0,
+        min_time_gap: float = 0.5,
+        max_time_gap: float = 12,
+        resume: bool = False,
+        geojson_format: str = 'indent',
+        geojson_precision: int = None) -> None:
     """
     Main entry point for the synthetic process whereby synthetic SVP
     profiles are generated along the entire length of a tracklines dataset.
     Profiles are generated at a frequency based on the `time_gap` parameter
 
     Args:
-        tracklines: Path to CSV file including trackline data
+        tracklines: Paths to CSV files including trackline data
         output: CARIS SVP output with supplemented synthetic SVPs
         generate_summary: generate a summary geojson file that includes
             locations of synthetic SVP data
         fail_on_error: escalates any warnings that occur to exceptions
         time_gap: time between each synthetic SVP profile
         date_format: python format string to parse date (eg '%d/%m/%y')
+        simplify_tolerance: tolerance (metres) used to simplify the
+            tracklines summary, 0 disables simplification
+        use_trackline_cache: cache the parsed tracklines in a binary file
+            alongside the tracklines file, and use it in later runs
+        jobs: number of worker processes used, 0 uses all available CPUs
+        atlas_cache_size: number of synthetic profiles (one per atlas grid
+            cell and month) cached in memory, 0 disables the cache
+        persistent_cache_size: maximum size (MB) of the on disk cache of
+            synthetic profiles shared across runs, 0 disables the cache
+        atlas_engine: 'ssm' queries the SSM atlas for each synthetic
+            profile, 'batch' calculates all profiles together from the
+            WOA18 grid
+        atlas_extract: path to an atlas extract file (see the
+            `extract-atlas` command) used instead of the full atlas
+        speed_tolerance: space synthetic SVPs by how much the atlas sound
+            speed changes (m/s) along the trackline, rather than every
+            `time_gap` hours. 0 uses a fixed `time_gap`.
+        min_time_gap: minimum time (hours) between synthetic SVPs when
+            `speed_tolerance` is used
+        max_time_gap: maximum time (hours) between synthetic SVPs when
+            `speed_tolerance` is used
+        resume: reuse the synthetic profiles in the checkpoint file left
+            alongside the output by a previous run that failed
+        geojson_format: format of the geojson summary files; indent,
+            compact, or ndjson (newline-delimited features)
+        geojson_precision: number of decimal places coordinates in the
+            geojson summary files are rounded to, None for full precision
 
     Returns:
         None
@@ -180,6 +456,19 @@ def synthetic_svp_process(
         time_gap=time_gap,
         generate_summary=generate_summary,
         fail_on_error=fail_on_error,
-        date_format=date_format
+        date_format=date_format,
+        simplify_tolerance=simplify_tolerance,
+        use_trackline_cache=use_trackline_cache,
+        jobs=jobs,
+        atlas_cache_size=atlas_cache_size,
+        persistent_cache_size=persistent_cache_size,
+        atlas_engine=atlas_engine,
+        atlas_extract=atlas_extract,
+        speed_tolerance=speed_tolerance,
+        min_time_gap=min_time_gap,
+        max_time_gap=max_time_gap,
+        resume=resume,
+        geojson_format=geojson_format,
+        geojson_precision=geojson_precision
     )
     processor.process()
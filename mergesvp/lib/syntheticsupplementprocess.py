@@ -3,22 +3,36 @@ data.
 """
 
 from datetime import datetime, timedelta
-from tkinter import FLAT
 import click
 import os
 import math
+from contextlib import closing
 from pathlib import Path
-from typing import List, TextIO, Tuple
+from typing import Iterator, List, TextIO, Tuple
 
+from mergesvp.lib.checkpoint import SvpCheckpoint, get_checkpoint_path
 from mergesvp.lib.svpprofile import SvpProfile, svps_to_geojson_file
+from mergesvp.lib.outputs import CarisSink, GeojsonSink, write_outputs
 from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.pipeline import BackgroundTasks, iter_in_background
+from mergesvp.lib.metrics import \
+    add_cache_metrics, \
+    add_files_read, \
+    add_metric
+from mergesvp.lib.profiling import stage
 from mergesvp.lib.tracklines import \
-    Trackline, \
-    TracklinesParser, \
-    tracklines_to_geojson_file, \
-    sort_tracklines
+    TracklineIndex, \
+    TracklineNormalisationReport, \
+    normalise_trackline_list, \
+    tracklines_to_geojson_file
+from mergesvp.lib.tracklinecache import load_tracklines_files
 from mergesvp.lib.utils import sort_svp_list, timedelta_to_hours
-from mergesvp.lib.ssminterface import get_ssm_synthetic_svp
+from mergesvp.lib.warningsummary import add_warning
+from mergesvp.lib.ssminterface import \
+    configure_atlas_extract, \
+    configure_persistent_cache, \
+    configure_svp_cache, \
+    iter_ssm_synthetic_svps
 
 
 def load_svps(path: Path, fail_on_error: bool) -> List[SvpProfile]:
@@ -66,25 +80,35 @@ def find_gaps(
     return gaps
 
 
-def get_synthetic_svp(
-        time: datetime,
-        latitude: float,
-        longitude: float) -> SvpProfile:
-    """ Generates a synthetic SVP for the given time and location
+def get_trackline_time_windows(
+        svps: List[SvpProfile],
+        gaps: List[Tuple[SvpProfile, SvpProfile, float]],
+        padding: float) -> List[Tuple[datetime, datetime]]:
     """
-    synthetic_svp = SvpProfile()
-    synthetic_svp.timestamp = time
-    synthetic_svp.latitude = latitude
-    synthetic_svp.longitude = longitude
-
-    svp_data = get_ssm_synthetic_svp(
-        latitude=latitude,
-        longitude=longitude,
-        timestamp=time
-    )
-    synthetic_svp.depth_speed = svp_data
+    Gets the time windows that trackline data is needed for. This includes
+    the time of each SVP (so it can be located) and each gap that will be
+    filled with synthetic SVPs.
+
+    Args:
+        svps: List of SVPs sorted by timestamp
+        gaps: gaps between the SVPs, as returned by `find_gaps`
+        padding: time (in hours) added to either side of each window so
+            that there are trackline points to interpolate between
 
-    return synthetic_svp
+    Returns:
+        A list of tuples, each tuple includes the start and end datetime
+        of the window
+    """
+    pad = timedelta(hours=padding)
+    windows = [
+        (svp.timestamp - pad, svp.timestamp + pad)
+        for svp in svps
+    ]
+    windows.extend([
+        (svp_start.timestamp - pad, svp_end.timestamp + pad)
+        for (svp_start, svp_end, _) in gaps
+    ])
+    return windows
 
 
 def calc_interval(
@@ -109,12 +133,23 @@ class SyntheticSupplementSvpProcessor:
     def __init__(
             self,
             input: Path,
-            tracklines_input: Path,
+            tracklines_input: List[Path],
             output: TextIO,
             time_threshold: float = 4,
             generate_summary: bool = False,
             fail_on_error: bool = False,
-            date_format: str = r'%d/%m/%y') -> None:
+            date_format: str = r'%d/%m/%y',
+            trackline_padding: float = 0.5,
+            simplify_tolerance: float = 0,
+            use_trackline_cache: bool = False,
+            jobs: int = 1,
+            atlas_cache_size: int = 1024,
+            persistent_cache_size: float = 0,
+            atlas_engine: str = 'ssm',
+            atlas_extract: Path = None,
+            resume: bool = False,
+            geojson_format: str = 'indent',
+            geojson_precision: int = None) -> None:
         self.input = input
         self.tracklines_input = tracklines_input
         self.output = output
@@ -124,33 +159,63 @@ class SyntheticSupplementSvpProcessor:
         self.generate_summary = generate_summary
         self.fail_on_error = fail_on_error
         self.date_format = date_format
+        # time (hours) of trackline data read either side of each SVP and gap,
+        # trackline data outside of these times is not loaded.
+        self.trackline_padding = trackline_padding
+        # tolerance (metres) used to simplify the tracklines summary
+        self.simplify_tolerance = simplify_tolerance
+        # should the parsed tracklines be cached alongside the tracklines file
+        self.use_trackline_cache = use_trackline_cache
+        # number of worker processes used to read tracklines and query the
+        # atlas, 0 uses all available CPUs
+        self.jobs = jobs
+        # number of synthetic profiles cached in memory, 0 disables the cache
+        self.atlas_cache_size = atlas_cache_size
+        # maximum size (MB) of the on disk cache of synthetic profiles shared
+        # across runs, 0 disables the persistent cache
+        self.persistent_cache_size = persistent_cache_size
+        # how synthetic profiles are generated from the atlas, see
+        # `ssminterface.ATLAS_ENGINES`
+        self.atlas_engine = atlas_engine
+        # regional atlas extract file used instead of the full atlas
+        self.atlas_extract = atlas_extract
+        # reuse the synthetic profiles in the checkpoint file left by a
+        # previous run that failed
+        self.resume = resume
+        # format and coordinate precision of the geojson summary files, see
+        # `GeojsonWriter`
+        self.geojson_format = geojson_format
+        self.geojson_precision = geojson_precision
 
-        # list of SvpProfiles
-        self.svps = []
         # list of Tracklines
         self.tracklines = []
-        # list of warning messages (str)
-        self.warnings = []
+        # index of self.tracklines, see `_get_trackline_index`
+        self._trackline_index = None
 
 
-    def _update_svp_coords(self) -> None:
-        """
-        Updates the coordinates of existing SVPs (in `self.svps`) based on the
-        trackline data. This is necessary as most SVPs do not include location
+    def _get_trackline_index(self) -> TracklineIndex:
+        """ Gets the index of `self.tracklines`, built when first needed"""
+        if self._trackline_index is None or \
+                self._trackline_index.tracklines is not self.tracklines:
+            self._trackline_index = TracklineIndex(self.tracklines)
+        return self._trackline_index
+
+
+    def _set_svp_coords(self, svp: SvpProfile) -> None:
+        """ Sets the coordinates of an existing SVP based on the trackline
+        data. This is necessary as most SVPs do not include location
         information.
         """
-        for svp in self.svps:
-            trackline = Trackline.get_containing_trackline(
-                self.tracklines,
-                svp.timestamp
+        lerp_point = self._get_trackline_index().get_lerp_point(svp.timestamp)
+        if lerp_point is None:
+            add_warning(
+                'trackline_coverage',
+                "Unable to identify trackline for SVP",
+                sample=svp.timestamp
             )
-            if trackline is None:
-                msg = (f"Unable to identify trackline for SVP at {svp.timestamp}")
-                self.warnings.append(msg)
-                continue
-            lerp_point = trackline.get_lerp_point(svp.timestamp)
-            svp.latitude = lerp_point.latitude
-            svp.longitude = lerp_point.longitude
+            return
+        svp.latitude = lerp_point.latitude
+        svp.longitude = lerp_point.longitude
 
 
     def _get_supplement_coords(
@@ -173,27 +238,25 @@ class SyntheticSupplementSvpProcessor:
         """
         coords_list = []
 
+        trackline_index = self._get_trackline_index()
         dt = timedelta(hours=interval)
         current_time = svp_start.timestamp + dt
 
         while current_time < svp_end.timestamp:
-            trackline = Trackline.get_containing_trackline(
-                self.tracklines,
-                current_time
-            )
-
-            if trackline is None:
-                self.warnings.append(
-                    f"Could not identify trackline that covers time {current_time} "
-                    "this SVP was skipped"
+            # get the interpolated location of this time based on the trackline
+            # data
+            lerp_point = trackline_index.get_lerp_point(current_time)
+
+            if lerp_point is None:
+                add_warning(
+                    'trackline_coverage',
+                    "Could not identify trackline that covers time, this SVP "
+                    "was skipped",
+                    sample=current_time
                 )
                 current_time += dt
                 continue
 
-            # get the interpolated location of this time based on the trackline
-            # data
-            lerp_point = trackline.get_lerp_point(current_time)
-
             coord = (current_time, lerp_point.latitude, lerp_point.longitude)
             coords_list.append(coord)
 
@@ -202,83 +265,237 @@ class SyntheticSupplementSvpProcessor:
         return coords_list
 
 
-    def _fill_gap(self, svp1: SvpProfile, svp2: SvpProfile, dt: float) -> None:
-        """ Fills the gap between the two SVPs with synthetic data at
-        locations determined by interpolating the trackline data. New
-        SvpProfiles are inserted into this objects list of SVPs
+    def _get_gaps_coords(
+            self,
+            svps: List[SvpProfile]
+            ) -> List[Tuple[Tuple[SvpProfile, SvpProfile, float], List]]:
+        """ Finds the gaps between the SVPs, and the coordinates of the
+        synthetic SVPs needed to fill each gap (see `_get_supplement_coords`)
         """
-        # get the time between the new SVPs we will generate
-        interval = calc_interval(svp1, svp2, self.time_threshold)
-        # list of coords that we need to get synthetic SVPs for
-        supp_coords = self._get_supplement_coords(svp1, svp2, interval)
-
-        synthetic_svps = [
-            get_synthetic_svp(timestamp, latitude, longitude)
-            for (timestamp, latitude, longitude) in supp_coords
-        ]
+        gaps = find_gaps(svps, self.time_threshold)
 
-        # we need to insert these new synthetic SVPs into the existing list
-        # of SVPs just after the first SVP of the gap
-        insertion_index = self.svps.index(svp1) + 1
+        # list of coords that we need to get synthetic SVPs for, for each
+        # of the gaps
+        gaps_coords = []
+        for (svp1, svp2, dt) in gaps:
+            # get the time between the new SVPs we will generate
+            interval = calc_interval(svp1, svp2, self.time_threshold)
+            gaps_coords.append(
+                (
+                    (svp1, svp2, dt),
+                    self._get_supplement_coords(svp1, svp2, interval)
+                )
+            )
+        return gaps_coords
 
-        # use slicing to insert into array
-        self.svps[insertion_index:insertion_index] = synthetic_svps
 
+    def _iter_filled_svps(
+            self,
+            svps: List[SvpProfile],
+            gaps_coords: List[Tuple[Tuple, List]],
+            checkpoint: SvpCheckpoint = None) -> Iterator[SvpProfile]:
+        """ Yields the SVPs with the gaps between them filled by synthetic
+        SVPs. Each synthetic SVP is yielded as soon as it has been generated.
+        The locations of the existing SVPs are also updated. If a checkpoint
+        is given, profiles already in the checkpoint are reused and new
+        profiles are added to it.
+        """
+        # generate the synthetic SVPs for all gaps together so that the atlas
+        # queries can be run in parallel
+        positions = [
+            (latitude, longitude, timestamp)
+            for (_, gap_coords) in gaps_coords
+            for (timestamp, latitude, longitude) in gap_coords
+        ]
+        if checkpoint is None:
+            svps_data = iter_ssm_synthetic_svps(
+                positions, self.jobs, self.atlas_engine)
+        else:
+            svps_data = checkpoint.iter_profiles(
+                positions,
+                lambda to_generate: iter_ssm_synthetic_svps(
+                    to_generate, self.jobs, self.atlas_engine)
+            )
 
-    def _fill_gaps(self):
-        gaps = find_gaps(self.svps, self.time_threshold)
-        for (svp1, svp2, dt) in gaps:
-            self._fill_gap(svp1, svp2, dt)
+        # a single pass over the existing SVPs, the synthetic SVPs of each
+        # gap follow the first SVP of the gap
+        gaps_iter = iter(gaps_coords)
+        next_gap = next(gaps_iter, None)
+        try:
+            for svp in svps:
+                self._set_svp_coords(svp)
+                yield svp
+                if next_gap is None or next_gap[0][0] is not svp:
+                    continue
+                for (timestamp, latitude, longitude) in next_gap[1]:
+                    yield SvpProfile(
+                        timestamp=timestamp,
+                        latitude=latitude,
+                        longitude=longitude,
+                        depth_speed=next(svps_data)
+                    )
+                next_gap = next(gaps_iter, None)
+        finally:
+            # closes the checkpoint journal, and any worker processes, if
+            # iteration stops early
+            svps_data.close()
+
+
+    def _get_checkpoint(self, output_path: Path) -> SvpCheckpoint:
+        """ Gets the checkpoint that synthetic profiles are journaled to
+        while they are generated"""
+        return SvpCheckpoint(
+            get_checkpoint_path(output_path),
+            {
+                'command': 'supplement-svp',
+                'atlas_engine': self.atlas_engine,
+                'atlas_extract': None if self.atlas_extract is None
+                else str(self.atlas_extract),
+            },
+            resume=self.resume
+        )
 
 
     def process(self):
-        svps = load_svps(self.input, self.fail_on_error)
-        # sort the list of SVPs by timestamp. In most cases this will already be
-        # done, but users may include unsorted files that haven't been generated
-        # by merge svp
-        self.svps = sort_svp_list(svps)
-
-        # load the tracklines data. Location information is sourced exclusively
-        # from this file. SVP files can store location data, but it is typically
-        # not included.
-        parser = TracklinesParser()
-        parser.date_format = self.date_format
-        self.tracklines = parser.read(self.tracklines_input)
-        sort_tracklines(self.tracklines)
-        if self.generate_summary:
-            tl_geojson = Path(self.output.name + '_tracklines.geojson')
-            tracklines_to_geojson_file(self.tracklines, tl_geojson)
-
-        # update location information for existing SVPs
-        self._update_svp_coords()
-
-        # generate a geojson summary of all the existing SVPs
-        if self.generate_summary:
-            svp_orig_geojson = Path(self.output.name + '_src_svps.geojson')
-            svps_to_geojson_file(self.svps, svp_orig_geojson)
-
-        # now fill gaps in between the existing SVPs
-        self._fill_gaps()
-
-        if self.generate_summary:
-            svp_synth_geojson = Path(self.output.name + '_synth_svps.geojson')
-            svps_to_geojson_file(self.svps, svp_synth_geojson)
-
-        # now write output file
-        writer = CarisSvpParser()
-        writer.show_progress = True
-        output_path = Path(os.path.realpath(self.output.name))
-        writer.write_many(output_path, self.svps)
+        svp_cache = configure_svp_cache(self.atlas_cache_size)
+        persistent_cache = configure_persistent_cache(
+            self.persistent_cache_size)
+        configure_atlas_extract(self.atlas_extract)
+
+        with stage('read SVPs') as read_stage:
+            svps = load_svps(self.input, self.fail_on_error)
+            # sort the list of SVPs by timestamp. In most cases this will
+            # already be done, but users may include unsorted files that
+            # haven't been generated by merge svp
+            src_svps = sort_svp_list(svps)
+            read_stage.items += len(src_svps)
+        add_files_read([self.input])
+        add_metric('profiles_parsed', len(src_svps))
+
+        # summary files are written in the background while the synthetic
+        # SVPs are generated
+        with BackgroundTasks() as background:
+            # load the tracklines data. Location information is sourced
+            # exclusively from this file. SVP files can store location data,
+            # but it is typically not included. Only the parts of the
+            # tracklines around the SVPs and the gaps between them are needed,
+            # so the rest of the file is skipped.
+            gaps = find_gaps(src_svps, self.time_threshold)
+            time_windows = get_trackline_time_windows(
+                src_svps,
+                gaps,
+                self.trackline_padding
+            )
+            # tracklines read from the cache were normalised before they
+            # were cached, what this removed is added to the report as they
+            # are read
+            report = TracklineNormalisationReport()
+            with stage('read tracklines') as tracklines_stage:
+                self.tracklines = load_tracklines_files(
+                    self.tracklines_input,
+                    self.date_format,
+                    time_windows=time_windows,
+                    use_cache=self.use_trackline_cache,
+                    jobs=self.jobs,
+                    report=report
+                )
+                tracklines_stage.items += \
+                    sum(len(tl.points) for tl in self.tracklines)
+            add_metric('files_discovered', len(self.tracklines_input))
+            add_files_read(self.tracklines_input)
+            # sort the tracklines, and merge those split across files
+            with stage('normalise tracklines') as normalise_stage:
+                self.tracklines, _ = normalise_trackline_list(
+                    self.tracklines, report)
+                normalise_stage.items += \
+                    sum(len(tl.points) for tl in self.tracklines)
+            # includes the points removed before the tracklines were cached
+            add_metric('trackline_points_read', report.input_points)
+            if self.generate_summary:
+                tl_geojson = Path(self.output.name + '_tracklines.geojson')
+                background.submit(
+                    tracklines_to_geojson_file,
+                    self.tracklines,
+                    tl_geojson,
+                    self.simplify_tolerance,
+                    self.geojson_format,
+                    self.geojson_precision
+                )
+
+            # fill gaps in between the existing SVPs, this also updates
+            # location information for existing SVPs. The atlas is queried in
+            # a background thread, and each SVP is written to the output file
+            # as soon as it is available. Synthetic profiles are also
+            # journaled to a checkpoint file so a failed run can be resumed,
+            # the checkpoint is removed on success.
+            with stage('interpolate trackline') as interpolate_stage:
+                gaps_coords = self._get_gaps_coords(src_svps)
+                num_synthetic = \
+                    sum(len(gap_coords) for (_, gap_coords) in gaps_coords)
+                interpolate_stage.items += num_synthetic
+            num_svps = len(src_svps) + num_synthetic
+            output_path = Path(os.path.realpath(self.output.name))
+            # the summary of the SVPs is written as they are generated, so
+            # they are not kept in memory
+            sinks = [CarisSink(output_path)]
+            if self.generate_summary:
+                sinks.append(GeojsonSink(
+                    Path(self.output.name + '_synth_svps.geojson'),
+                    self.geojson_format,
+                    self.geojson_precision
+                ))
+            # atlas queries and writing overlap, so are profiled together
+            with stage('generate and write SVPs') as generate_stage, \
+                    self._get_checkpoint(output_path) as checkpoint:
+                # the background thread is stopped before the checkpoint is
+                # closed, even if writing fails
+                with closing(iter_in_background(self._iter_filled_svps(
+                        src_svps, gaps_coords, checkpoint))) as svps, \
+                        click.progressbar(
+                            svps,
+                            length=num_svps,
+                            label="Generating synthetic SVPs") as svps_iter:
+                    num_written = write_outputs(svps_iter, sinks)
+                generate_stage.items += num_written
+            add_metric('synthetic_profiles_generated', num_synthetic)
+            add_metric('profiles_written', num_written)
+            add_cache_metrics(svp_cache, persistent_cache)
+
+            click.echo(svp_cache.summary())
+            if persistent_cache is not None:
+                click.echo(persistent_cache.summary())
+
+            if self.generate_summary:
+                # generate a geojson summary of all the existing SVPs
+                svp_orig_geojson = Path(self.output.name + '_src_svps.geojson')
+                background.submit(
+                    svps_to_geojson_file, src_svps, svp_orig_geojson,
+                    self.geojson_format, self.geojson_precision)
+
+            # time spent waiting for the summary files still being written
+            with stage('write summary files'):
+                background.wait()
 
 
 def synthetic_supplement_svp_process(
         input: Path,
-        tracklines: Path,
+        tracklines: List[Path],
         output: TextIO,
         time_threshold: float = 4,
         generate_summary: bool = False,
         fail_on_error: bool = False,
-        date_format: str = r'%d/%m/%y') -> None:
+        date_format: str = r'%d/%m/%y',
+        trackline_padding: float = 0.5,
+        simplify_tolerance: float = 0,
+        use_trackline_cache: bool = False,
+        jobs: int = 1,
+        atlas_cache_size: int = 1024,
+        persistent_cache_size: float = 0,
+        atlas_engine: str = 'ssm',
+        atlas_extract: Path = None,
+        resume: bool = False,
+        geojson_format: str = 'indent',
+        geojson_precision: int = None) -> None:
     """
     Main entry point for the synthetic supplement process whereby synthetic
     SVP profiles are generate to fill in the gaps between recorded SVPs. Only
@@ -286,7 +503,7 @@ def synthetic_supplement_svp_process(
 
     Args:
         input: Path to input CARIS formatted SVP file
-        tracklines: Path to CSV file including trackline data
+        tracklines: Paths to CSV files including trackline data
         output: CARIS SVP output with supplemented synthetic SVPs
         generate_summary: generate a summary geojson file that includes
             locations of synthetic SVN data
@@ -294,6 +511,28 @@ def synthetic_supplement_svp_process(
         time_threshold: only periods larger than this time (in hours) will
             be supplemented with synthetic SVPs
         date_format: python format string to parse date (eg '%d/%m/%y')
+        trackline_padding: time (in hours) of trackline data read either
+            side of each SVP and gap, the rest of the tracklines is skipped
+        simplify_tolerance: tolerance (metres) used to simplify the
+            tracklines summary, 0 disables simplification
+        use_trackline_cache: cache the parsed tracklines in a binary file
+            alongside the tracklines file, and use it in later runs
+        jobs: number of worker processes used, 0 uses all available CPUs
+        atlas_cache_size: number of synthetic profiles (one per atlas grid
+            cell and month) cached in memory, 0 disables the cache
+        persistent_cache_size: maximum size (MB) of the on disk cache of
+            synthetic profiles shared across runs, 0 disables the cache
+        atlas_engine: 'ssm' queries the SSM atlas for each synthetic
+            profile, 'batch' calculates all profiles together from the
+            WOA18 grid
+        atlas_extract: path to an atlas extract file (see the
+            `extract-atlas` command) used instead of the full atlas
+        resume: reuse the synthetic profiles in the checkpoint file left
+            alongside the output by a previous run that failed
+        geojson_format: format of the geojson summary files; indent,
+            compact, or ndjson (newline-delimited features)
+        geojson_precision: number of decimal places coordinates in the
+            geojson summary files are rounded to, None for full precision
 
     Returns:
         None
@@ -309,7 +548,18 @@ def synthetic_supplement_svp_process(
         time_threshold=time_threshold,
         generate_summary=generate_summary,
         fail_on_error=fail_on_error,
-        date_format=date_format
+        date_format=date_format,
+        trackline_padding=trackline_padding,
+        simplify_tolerance=simplify_tolerance,
+        use_trackline_cache=use_trackline_cache,
+        jobs=jobs,
+        atlas_cache_size=atlas_cache_size,
+        persistent_cache_size=persistent_cache_size,
+        atlas_engine=atlas_engine,
+        atlas_extract=atlas_extract,
+        resume=resume,
+        geojson_format=geojson_format,
+        geojson_precision=geojson_precision
     )
     processor.process()
 
@@ -0,0 +1,588 @@
+"""
+Binary sidecar cache of parsed trackline data. Parsing large trackline CSV
+files is slow, so the parsed and normalised (see
+`tracklines.normalise_trackline_list`) tracklines are written to a binary
+file alongside the CSV file. Subsequent runs memory map this file
+instead of parsing the CSV again.
+
+The cache file includes the following;
+- 8 byte magic string
+- 4 byte (little endian) length of the JSON header
+- JSON header including the cache key, the id and number of points of
+  each trackline, and the number of tracklines parsed before they were
+  normalised
+- padding to an 8 byte boundary
+- timestamps of all points as int64 microseconds since 1970-01-01
+- latitudes, longitudes, and depths of all points as float64 arrays
+- timestamps of the duplicate points removed when the tracklines were
+  normalised, as sorted int64 microseconds since 1970-01-01. These are
+  needed so the normalisation report is the same whether or not the cache
+  is used
+"""
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Sequence, Tuple
+import click
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+
+from mergesvp.lib.compression import strip_compression_suffix
+from mergesvp.lib.errors import SvpMissingDataException
+from mergesvp.lib.metrics import RunMetrics, merge_metrics, start_metrics
+from mergesvp.lib.tracklines import \
+    Trackline, \
+    TracklinePoint, \
+    TracklineNormalisationReport, \
+    TracklinesParser, \
+    merge_time_windows, \
+    normalise_trackline_list
+from mergesvp.lib.warningsummary import \
+    WarningSummary, \
+    add_warning, \
+    merge_warnings, \
+    start_warnings
+
+CACHE_MAGIC = b'MSVPTLC1'
+CACHE_SUFFIX = '.mergesvp-cache'
+# increment if the format of the cache file changes, this will invalidate
+# all existing cache files
+CACHE_VERSION = 2
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def get_cache_path(tracklines_file: Path) -> Path:
+    """ Gets the path of the sidecar cache file for a tracklines file"""
+    return tracklines_file.with_name(tracklines_file.name + CACHE_SUFFIX)
+
+
+def get_cache_key(tracklines_file: Path, date_format: str) -> Dict:
+    """ Gets the key that identifies the contents of a cache file. If any
+    of these values change the cache file is considered stale.
+    """
+    stat = tracklines_file.stat()
+    return {
+        'version': CACHE_VERSION,
+        'path': str(tracklines_file.resolve()),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'date_format': date_format,
+        'byteorder': sys.byteorder,
+    }
+
+
+def _to_microseconds(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+
+def write_cache(
+        cache_file: Path,
+        key: Dict,
+        tracklines: List[Trackline],
+        report: TracklineNormalisationReport) -> None:
+    """ Writes the tracklines to a cache file. Tracklines must already be
+    normalised, `report` is the report of this normalisation and must
+    include the duplicate timestamps (see `normalise_trackline_list`).
+    """
+    timestamps = array('q')
+    latitudes = array('d')
+    longitudes = array('d')
+    depths = array('d')
+    lines = []
+    for trackline in tracklines:
+        lines.append([trackline.line_id, len(trackline.points)])
+        timestamps.extend(
+            _to_microseconds(pt.timestamp) for pt in trackline.points)
+        latitudes.extend(pt.latitude for pt in trackline.points)
+        longitudes.extend(pt.longitude for pt in trackline.points)
+        depths.extend(pt.depth for pt in trackline.points)
+    duplicates = array('q', sorted(
+        _to_microseconds(timestamp)
+        for timestamp in report.duplicate_timestamps
+    ))
+
+    header = json.dumps({
+        'key': key,
+        'lines': lines,
+        'num_points': len(timestamps),
+        'num_duplicates': len(duplicates),
+        'tracklines': report.tracklines,
+        'empty_tracklines': report.empty_tracklines,
+    }).encode('utf-8')
+    # the arrays must start on an 8 byte boundary so they can be
+    # cast directly from the memory mapped file
+    header_end = len(CACHE_MAGIC) + 4 + len(header)
+    padding = b'\0' * (-header_end % 8)
+
+    # write to a temporary file first so a partially written cache file
+    # is never read
+    tmp_file = cache_file.with_name(cache_file.name + '.tmp')
+    with tmp_file.open('wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(padding)
+        for values in (timestamps, latitudes, longitudes, depths, duplicates):
+            values.tofile(f)
+    os.replace(tmp_file, cache_file)
+
+
+def _window_microseconds(
+        time_windows: List[Tuple[datetime, datetime]]
+        ) -> List[Tuple[int, int]]:
+    """ Gets the merged time windows as microseconds since 1970-01-01, the
+    same as the timestamps in the cache file. None if there are no windows.
+    """
+    if time_windows is None:
+        return None
+    return [
+        (_to_microseconds(start), _to_microseconds(end))
+        for (start, end) in merge_time_windows(time_windows)
+    ]
+
+
+def _window_ranges(
+        timestamps: memoryview,
+        start: int,
+        end: int,
+        windows: List[Tuple[int, int]]) -> Iterable[Tuple[int, int]]:
+    """ Gets the index ranges of the sorted timestamps (between start
+    and end) that fall within the windows"""
+    if windows is None:
+        yield (start, end)
+        return
+    for (window_start, window_end) in windows:
+        i = bisect_left(timestamps, window_start, start, end)
+        j = bisect_right(timestamps, window_end, start, end)
+        if i < j:
+            yield (i, j)
+
+
+def _add_cached_report(
+        report: TracklineNormalisationReport,
+        header: Dict,
+        duplicates: Sequence[int],
+        windows: List[Tuple[int, int]],
+        tracklines: List[Trackline]) -> None:
+    """ Adds what was removed when the cached tracklines were normalised to
+    the report. The tracklines themselves are counted when they are
+    normalised again along with the tracklines of the other files, so only
+    the duplicate points (those within the time windows), and the
+    tracklines that were merged or empty, are added.
+    """
+    if windows is None:
+        # tracklines parsed within time windows can't be counted, as the
+        # parser only splits the points of a line at changes of line id
+        report.tracklines += header['tracklines'] - len(tracklines)
+        report.empty_tracklines += header['empty_tracklines']
+    num_duplicates = sum(
+        j - i
+        for (i, j) in _window_ranges(duplicates, 0, len(duplicates), windows)
+    )
+    report.input_points += num_duplicates
+    report.duplicate_points += num_duplicates
+
+
+def _read_header(f: BinaryIO, key: Dict) -> Dict:
+    """ Reads the JSON header of an open cache file. Returns None if the
+    file is not a cache file, or does not match the given key.
+    """
+    if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+        return None
+    header_len = struct.unpack('<I', f.read(4))[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header['key'] != key:
+        return None
+    return header
+
+
+def read_cache(
+        cache_file: Path,
+        key: Dict,
+        time_windows: List[Tuple[datetime, datetime]] = None,
+        report: TracklineNormalisationReport = None
+        ) -> List[Trackline]:
+    """ Reads tracklines from the cache file. Returns None if the cache file
+    does not exist, is not valid, or does not match the given key. If time
+    windows are given only the points within these windows are read. If a
+    report is given the duplicate points removed from the tracklines read
+    are added to it, see `_add_cached_report`.
+    """
+    if not cache_file.exists():
+        return None
+
+    with cache_file.open('rb') as f:
+        header = _read_header(f, key)
+        if header is None:
+            return None
+
+        windows = _window_microseconds(time_windows)
+
+        num_points = header['num_points']
+        if num_points == 0:
+            if report is not None:
+                _add_cached_report(report, header, [], windows, [])
+            return []
+        # the arrays start after the header and its padding
+        offset = f.tell()
+        offset += -offset % 8
+
+        source_file = Path(key['path'])
+        tracklines = []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = memoryview(mm)
+            size = num_points * 8
+            timestamps = data[offset:offset + size].cast('q')
+            latitudes = data[offset + size:offset + 2 * size].cast('d')
+            longitudes = data[offset + 2 * size:offset + 3 * size].cast('d')
+            depths = data[offset + 3 * size:offset + 4 * size].cast('d')
+            duplicates = data[
+                offset + 4 * size:
+                offset + 4 * size + header['num_duplicates'] * 8
+            ].cast('q')
+
+            start = 0
+            for (line_id, count) in header['lines']:
+                end = start + count
+                trackline = Trackline(line_id=line_id, file=source_file)
+                trackline.is_normalised = True
+                for (i, j) in _window_ranges(timestamps, start, end, windows):
+                    trackline.points.extend(
+                        TracklinePoint(
+                            timestamp=EPOCH + timedelta(microseconds=ts),
+                            latitude=lat,
+                            longitude=lng,
+                            depth=depth
+                        )
+                        for (ts, lat, lng, depth) in zip(
+                            timestamps[i:j],
+                            latitudes[i:j],
+                            longitudes[i:j],
+                            depths[i:j])
+                    )
+                if len(trackline.points) != 0:
+                    tracklines.append(trackline)
+                start = end
+            if report is not None:
+                _add_cached_report(
+                    report, header, duplicates, windows, tracklines)
+
+            # all views of the memory mapped file must be released before
+            # it can be closed
+            views = (timestamps, latitudes, longitudes, depths, duplicates)
+            for view in views + (data,):
+                view.release()
+
+    # filtering by time windows may change the start of each trackline
+    if windows is not None:
+        tracklines.sort(key=lambda x: x.start)
+    return tracklines
+
+
+def _filter_time_windows(
+        tracklines: List[Trackline],
+        time_windows: List[Tuple[datetime, datetime]]) -> List[Trackline]:
+    """ Gets the points of normalised tracklines that fall within the time
+    windows, as `read_cache` does for the tracklines in a cache file"""
+    windows = merge_time_windows(time_windows)
+    filtered = []
+    for trackline in tracklines:
+        timestamps = [pt.timestamp for pt in trackline.points]
+        window_trackline = Trackline(trackline.line_id, trackline.file)
+        for (i, j) in _window_ranges(timestamps, 0, len(timestamps), windows):
+            window_trackline.points.extend(trackline.points[i:j])
+        if len(window_trackline.points) != 0:
+            window_trackline.is_normalised = True
+            filtered.append(window_trackline)
+    filtered.sort(key=lambda x: x.start)
+    return filtered
+
+
+def _parse_tracklines(
+        tracklines_file: Path,
+        date_format: str,
+        time_windows: List[Tuple[datetime, datetime]] = None
+        ) -> List[Trackline]:
+    """ Parses the tracklines, they are returned as parsed (not sorted)"""
+    parser = TracklinesParser()
+    parser.date_format = date_format
+    if time_windows is not None:
+        parser.set_time_windows(time_windows)
+    return parser.read(tracklines_file)
+
+
+def load_tracklines(
+        tracklines_file: Path,
+        date_format: str,
+        time_windows: List[Tuple[datetime, datetime]] = None,
+        use_cache: bool = False,
+        report: TracklineNormalisationReport = None) -> List[Trackline]:
+    """ Loads the tracklines from a tracklines CSV file. Tracklines parsed
+    from the CSV file are returned as parsed, those read from the cache
+    are already normalised; in either case use `normalise_trackline_list`
+    before using them.
+
+    Args:
+        tracklines_file: path to the CSV formatted tracklines file
+        date_format: python format string to parse date (eg '%d/%m/%y')
+        time_windows: optional list of (start, end) datetimes, only points
+            within these windows are loaded
+        use_cache: read tracklines from the sidecar cache file if it is
+            up to date, otherwise parse the CSV file and write the cache
+        report: normalisation report that the tracklines will be normalised
+            with. Tracklines read from the cache were normalised before they
+            were cached, so what this removed is added to the report
+
+    Returns:
+        List of tracklines
+    """
+    if not use_cache:
+        return _parse_tracklines(tracklines_file, date_format, time_windows)
+
+    cache_file = get_cache_path(tracklines_file)
+    key = get_cache_key(tracklines_file, date_format)
+    try:
+        tracklines = read_cache(cache_file, key, time_windows, report)
+    except (OSError, ValueError, KeyError, struct.error) as ex:
+        _warn_invalid_cache(cache_file, ex)
+        tracklines = None
+    if tracklines is not None:
+        return tracklines
+
+    if not _is_cache_writable(cache_file):
+        # the cache can't be written (eg; read only folder), so only the
+        # rows within the time windows are parsed
+        return _parse_tracklines(tracklines_file, date_format, time_windows)
+
+    # cache is missing or stale, so parse the entire file and write the
+    # cache so that it can be used with any time windows. The time windows
+    # are applied after this.
+    tracklines, cache_report, _ = _update_cache(
+        tracklines_file, date_format, cache_file, key)
+
+    if time_windows is not None:
+        tracklines = _filter_time_windows(tracklines, time_windows)
+    if report is not None:
+        _add_cached_report(
+            report,
+            {
+                'tracklines': cache_report.tracklines,
+                'empty_tracklines': cache_report.empty_tracklines,
+            },
+            sorted(
+                _to_microseconds(timestamp)
+                for timestamp in cache_report.duplicate_timestamps
+            ),
+            _window_microseconds(time_windows),
+            tracklines
+        )
+    return tracklines
+
+
+def refresh_cache(tracklines_file: Path, date_format: str) -> bool:
+    """ Makes sure the sidecar cache of a tracklines file is up to date,
+    parsing the tracklines file and writing the cache if it is missing or
+    stale. Returns False if the cache could not be written.
+    """
+    cache_file = get_cache_path(tracklines_file)
+    key = get_cache_key(tracklines_file, date_format)
+    try:
+        if cache_file.exists():
+            with cache_file.open('rb') as f:
+                if _read_header(f, key) is not None:
+                    return True
+    except (OSError, ValueError, KeyError, struct.error) as ex:
+        _warn_invalid_cache(cache_file, ex)
+
+    if not _is_cache_writable(cache_file):
+        return False
+    _, _, written = _update_cache(tracklines_file, date_format, cache_file, key)
+    return written
+
+
+def _update_cache(
+        tracklines_file: Path,
+        date_format: str,
+        cache_file: Path,
+        key: Dict
+        ) -> Tuple[List[Trackline], TracklineNormalisationReport, bool]:
+    """ Parses and normalises all the tracklines of a file, and writes them
+    to the cache file. Returns the tracklines, the normalisation report
+    (including the duplicate timestamps), and if the cache was written.
+    """
+    cache_report = TracklineNormalisationReport()
+    cache_report.duplicate_timestamps = []
+    tracklines, _ = normalise_trackline_list(
+        _parse_tracklines(tracklines_file, date_format), cache_report)
+    try:
+        write_cache(cache_file, key, tracklines, cache_report)
+    except OSError as ex:
+        # not being able to write the cache is not an error, the next run
+        # will need to parse the file again
+        add_warning(
+            'trackline_cache',
+            "Unable to write tracklines cache",
+            filename=cache_file,
+            sample=str(ex)
+        )
+        return (tracklines, cache_report, False)
+    return (tracklines, cache_report, True)
+
+
+def _is_cache_writable(cache_file: Path) -> bool:
+    """ Checks the folder of the cache file is writable, adding a warning
+    if it is not"""
+    if os.access(cache_file.parent, os.W_OK):
+        return True
+    add_warning(
+        'trackline_cache',
+        "Unable to write tracklines cache",
+        filename=cache_file,
+        sample="folder is not writable"
+    )
+    return False
+
+
+def _warn_invalid_cache(cache_file: Path, ex: Exception) -> None:
+    add_warning(
+        'trackline_cache',
+        "Ignoring invalid tracklines cache",
+        filename=cache_file,
+        sample=str(ex)
+    )
+
+
+def find_tracklines_files(tracklines: str) -> List[Path]:
+    """ Gets the list of tracklines files given by the `tracklines` string.
+    This may be the path to a single file, a folder (all CSV files within
+    the folder are included, including compressed CSV files such as
+    '.csv.gz'), or a glob pattern (eg; 'nav/*_EM710.csv').
+    Raises a SvpMissingDataException if no files are found.
+    """
+    path = Path(tracklines)
+    if path.is_dir():
+        paths = [
+            child
+            for child in path.iterdir()
+            if strip_compression_suffix(child.name.lower()).endswith('.csv')
+        ]
+    elif path.is_file():
+        paths = [path]
+    else:
+        paths = [Path(p) for p in glob.glob(tracklines)]
+
+    # exclude any of our own cache files that may match a glob pattern
+    paths = sorted(
+        p.resolve()
+        for p in paths
+        if p.is_file() and not p.name.endswith((CACHE_SUFFIX, '.tmp'))
+    )
+    if len(paths) == 0:
+        raise SvpMissingDataException(
+            f'No tracklines files were found matching "{tracklines}"')
+    return paths
+
+
+def _load_tracklines_worker(
+        tracklines_file: Path,
+        date_format: str,
+        time_windows: List[Tuple[datetime, datetime]],
+        use_cache: bool) -> Tuple[Tuple, RunMetrics, WarningSummary]:
+    """ Loads the tracklines of a file in a worker process, see
+    `load_tracklines`. Returns the tracklines and their report, and the
+    metrics and warnings of the worker so they can be added to those of the
+    parent process.
+
+    When the cache is used the worker only brings the cache file up to date
+    and None is returned in place of the tracklines and report. The parent
+    then reads the tracklines from the memory mapped cache file, which is
+    much faster than sending each point back from the worker.
+    """
+    worker_metrics = start_metrics(None)
+    worker_warnings = start_warnings()
+    if use_cache and refresh_cache(tracklines_file, date_format):
+        return (None, worker_metrics, worker_warnings)
+    report = TracklineNormalisationReport()
+    tracklines = load_tracklines(
+        tracklines_file, date_format, time_windows, report=report)
+    return ((tracklines, report), worker_metrics, worker_warnings)
+
+
+def load_tracklines_files(
+        tracklines_files: List[Path],
+        date_format: str,
+        time_windows: List[Tuple[datetime, datetime]] = None,
+        use_cache: bool = False,
+        jobs: int = 1,
+        report: TracklineNormalisationReport = None) -> List[Trackline]:
+    """ Loads the tracklines from multiple tracklines files into a single
+    list of tracklines (see `load_tracklines`), in the order of the files.
+    Use `normalise_trackline_list` (with the same `report`, if given) to
+    sort the tracklines and merge those split across files. Files are parsed
+    in parallel by `jobs` worker processes, 0 will use all available CPUs.
+    """
+    if isinstance(tracklines_files, Path):
+        tracklines_files = [tracklines_files]
+
+    if jobs == 0:
+        jobs = os.cpu_count()
+    jobs = min(jobs, len(tracklines_files))
+
+    if jobs <= 1:
+        # not worth the overhead of starting worker processes, each file is
+        # loaded below
+        worker_results = repeat(None)
+    else:
+        load_fn = partial(
+            _load_tracklines_worker,
+            date_format=date_format,
+            time_windows=time_windows,
+            use_cache=use_cache
+        )
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        worker_results = executor.map(load_fn, tracklines_files)
+
+    tracklines = []
+    try:
+        with click.progressbar(
+                zip(tracklines_files, worker_results),
+                length=len(tracklines_files),
+                label="Reading tracklines files") as files_iter:
+            for (tracklines_file, worker_result) in files_iter:
+                file_result = None
+                if worker_result is not None:
+                    (file_result, worker_metrics, worker_warnings) = \
+                        worker_result
+                    merge_metrics(worker_metrics)
+                    merge_warnings(worker_warnings)
+                if file_result is None:
+                    # not loaded by a worker, or the worker has updated
+                    # the cache that is read here
+                    file_tl = load_tracklines(
+                        tracklines_file,
+                        date_format,
+                        time_windows,
+                        use_cache,
+                        report
+                    )
+                else:
+                    (file_tl, file_report) = file_result
+                    if report is not None:
+                        report.add(file_report)
+                tracklines.extend(file_tl)
+    finally:
+        if jobs > 1:
+            executor.shutdown()
+
+    return tracklines
@@ -3,14 +3,23 @@ Module includes functions/classes to support the parsing and processing
 of trackline data (positions of the ship undertaking the survey).
 """
 from __future__ import annotations
-from datetime import datetime
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
 from operator import le
 from pathlib import Path
-import json
-from typing import List, Tuple
-from mergesvp.lib.geojson import GeojsonFeature, GeojsonLineStringFeature, GeojsonRoot
+import math
+from typing import Iterable, List, Tuple
+from mergesvp.lib.compression import open_file
+from mergesvp.lib.geojson import \
+    GeojsonFeature, \
+    GeojsonLineStringFeature, \
+    GeojsonWriter
 
-from mergesvp.lib.utils import lerp, timedelta_to_hours
+from mergesvp.lib.utils import douglas_peucker, lerp, timedelta_to_hours
+
+# approximate length (metres) of one degree of latitude, used to convert
+# tolerances given in metres to lat/long degrees
+METRES_PER_DEGREE = 111320.0
 
 
 class TracklinePoint:
@@ -69,49 +78,6 @@ class Trackline:
         return None
 
 
-    @staticmethod
-    def merge_tracklines(tracklines: List[Trackline]) -> Trackline:
-        """ Merges multiple tracklines into a single trackline
-        """
-        ids = [str(tl.line_id) for tl in tracklines]
-        ids_str = ','.join(ids)
-        merged_trackline = Trackline(line_id=ids_str, file=None)
-
-        pts = []
-        for tl in tracklines:
-            pts.extend(tl.points)
-
-        merged_trackline.points = pts
-
-        return merged_trackline
-
-
-    @staticmethod
-    def filter_duplicate_points(trackline: Trackline) -> Trackline:
-        """ Removes all duplicate points (points that have the same 
-        timestamp) from the trackline. Operates on the given tracklines
-        object.
-        """
-        filtered_points = []
-        last_point = None
-        for point in trackline.points:
-            if last_point is None:
-                # first point
-                filtered_points.append(point)
-            elif last_point.timestamp != point.timestamp:
-                # not a duplicate if they dont have the same timestamp
-                filtered_points.append(point)
-            else:
-                # the it's a duplicate point, so skip it
-                pass
-                # print(f"dup pt at {str(point.timestamp)}")
-            last_point = point
-
-        trackline.points = filtered_points
-
-        return trackline
-
-
     def __init__(self, line_id: str, file: Path) -> None:
         """
         Args:
@@ -123,6 +89,10 @@ class Trackline:
 
         # list of trackline points
         self.points = []
+        # the points are known to be sorted without duplicates, set by
+        # `normalise_trackline_list` (and when read from the tracklines
+        # cache) so that the points are only normalised once
+        self.is_normalised = False
 
 
     @property
@@ -166,33 +136,140 @@ class Trackline:
                 f"based on the start ({self.points[0].timestamp}) and end "
                 f"({self.points[-1].timestamp}) times."
             )
-        
-        prev_pt = None
-        for pt in self.points:
-            if prev_pt is None:
-                prev_pt = pt
-            elif prev_pt.timestamp <= timestamp and pt.timestamp > timestamp:
-                # then we've found where this timestamp fits in
-                break
 
-        lerp_pt = prev_pt.lerp(pt, timestamp)
-        return lerp_pt
+        timestamps = [pt.timestamp for pt in self.points]
+        return self._lerp_at(bisect_right(timestamps, timestamp), timestamp)
 
 
-    def to_geojson_object(self) -> GeojsonFeature:
-        """ Generates a GeojsonFeature that represents this trackline
+    def _lerp_at(self, index: int, timestamp: datetime) -> TracklinePoint:
+        """ Interpolates the location at the timestamp, `index` is the index
+        of the first point after the timestamp (see `bisect_right`).
+        """
+        if len(self.points) == 1:
+            pt = self.points[0]
+            return TracklinePoint(
+                timestamp, pt.latitude, pt.longitude, pt.depth)
+        # a timestamp equal to the end of the trackline is interpolated
+        # between the last two points
+        index = min(max(index, 1), len(self.points) - 1)
+        prev_pt = self.points[index - 1]
+        pt = self.points[index]
+        if prev_pt.timestamp == pt.timestamp:
+            return TracklinePoint(
+                timestamp, pt.latitude, pt.longitude, pt.depth)
+        return prev_pt.lerp(pt, timestamp)
+
+
+    def simplified_points(self, tolerance: float) -> List[TracklinePoint]:
+        """ Gets a simplified list of this tracklines points that still
+        follows the same path. No point is removed that is further than
+        `tolerance` (metres) from the simplified line.
+        """
+        if tolerance <= 0 or len(self.points) < 3:
+            return self.points
+
+        # use an equirectangular projection so that the tolerance can be
+        # applied in metres. Tracklines are short enough that this is
+        # accurate for this purpose.
+        mean_lat = sum(pt.latitude for pt in self.points) / len(self.points)
+        x_scale = METRES_PER_DEGREE * math.cos(math.radians(mean_lat))
+        xs = [pt.longitude * x_scale for pt in self.points]
+        ys = [pt.latitude * METRES_PER_DEGREE for pt in self.points]
+
+        indexes = douglas_peucker(xs, ys, tolerance)
+        return [self.points[i] for i in indexes]
+
+
+    def to_geojson_object(self, simplify_tolerance: float = 0) -> GeojsonFeature:
+        """ Generates a GeojsonFeature that represents this trackline. The
+        line is simplified if a `simplify_tolerance` (metres) is given.
         """
         feature = GeojsonLineStringFeature()
         feature.properties['line_id'] = self.line_id
         geojson_points = [
             [tl_pt.longitude, tl_pt.latitude]
-            for tl_pt in self.points
+            for tl_pt in self.simplified_points(simplify_tolerance)
         ]
 
         feature.points = geojson_points
         return feature
 
 
+class TracklineIndex:
+    """ Index of a list of tracklines that supports finding the trackline
+    that contains a timestamp, and interpolating the location at that time, in
+    logarithmic time. The tracklines (and their points) must not be modified
+    while the index is in use.
+    """
+
+    def __init__(self, tracklines: List[Trackline]) -> None:
+        self.tracklines = tracklines
+        # positions (in the tracklines list) of the non-empty tracklines,
+        # ordered by start time
+        self._order = sorted(
+            (i for (i, tl) in enumerate(tracklines) if len(tl.points) != 0),
+            key=lambda i: tracklines[i].start
+        )
+        self._starts = [tracklines[i].start for i in self._order]
+        # latest end time of all tracklines up to (and including) each
+        # position in the order, limits how far back tracklines that overlap
+        # a timestamp need to be searched for
+        self._max_ends = []
+        max_end = None
+        for i in self._order:
+            end = tracklines[i].points[-1].timestamp
+            max_end = end if max_end is None else max(max_end, end)
+            self._max_ends.append(max_end)
+        # timestamps of the points of each trackline, built when first needed
+        self._timestamps = {}
+
+    def get_containing_trackline(self, timestamp: datetime) -> Trackline:
+        """ Gets the trackline that the timestamp falls in, or None if it falls
+        outside all tracklines. Where tracklines overlap the same trackline as
+        `Trackline.get_containing_trackline` is returned.
+        """
+        containing = None
+        j = bisect_right(self._starts, timestamp) - 1
+        while j >= 0 and self._max_ends[j] >= timestamp:
+            i = self._order[j]
+            if self.tracklines[i].is_in(timestamp) and \
+                    (containing is None or i < containing):
+                containing = i
+            j -= 1
+        return None if containing is None else self.tracklines[containing]
+
+    def get_lerp_point(self, timestamp: datetime) -> TracklinePoint:
+        """ Calculates the location of the ship for the given timestamp by
+        linear interpolation of the trackline that contains it. Returns None
+        if no trackline contains the timestamp.
+        """
+        trackline = self.get_containing_trackline(timestamp)
+        if trackline is None:
+            return None
+        timestamps = self._timestamps.get(id(trackline))
+        if timestamps is None:
+            timestamps = [pt.timestamp for pt in trackline.points]
+            self._timestamps[id(trackline)] = timestamps
+        return trackline._lerp_at(
+            bisect_right(timestamps, timestamp), timestamp)
+
+
+def merge_time_windows(
+        windows: Iterable[Tuple[datetime, datetime]]
+        ) -> List[Tuple[datetime, datetime]]:
+    """ Sorts a collection of time windows (start, end) by start time and
+    merges any windows that overlap.
+    """
+    merged = []
+    for (start, end) in sorted(windows):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            # overlaps the previous window, so extend that one instead
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
 class TracklinesParser:
     """ Reads CSV formatted tracklines data into Tracklines objects 
     """
@@ -205,25 +282,73 @@ class TracklinesParser:
         self._current_trackline = None
         self.date_format = r'%d/%m/%y'
 
+        # optional time windows, when set only points that fall within one
+        # of these windows are read. Set via `set_time_windows`
+        self._window_starts = None
+        self._window_ends = None
+        # cache of date strings (first column) and whether that day overlaps
+        # any of the time windows
+        self._window_dates = {}
 
-    def _process_line(self, line: str) -> Tuple[str, TracklinePoint]:
-        """ Parses the text line into a trackline point object.
 
-        Args:
-            line: csv formatted line read from a tracklines file
-        
-        Returns:
-            Tuple; first element is the track id, second is a TracklinePoint
-                object containing the position data (location, timestamp)
+    def set_time_windows(
+            self,
+            windows: Iterable[Tuple[datetime, datetime]]) -> None:
+        """ Restricts the points read to those within the given time windows.
+        Each window is a tuple of start and end datetimes (inclusive). Rows
+        outside these windows are skipped before the location data is
+        parsed. Passing None will read all points.
         """
-        line_bits = line.split(',')
+        self._window_dates = {}
+        if windows is None:
+            self._window_starts = None
+            self._window_ends = None
+            return
+
+        merged = merge_time_windows(windows)
+        self._window_starts = [start for (start, _) in merged]
+        self._window_ends = [end for (_, end) in merged]
+
+
+    def _date_in_time_windows(self, date_str: str) -> bool:
+        """ Checks if any part of the day given by `date_str` falls within
+        the time windows. Result is cached as the date string is shared by
+        all points recorded on the same day.
+        """
+        in_windows = self._window_dates.get(date_str)
+        if in_windows is not None:
+            return in_windows
+
+        day_start = datetime.strptime(date_str, self.date_format)
+        day_end = day_start + timedelta(days=1)
+        # windows are merged, so they are sorted by both start and end. Only
+        # the last window starting before the end of the day can overlap it
+        i = bisect_left(self._window_starts, day_end)
+        in_windows = i > 0 and self._window_ends[i - 1] >= day_start
+
+        self._window_dates[date_str] = in_windows
+        return in_windows
+
+
+    def _timestamp_in_time_windows(self, timestamp: datetime) -> bool:
+        i = bisect_right(self._window_starts, timestamp)
+        return i > 0 and self._window_ends[i - 1] >= timestamp
+
+
+    def _parse_timestamp(self, date_str: str, time_str: str) -> datetime:
         # merge date and time components so we can parse them together
-        date_str = line_bits[0] + ' ' + line_bits[1]
+        date_time_str = date_str + ' ' + time_str
         date_format = self.date_format + r' %H:%M:%S.%f'
-        
+        return datetime.strptime(date_time_str, date_format)
+
+
+    def _process_line_bits(
+            self,
+            line_bits: List[str],
+            timestamp: datetime) -> Tuple[str, TracklinePoint]:
         tl_id = line_bits[2]
         pt = TracklinePoint(
-            timestamp=datetime.strptime(date_str, date_format),
+            timestamp=timestamp,
             latitude=float(line_bits[4]),
             longitude=float(line_bits[3]),
             depth=float(line_bits[5])
@@ -232,9 +357,35 @@ class TracklinesParser:
         return tl_id, pt
 
 
-    def _process_lines(self, lines: List[str]) -> List[Trackline]:
+    def _process_line(self, line: str) -> Tuple[str, TracklinePoint]:
+        """ Parses the text line into a trackline point object.
+
+        Args:
+            line: csv formatted line read from a tracklines file
+        
+        Returns:
+            Tuple; first element is the track id, second is a TracklinePoint
+                object containing the position data (location, timestamp)
+        """
+        line_bits = line.split(',')
+        timestamp = self._parse_timestamp(line_bits[0], line_bits[1])
+        return self._process_line_bits(line_bits, timestamp)
+
+
+    def _process_lines(self, lines: Iterable[str]) -> List[Trackline]:
+        use_windows = self._window_starts is not None
         for line in lines:
-            tl_id, tl_p = self._process_line(line)
+            line_bits = line.split(',')
+
+            # skip lines outside the time windows. The (cached) date check
+            # means most lines can be skipped without parsing the time
+            if use_windows and not self._date_in_time_windows(line_bits[0]):
+                continue
+            timestamp = self._parse_timestamp(line_bits[0], line_bits[1])
+            if use_windows and not self._timestamp_in_time_windows(timestamp):
+                continue
+
+            tl_id, tl_p = self._process_line_bits(line_bits, timestamp)
 
             if (self._current_trackline is None) or (
                     self._current_trackline.line_id != tl_id):
@@ -258,43 +409,175 @@ class TracklinesParser:
         self.tracklines = []
         self._current_trackline = None
 
-        with file.open('r') as f:
+        with open_file(file) as f:
             # skip first line as it is just the header
             f.readline()
-            lines = f.read().splitlines()
-            self._process_lines(lines)
+            # iterate over the file rather than reading it all into memory,
+            # most lines may be skipped if time windows have been set
+            self._process_lines(f)
 
         return self.tracklines
 
 
 def tracklines_to_geojson_file(
         tracklines: List[Trackline],
-        output_file: Path) -> None:
-    """ Writes a list of tracklines to a geojson file
+        output_file: Path,
+        simplify_tolerance: float = 0,
+        format: str = 'indent',
+        precision: int = None) -> None:
+    """ Writes a list of tracklines to a geojson file. Tracklines are
+    simplified if a `simplify_tolerance` (metres) is given. See
+    `GeojsonWriter` for the format and precision.
     """
-    geojson_object = GeojsonRoot()
-    for trackline in tracklines:
-        geojson_object.feature_collection.add_feature(
-            trackline.to_geojson_object()
-        )
+    with GeojsonWriter.open(output_file, format, precision) as writer:
+        for trackline in tracklines:
+            writer.write_feature(
+                trackline.to_geojson_object(simplify_tolerance))
 
-    geojson = geojson_object.to_geojson()
 
-    with output_file.open('w') as f:
-        f.write(
-            json.dumps(
-                geojson,
-                indent=2
-            )
+class TracklineNormalisationReport:
+    """ Details of what was changed when normalising tracklines
+    """
+
+    def __init__(self) -> None:
+        self.tracklines = 0
+        # tracklines that did not include any points
+        self.empty_tracklines = 0
+        self.input_points = 0
+        # points removed as another point shared the same timestamp
+        self.duplicate_points = 0
+        # set to a list to record the timestamp of each duplicate point
+        # removed (used by the tracklines cache)
+        self.duplicate_timestamps = None
+
+    @property
+    def output_points(self) -> int:
+        return self.input_points - self.duplicate_points
+
+    def add(self, other: TracklineNormalisationReport) -> None:
+        """ Adds the counts of another report to this one"""
+        self.tracklines += other.tracklines
+        self.empty_tracklines += other.empty_tracklines
+        self.input_points += other.input_points
+        self.duplicate_points += other.duplicate_points
+
+    def __str__(self) -> str:
+        return (
+            f"{self.tracklines} tracklines with {self.input_points} points "
+            f"were merged into a single trackline of {self.output_points} "
+            f"points ({self.duplicate_points} duplicate points and "
+            f"{self.empty_tracklines} empty tracklines were dropped)"
         )
 
 
-def sort_tracklines(tracklines: List[Trackline]) -> None:
-    """ Sorts a list of tracklines in place
+def _normalise_points(
+        trackline: Trackline,
+        report: TracklineNormalisationReport) -> None:
+    """ Sorts the points of the trackline and removes duplicates, in place"""
+    # points of tracklines read from file are normally already in order,
+    # in this case sorting is only a single comparison per point
+    trackline.sort()
+    points = trackline.points
+    last_timestamp = points[0].timestamp
+    count = 1
+    for i in range(1, len(points)):
+        point = points[i]
+        if point.timestamp == last_timestamp:
+            report.duplicate_points += 1
+            if report.duplicate_timestamps is not None:
+                report.duplicate_timestamps.append(last_timestamp)
+            continue
+        points[count] = point
+        count += 1
+        last_timestamp = point.timestamp
+    del points[count:]
+    trackline.is_normalised = True
+
+
+def normalise_trackline_list(
+        tracklines: List[Trackline],
+        report: TracklineNormalisationReport = None
+        ) -> Tuple[List[Trackline], TracklineNormalisationReport]:
+    """ Sorts the points of each trackline and removes duplicate points
+    (points with the same timestamp), drops empty tracklines, and sorts the
+    tracklines by start time. Consecutive tracklines with the same line id
+    that do not overlap (eg; a line split across two files) are merged. This
+    is the only place tracklines are sorted and deduplicated; the points of
+    each trackline are only processed once, tracklines that are already
+    normalised (see `Trackline.is_normalised`) are only merged.
+
+    Returns:
+        Tuple; first element is the list of normalised tracklines, second is
+            a report detailing what was dropped
+    """
+    if report is None:
+        report = TracklineNormalisationReport()
+    report.tracklines += len(tracklines)
+
+    non_empty = []
+    for trackline in tracklines:
+        if len(trackline.points) == 0:
+            report.empty_tracklines += 1
+            continue
+        report.input_points += len(trackline.points)
+        if not trackline.is_normalised:
+            _normalise_points(trackline, report)
+        non_empty.append(trackline)
+    non_empty.sort(key=lambda x: x.start)
+
+    normalised = []
+    for trackline in non_empty:
+        if (
+                len(normalised) > 0 and
+                normalised[-1].line_id == trackline.line_id and
+                normalised[-1].points[-1].timestamp <= trackline.start):
+            points = trackline.points
+            if normalised[-1].points[-1].timestamp == trackline.start:
+                # same point included at the end of one file and the
+                # start of the next
+                report.duplicate_points += 1
+                if report.duplicate_timestamps is not None:
+                    report.duplicate_timestamps.append(trackline.start)
+                points = points[1:]
+            normalised[-1].points.extend(points)
+        else:
+            normalised.append(trackline)
+    return (normalised, report)
+
+
+def join_tracklines(
+        tracklines: List[Trackline],
+        report: TracklineNormalisationReport = None) -> Trackline:
+    """ Joins a list of normalised tracklines (see `normalise_trackline_list`)
+    into a single trackline. As the points of each trackline are already in
+    order only the start and end of each trackline need to be checked; a
+    point shared by the end of one trackline and the start of the next is
+    dropped (and counted in the report, if given).
+
+    Raises a RuntimeError if tracklines overlap in time.
     """
-    # to sort a list of tracklines, we must first make sure all the
-    # points in each trackline are sorted.
+    ids = [str(tl.line_id) for tl in tracklines]
+    joined = Trackline(line_id=','.join(ids), file=None)
+
+    points = []
+    last_trackline = None
     for trackline in tracklines:
-        trackline.sort()
-    # then we can sort the list of tracklines
-    tracklines.sort(key=lambda x: x.start)
+        trackline_points = trackline.points
+        if last_trackline is not None:
+            last_timestamp = points[-1].timestamp
+            if trackline.start == last_timestamp:
+                if report is not None:
+                    report.duplicate_points += 1
+                trackline_points = trackline_points[1:]
+            elif trackline.start < last_timestamp:
+                raise RuntimeError(
+                    "Trackline points not in chronological order, "
+                    f"trackline {trackline.line_id} overlaps "
+                    f"trackline {last_trackline.line_id} at "
+                    f"{trackline.start}")
+        points.extend(trackline_points)
+        last_trackline = trackline
+
+    joined.points = points
+    joined.is_normalised = True
+    return joined
@@ -3,7 +3,7 @@ from functools import reduce
 import math
 from sys import flags
 from typing import List, Tuple
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from mergesvp.lib.svpprofile import SvpProfile
 
@@ -44,6 +44,97 @@ def decimal_to_dms(val: float) -> Tuple[int, int, float]:
     return (math.copysign(d, val), m, s)
 
 
+def format_caris_section_headers(
+        timestamps: List[datetime],
+        latitudes: List[float],
+        longitudes: List[float]) -> List[str]:
+    """ Formats the CARIS section header lines (including the newline) of
+    many SVPs at once, eg; `Section 2015-148 23:49:31 -12.0:14:35.0 ...`.
+    The output is identical to formatting each header with `strftime` and
+    `decimal_to_dms`, but the date of each day is only formatted once.
+    """
+    days = {}
+    headers = []
+    copysign = math.copysign
+    for (timestamp, latitude, longitude) in zip(
+            timestamps, latitudes, longitudes):
+        day = timestamp.toordinal()
+        day_str = days.get(day)
+        if day_str is None:
+            day_str = timestamp.strftime('%Y-%j')
+            days[day] = day_str
+
+        # same as decimal_to_dms, inlined as this is called for each SVP
+        abs_val = abs(latitude)
+        d = int(abs_val)
+        m = int((abs_val - d) * 60)
+        lat_s = (abs_val - d - m / 60) * 3600
+        lat_str = f"{copysign(d, latitude)}:{m}:{lat_s}"
+        abs_val = abs(longitude)
+        d = int(abs_val)
+        m = int((abs_val - d) * 60)
+        lng_s = (abs_val - d - m / 60) * 3600
+        lng_str = f"{copysign(d, longitude)}:{m}:{lng_s}"
+
+        headers.append(
+            f"Section {day_str} {timestamp.hour:02d}:{timestamp.minute:02d}:"
+            f"{timestamp.second:02d} {lat_str} {lng_str}\n"
+        )
+    return headers
+
+
+def _parse_dms(dms_str: str) -> float:
+    """ Same as `dms_to_decimal` of the colon separated values"""
+    vals = dms_str.split(':')
+    degrees = float(vals[0])
+    abs_decimal = abs(degrees)
+    if len(vals) > 1:
+        abs_decimal += float(vals[1]) / 60
+    if len(vals) > 2:
+        abs_decimal += float(vals[2]) / 3600
+    return math.copysign(abs_decimal, degrees)
+
+
+def parse_caris_section_headers(
+        lines: List[str]
+        ) -> Tuple[List[datetime], List[float], List[float]]:
+    """ Parses the timestamps, latitudes, and longitudes of many CARIS
+    section header lines at once. Gives the same results as `strptime` and
+    `dms_to_decimal`, but each date is only parsed once. Raises ValueError
+    or IndexError if a header can't be parsed.
+    """
+    days = {}
+    timestamps = []
+    latitudes = []
+    longitudes = []
+    for line in lines:
+        linebits = line.split()
+        if len(linebits) < 5:
+            raise ValueError(f"Invalid section header: {line}")
+        (date_str, time_str) = (linebits[1], linebits[2])
+        day = days.get(date_str)
+        if day is None:
+            day = datetime.strptime(date_str, '%Y-%j')
+            days[date_str] = day
+        if len(time_str) == 8 and time_str[2] == ':' and time_str[5] == ':' \
+                and time_str[:2].isdigit() and time_str[3:5].isdigit() \
+                and time_str[6:].isdigit():
+            # replace validates the hour, minute and second are in range
+            timestamp = day.replace(
+                hour=int(time_str[:2]),
+                minute=int(time_str[3:5]),
+                second=int(time_str[6:])
+            )
+        else:
+            # less common forms (eg; single digit values)
+            timestamp = datetime.strptime(
+                date_str + ' ' + time_str, '%Y-%j %H:%M:%S')
+        timestamps.append(timestamp)
+        latitudes.append(_parse_dms(linebits[3]))
+        longitudes.append(_parse_dms(linebits[4]))
+    return (timestamps, latitudes, longitudes)
+
+
 def _get_all_dives(
         depth_vs_speed: List[Tuple[float, float]]
         ) -> List[List[Tuple[float, float]]]:
@@ -118,3 +209,83 @@ def lerp(a: float, b: float, t: float) -> float:
     """Linear interpolate between a and b, using t.
     """
     return (1 - t) * a + t * b
+
+
+def max_speed_difference(
+        depth_speed_a: List[Tuple[float, float]],
+        depth_speed_b: List[Tuple[float, float]]) -> float:
+    """ Gets the largest difference in speed between two profiles at the
+    depths they share. Profiles generated from the same atlas share the same
+    depths, down to the shallower of the two.
+    """
+    speeds_a = dict(depth_speed_a)
+    diffs = [
+        abs(speed - speeds_a[depth])
+        for (depth, speed) in depth_speed_b
+        if depth in speeds_a
+    ]
+    if len(diffs) == 0:
+        return math.inf
+    return max(diffs)
+
+
+def _segment_distances_sq(
+        xs: List[float],
+        ys: List[float],
+        first: int,
+        last: int) -> List[float]:
+    """ Gets the squared distance of each point between first and last
+    (exclusive) to the line segment joining the first and last points"""
+    x0 = xs[first]
+    y0 = ys[first]
+    dx = xs[last] - x0
+    dy = ys[last] - y0
+    seg_len_sq = dx * dx + dy * dy
+
+    pts = zip(xs[first + 1:last], ys[first + 1:last])
+    if seg_len_sq == 0:
+        return [(x - x0) ** 2 + (y - y0) ** 2 for (x, y) in pts]
+
+    # project each point onto the segment, clamped to the segment ends
+    dists = []
+    for (x, y) in pts:
+        t = ((x - x0) * dx + (y - y0) * dy) / seg_len_sq
+        t = min(1.0, max(0.0, t))
+        dists.append((x - x0 - t * dx) ** 2 + (y - y0 - t * dy) ** 2)
+    return dists
+
+
+def douglas_peucker(
+        xs: List[float],
+        ys: List[float],
+        tolerance: float) -> List[int]:
+    """ Simplifies a line using the Douglas-Peucker algorithm. Returns the
+    indexes of the points that should be kept, all other points are within
+    `tolerance` of the simplified line. Tolerance uses the same units as the
+    x and y values.
+    """
+    n = len(xs)
+    if n < 3 or tolerance <= 0:
+        return list(range(n))
+
+    keep = [False] * n
+    keep[0] = True
+    keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+
+    # use a stack instead of recursion as tracklines can include many
+    # thousands of points
+    stack = [(0, n - 1)]
+    while len(stack) > 0:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dists = _segment_distances_sq(xs, ys, first, last)
+        max_dist = max(dists)
+        if max_dist > tolerance_sq:
+            split = first + 1 + dists.index(max_dist)
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return [i for i in range(n) if keep[i]]
@@ -0,0 +1,150 @@
+"""
+Aggregation of the warnings generated while a command runs. A damaged input
+file may produce a warning for every line, so rather than logging each one
+the warnings are counted by category, file and message, and only a small
+sample of the line numbers (or other values identifying where the warning
+occurred) is kept. A single summary is logged when the command ends.
+
+Messages should not include details of the individual warning (eg; the line
+number), these are passed as the `sample` instead so that nothing is
+formatted for warnings that are only counted.
+"""
+from typing import Any, Dict, List, Tuple
+import logging
+
+from mergesvp.lib.metrics import add_metric
+
+logger = logging.getLogger(__name__)
+
+# number of samples kept for each file and message
+MAX_SAMPLES = 5
+
+
+class WarningCount:
+    """ Number of times a warning occurred, and a sample of where"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.samples: List[Any] = []
+
+
+class WarningSummary:
+    """ Counts of the warnings generated by a command. Warnings are keyed by
+    category (as used by the warnings metric), file and message.
+    """
+
+    def __init__(self, max_samples: int = MAX_SAMPLES) -> None:
+        self.max_samples = max_samples
+        self.warnings: Dict[Tuple[str, str, str], WarningCount] = {}
+
+    def add(
+            self,
+            category: str,
+            message: str,
+            filename: str = None,
+            sample: Any = None) -> None:
+        key = (category, None if filename is None else str(filename), message)
+        warning = self.warnings.get(key)
+        if warning is None:
+            warning = WarningCount()
+            self.warnings[key] = warning
+        warning.count += 1
+        if sample is not None and len(warning.samples) < self.max_samples:
+            warning.samples.append(sample)
+
+    def merge(self, other: 'WarningSummary') -> None:
+        """ Adds the warnings of another summary to this one (eg; the
+        warnings of a worker process)"""
+        for (key, other_warning) in other.warnings.items():
+            warning = self.warnings.get(key)
+            if warning is None:
+                warning = WarningCount()
+                self.warnings[key] = warning
+            warning.count += other_warning.count
+            free = self.max_samples - len(warning.samples)
+            warning.samples.extend(other_warning.samples[:max(free, 0)])
+
+    def count(self, category: str = None, filename: str = None) -> int:
+        """ Total number of warnings, optionally only those of a category
+        and/or file"""
+        if filename is not None:
+            filename = str(filename)
+        return sum(
+            warning.count
+            for ((key_category, key_filename, _), warning)
+            in self.warnings.items()
+            if (category is None or key_category == category) and
+            (filename is None or key_filename == filename)
+        )
+
+    def summary(self) -> str:
+        """ Multi-line summary of the warnings, grouped by category"""
+        lines = []
+        categories = sorted({key[0] for key in self.warnings.keys()})
+        for category in categories:
+            lines.append(f"{category}: {self.count(category)} warnings")
+            for ((key_category, filename, message), warning) in \
+                    self.warnings.items():
+                if key_category != category:
+                    continue
+                line = '    '
+                if filename is not None:
+                    line += f"{filename}: "
+                line += f"{message} ({warning.count} times"
+                if len(warning.samples) > 0:
+                    samples = ', '.join(str(s) for s in warning.samples)
+                    line += f", eg; {samples}"
+                line += ")"
+                lines.append(line)
+        return '\n'.join(lines)
+
+
+# warnings of the current command
+warning_summary = WarningSummary()
+
+
+def start_warnings() -> WarningSummary:
+    global warning_summary
+    warning_summary = WarningSummary()
+    return warning_summary
+
+
+def add_warning(
+        category: str,
+        message: str,
+        filename: str = None,
+        sample: Any = None) -> None:
+    """ Records a warning, and adds it to the warnings metric.
+
+    Args:
+        category: category of the warning (eg; svp_parse)
+        message: description of the warning, the same for all occurrences
+        filename: file the warning relates to, if any
+        sample: identifies this occurrence of the warning (eg; line number),
+            only the first few samples are kept
+
+    Returns:
+        None
+    """
+    warning_summary.add(category, message, filename, sample)
+    add_metric('warnings', category=category)
+
+
+def merge_warnings(other: WarningSummary) -> None:
+    """ Adds the warnings of another summary (eg; that of a worker process)
+    to the warnings of the current command. The warnings metric is not
+    changed, merge the metrics of the worker as well (see
+    `metrics.merge_metrics`)."""
+    warning_summary.merge(other)
+
+
+def report_warnings() -> None:
+    """ Logs the summary of the warnings of the current command, if there
+    were any"""
+    if len(warning_summary.warnings) == 0:
+        return
+    logger.warning(
+        "%d warnings were generated\n%s",
+        warning_summary.count(),
+        warning_summary.summary()
+    )
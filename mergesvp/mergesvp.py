@@ -1,31 +1,48 @@
-from email.policy import default
 from pathlib import Path
 import click
 import logging
 
 from mergesvp.lib.rawprocess import merge_raw_svp_process
 from mergesvp.lib.carisprocess import merge_caris_svp_process
-from mergesvp.lib.syntheticsupplementprocess import \
-    synthetic_supplement_svp_process
-from mergesvp.lib.syntheticprocess import \
-    synthetic_svp_process
+from mergesvp.lib.compression import configure_compression, open_file
+from mergesvp.lib.errors import SvpMissingDataException
+from mergesvp.lib.fixtureprocess import FIXTURES, generate_fixtures_process
+from mergesvp.lib.geojson import GEOJSON_FORMATS
+from mergesvp.lib.profilecache import \
+    DEFAULT_MAX_SIZE, \
+    PersistentSvpCache, \
+    get_cache_path
+from mergesvp.lib.metrics import \
+    METRICS_FORMATS, \
+    start_metrics, \
+    write_metrics
+from mergesvp.lib.profiling import start_profiling, stop_profiling
+from mergesvp.lib.ssminterface import ATLAS_ENGINES
+from mergesvp.lib.tracklinecache import find_tracklines_files
 from mergesvp.lib.utils import dateformat_to_pythondateformat
+from mergesvp.lib.warningsummary import report_warnings, start_warnings
 
 def configure_logger():
-    logging.basicConfig(level="DEBUG")
+    logging.basicConfig(level="INFO")
 
 
-configure_logger()
+def tracklines_files_callback(ctx, param, value):
+    """ Converts the tracklines argument (file, folder, or glob pattern)
+    into a list of tracklines file paths"""
+    try:
+        return find_tracklines_files(value)
+    except SvpMissingDataException as ex:
+        raise click.BadParameter(str(ex))
 
 
 @click.command()
 @click.option(
     '-i', '--input',
     required=True,
-    type=click.File('r'),
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
     help=(
         "Path to CSV file including reference to SVP files, locations "
-        "and timestamps."
+        "and timestamps. May be compressed (eg; gzip)."
     )
 )
 @click.option(
@@ -33,14 +50,26 @@ configure_logger()
     type=click.File('w'),
     help="Output location for merged SVP file."
 )
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to format the merged output. Use 0 "
+        "for all available CPUs. Defaults to 1"
+    )
+)
 @click.pass_context
-def merge_raw_svp(ctx, input, output):
+def merge_raw_svp(ctx, input, output, jobs):
     """
     Merge multiple raw sound velocity profiles (SVP) as listed in a single
     CSV file into a single CARIS compatible SVP file. SVP files must be in a
     L0 or L2 format.
     """
-    merge_raw_svp_process(input, output, ctx.obj['fail_on_error'])
+    with open_file(input) as input_file:
+        merge_raw_svp_process(
+            input_file, output, ctx.obj['fail_on_error'], jobs)
 
 
 @click.command()
@@ -69,15 +98,26 @@ def merge_raw_svp(ctx, input, output):
         "level folders, only immediate parents of folders containing SVP files."
     )
 )
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to format the merged output. Use 0 "
+        "for all available CPUs. Defaults to 1"
+    )
+)
 @click.pass_context
-def merge_caris_svp(ctx, input, output, folder_filter):
+def merge_caris_svp(ctx, input, output, folder_filter, jobs):
     """ Merge multiple CARIS SVP files into a single CARIS SVP file.
     Note: duplicate profiles are removed during this process."""
     merge_caris_svp_process(
         Path(input),
         output,
         ctx.obj['fail_on_error'],
-        folder_filter
+        folder_filter,
+        jobs
     )
 
 
@@ -94,13 +134,12 @@ def merge_caris_svp(ctx, input, output, folder_filter):
 @click.option(
     '-t', '--tracklines',
     required=True,
-    type=click.Path(
-        exists=True,
-        file_okay=True,
-        dir_okay=False,
-        resolve_path=True),
+    type=str,
+    callback=tracklines_files_callback,
     help=(
-        "Path to CSV formatted tracklines file"
+        "Path to CSV formatted tracklines file. May also be a folder "
+        "containing multiple tracklines files, or a glob pattern (eg; "
+        "'nav/*.csv')"
     )
 )
 @click.option(
@@ -118,6 +157,18 @@ def merge_caris_svp(ctx, input, output, folder_filter):
         "SVPs are added"
     )
 )
+@click.option(
+    '-tp', '--trackline-padding',
+    required=False,
+    default=0.5,
+    type=click.FloatRange(min=0),
+    help=(
+        "Time (hours) of trackline data read either side of each SVP and "
+        "gap between SVPs, the rest of the tracklines files is skipped. "
+        "Increase this if the tracklines have long intervals between "
+        "points. Defaults to 0.5 hours"
+    )
+)
 @click.option(
     '-ns', '--no-summary',
     is_flag=True,
@@ -137,22 +188,144 @@ def merge_caris_svp(ctx, input, output, folder_filter):
         "Defaults to dmy"
     )
 )
+@click.option(
+    '-st', '--simplify-tolerance',
+    required=False,
+    default=1.0,
+    type=click.FloatRange(min=0),
+    help=(
+        "Tolerance (metres) used to simplify tracklines included in the "
+        "tracklines summary file. Use 0 to include all trackline points. "
+        "Defaults to 1 metre"
+    )
+)
+@click.option(
+    '-nc', '--no-cache',
+    is_flag=True,
+    help=(
+        "Disable caching of the parsed tracklines file. By default parsed "
+        "tracklines are cached in a '.mergesvp-cache' file alongside the "
+        "tracklines file to speed up later runs"
+    )
+)
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to read tracklines files and "
+        "generate synthetic SVPs. Use 0 for all available CPUs. Defaults to 1"
+    )
+)
+@click.option(
+    '-acs', '--atlas-cache-size',
+    required=False,
+    default=1024,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of synthetic profiles (one per atlas grid cell and month) "
+        "cached in memory, avoids querying the atlas for locations that "
+        "share a grid cell. Use 0 to disable. Defaults to 1024"
+    )
+)
+@click.option(
+    '-pcs', '--persistent-cache-size',
+    required=False,
+    default=DEFAULT_MAX_SIZE,
+    type=click.FloatRange(min=0),
+    help=(
+        "Maximum size (MB) of the on disk cache of synthetic profiles that "
+        "is shared across runs. Use 0 to disable. Defaults to "
+        f"{DEFAULT_MAX_SIZE} MB"
+    )
+)
+@click.option(
+    '-ae', '--atlas-engine',
+    required=False,
+    default='ssm',
+    type=click.Choice(ATLAS_ENGINES),
+    help=(
+        "How synthetic profiles are generated from the World Ocean Atlas. "
+        "'ssm' queries Sound Speed Manager for each profile, 'batch' loads "
+        "the atlas grid for the survey area once and calculates all profiles "
+        "together. Defaults to ssm"
+    )
+)
+@click.option(
+    '-ax', '--atlas-extract',
+    required=False,
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, resolve_path=True),
+    help=(
+        "Path to an atlas extract file (see extract-atlas) that is used to "
+        "generate synthetic profiles instead of the full World Ocean Atlas"
+    )
+)
+@click.option(
+    '-r', '--resume',
+    is_flag=True,
+    help=(
+        "Resume a previous run that failed. Synthetic profiles are saved to "
+        "a checkpoint file alongside the output as they are generated, "
+        "those already in the checkpoint are not generated again"
+    )
+)
+@click.option(
+    '-gf', '--geojson-format',
+    required=False,
+    default='indent',
+    type=click.Choice(GEOJSON_FORMATS),
+    help=(
+        "Format of the geojson summary files. 'indent' is indented JSON, "
+        "'compact' has no whitespace, and 'ndjson' writes one feature per "
+        "line (newline-delimited GeoJSON). Defaults to indent"
+    )
+)
+@click.option(
+    '-gp', '--geojson-precision',
+    required=False,
+    default=None,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of decimal places coordinates in the geojson summary files "
+        "are rounded to. By default coordinates are not rounded"
+    )
+)
 @click.pass_context
 def supplement_svp(
-        ctx, input, tracklines, output, time_threshold, no_summary,
-        date_format):
+        ctx, input, tracklines, output, time_threshold, trackline_padding,
+        no_summary, date_format, simplify_tolerance, no_cache, jobs,
+        atlas_cache_size, persistent_cache_size, atlas_engine, atlas_extract,
+        resume, geojson_format, geojson_precision):
     """
     Fills the gaps in a series of SVPs where the time between two SVP
     profiles exceeds the given threshold
     """
+    # imported here as the synthetic process depends on Sound Speed Manager
+    # which is slow to load, and isn't needed by other commands
+    from mergesvp.lib.syntheticsupplementprocess import \
+        synthetic_supplement_svp_process
+
     synthetic_supplement_svp_process(
         input=Path(input),
-        tracklines=Path(tracklines),
+        tracklines=tracklines,
         output=output,
         time_threshold=time_threshold,
+        trackline_padding=trackline_padding,
         fail_on_error=ctx.obj['fail_on_error'],
         generate_summary= not no_summary,
-        date_format=dateformat_to_pythondateformat(date_format)
+        date_format=dateformat_to_pythondateformat(date_format),
+        simplify_tolerance=simplify_tolerance,
+        use_trackline_cache=not no_cache,
+        jobs=jobs,
+        atlas_cache_size=atlas_cache_size,
+        persistent_cache_size=persistent_cache_size,
+        atlas_engine=atlas_engine,
+        atlas_extract=None if atlas_extract is None else Path(atlas_extract),
+        resume=resume,
+        geojson_format=geojson_format,
+        geojson_precision=geojson_precision
     )
 
 
@@ -160,13 +333,12 @@ def supplement_svp(
 @click.option(
     '-t', '--tracklines',
     required=True,
-    type=click.Path(
-        exists=True,
-        file_okay=True,
-        dir_okay=False,
-        resolve_path=True),
+    type=str,
+    callback=tracklines_files_callback,
     help=(
-        "Path to CSV formatted tracklines file"
+        "Path to CSV formatted tracklines file. May also be a folder "
+        "containing multiple tracklines files, or a glob pattern (eg; "
+        "'nav/*.csv')"
     )
 )
 @click.option(
@@ -202,22 +374,394 @@ def supplement_svp(
         "Defaults to dmy"
     )
 )
+@click.option(
+    '-st', '--simplify-tolerance',
+    required=False,
+    default=1.0,
+    type=click.FloatRange(min=0),
+    help=(
+        "Tolerance (metres) used to simplify tracklines included in the "
+        "tracklines summary file. Use 0 to include all trackline points. "
+        "Defaults to 1 metre"
+    )
+)
+@click.option(
+    '-nc', '--no-cache',
+    is_flag=True,
+    help=(
+        "Disable caching of the parsed tracklines file. By default parsed "
+        "tracklines are cached in a '.mergesvp-cache' file alongside the "
+        "tracklines file to speed up later runs"
+    )
+)
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to read tracklines files and "
+        "generate synthetic SVPs. Use 0 for all available CPUs. Defaults to 1"
+    )
+)
+@click.option(
+    '-acs', '--atlas-cache-size',
+    required=False,
+    default=1024,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of synthetic profiles (one per atlas grid cell and month) "
+        "cached in memory, avoids querying the atlas for locations that "
+        "share a grid cell. Use 0 to disable. Defaults to 1024"
+    )
+)
+@click.option(
+    '-pcs', '--persistent-cache-size',
+    required=False,
+    default=DEFAULT_MAX_SIZE,
+    type=click.FloatRange(min=0),
+    help=(
+        "Maximum size (MB) of the on disk cache of synthetic profiles that "
+        "is shared across runs. Use 0 to disable. Defaults to "
+        f"{DEFAULT_MAX_SIZE} MB"
+    )
+)
+@click.option(
+    '-ae', '--atlas-engine',
+    required=False,
+    default='ssm',
+    type=click.Choice(ATLAS_ENGINES),
+    help=(
+        "How synthetic profiles are generated from the World Ocean Atlas. "
+        "'ssm' queries Sound Speed Manager for each profile, 'batch' loads "
+        "the atlas grid for the survey area once and calculates all profiles "
+        "together. Defaults to ssm"
+    )
+)
+@click.option(
+    '-ax', '--atlas-extract',
+    required=False,
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, resolve_path=True),
+    help=(
+        "Path to an atlas extract file (see extract-atlas) that is used to "
+        "generate synthetic profiles instead of the full World Ocean Atlas"
+    )
+)
+@click.option(
+    '-at', '--adaptive-tolerance',
+    required=False,
+    default=0,
+    type=click.FloatRange(min=0),
+    help=(
+        "Space synthetic SVPs by how much the atlas sound speed changes along "
+        "the tracklines. A new SVP is added when the speed changes by more "
+        "than this tolerance (m/s), or the maximum time gap (-xtg) has "
+        "passed. Defaults to 0 (SVPs are spaced by the time gap)"
+    )
+)
+@click.option(
+    '-mtg', '--min-time-gap',
+    required=False,
+    default=0.5,
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Minimum time (hours) between synthetic SVPs when the adaptive "
+        "tolerance (-at) is used. Defaults to 0.5 hours"
+    )
+)
+@click.option(
+    '-xtg', '--max-time-gap',
+    required=False,
+    default=12,
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Maximum time (hours) between synthetic SVPs when the adaptive "
+        "tolerance (-at) is used, this may be longer than the time gap "
+        "(-tg). Defaults to 12 hours"
+    )
+)
+@click.option(
+    '-r', '--resume',
+    is_flag=True,
+    help=(
+        "Resume a previous run that failed. Synthetic profiles are saved to "
+        "a checkpoint file alongside the output as they are generated, "
+        "those already in the checkpoint are not generated again"
+    )
+)
+@click.option(
+    '-gf', '--geojson-format',
+    required=False,
+    default='indent',
+    type=click.Choice(GEOJSON_FORMATS),
+    help=(
+        "Format of the geojson summary files. 'indent' is indented JSON, "
+        "'compact' has no whitespace, and 'ndjson' writes one feature per "
+        "line (newline-delimited GeoJSON). Defaults to indent"
+    )
+)
+@click.option(
+    '-gp', '--geojson-precision',
+    required=False,
+    default=None,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of decimal places coordinates in the geojson summary files "
+        "are rounded to. By default coordinates are not rounded"
+    )
+)
 @click.pass_context
-def synthetic_svp(ctx, tracklines, output, time_gap, no_summary, date_format):
+def synthetic_svp(
+        ctx, tracklines, output, time_gap, no_summary, date_format,
+        simplify_tolerance, no_cache, jobs, atlas_cache_size,
+        persistent_cache_size, atlas_engine, atlas_extract,
+        adaptive_tolerance, min_time_gap, max_time_gap, resume,
+        geojson_format, geojson_precision):
     """
     Generates a series of synthetic SVPs based on a tracklines path and time
     gap.
     """
+    # see supplement_svp
+    from mergesvp.lib.syntheticprocess import synthetic_svp_process
+
     synthetic_svp_process(
-        tracklines=Path(tracklines),
+        tracklines=tracklines,
         output=output,
         time_gap=time_gap,
         fail_on_error=ctx.obj['fail_on_error'],
         generate_summary=not no_summary,
-        date_format=dateformat_to_pythondateformat(date_format)
+        date_format=dateformat_to_pythondateformat(date_format),
+        simplify_tolerance=simplify_tolerance,
+        use_trackline_cache=not no_cache,
+        jobs=jobs,
+        atlas_cache_size=atlas_cache_size,
+        persistent_cache_size=persistent_cache_size,
+        atlas_engine=atlas_engine,
+        atlas_extract=None if atlas_extract is None else Path(atlas_extract),
+        speed_tolerance=adaptive_tolerance,
+        min_time_gap=min_time_gap,
+        max_time_gap=max_time_gap,
+        resume=resume,
+        geojson_format=geojson_format,
+        geojson_precision=geojson_precision
+    )
+
+
+@click.command()
+@click.option(
+    '-t', '--tracklines',
+    required=True,
+    type=str,
+    callback=tracklines_files_callback,
+    help=(
+        "Path to CSV formatted tracklines file. May also be a folder "
+        "containing multiple tracklines files, or a glob pattern (eg; "
+        "'nav/*.csv')"
+    )
+)
+@click.option(
+    '-o', '--output',
+    required=True,
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True),
+    help="Output location for the atlas extract file."
+)
+@click.option(
+    '-df', '--date-format',
+    required=False,
+    default='dmy',
+    type=click.Choice(['dmy', 'mdy', 'ymd']),
+    help=(
+        "Date format used by the tracklines input file. Options are "
+        "dmy (day/month/year), mdy (month/day/year), and ymd (year/month/day). "
+        "Defaults to dmy"
+    )
+)
+@click.option(
+    '-p', '--padding',
+    required=False,
+    default=1.0,
+    type=click.FloatRange(min=0),
+    help=(
+        "Distance (degrees) the extract extends beyond the tracklines. "
+        "Defaults to 1 degree"
+    )
+)
+@click.option(
+    '-am', '--all-months',
+    is_flag=True,
+    help=(
+        "Include all months in the extract, by default only the months "
+        "covered by the tracklines are included"
+    )
+)
+@click.option(
+    '-nc', '--no-cache',
+    is_flag=True,
+    help=(
+        "Disable caching of the parsed tracklines file. By default parsed "
+        "tracklines are cached in a '.mergesvp-cache' file alongside the "
+        "tracklines file to speed up later runs"
+    )
+)
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to read tracklines files. Use 0 for "
+        "all available CPUs. Defaults to 1"
+    )
+)
+def extract_atlas(
+        tracklines, output, date_format, padding, all_months, no_cache, jobs):
+    """
+    Extracts the World Ocean Atlas data covering the tracklines into a small
+    file, synthetic SVPs can then be generated from this file without the
+    full atlas.
+    """
+    # see supplement_svp
+    from mergesvp.lib.atlasextractprocess import atlas_extract_process
+
+    atlas_extract_process(
+        tracklines=tracklines,
+        output=Path(output),
+        date_format=dateformat_to_pythondateformat(date_format),
+        padding=padding,
+        all_months=all_months,
+        use_trackline_cache=not no_cache,
+        jobs=jobs
+    )
+
+
+@click.command()
+@click.option(
+    '-o', '--output',
+    required=True,
+    type=click.Path(file_okay=False, dir_okay=True, resolve_path=True),
+    help="Output folder the fixtures are written to."
+)
+@click.option(
+    '-s', '--seed',
+    required=False,
+    default=0,
+    type=int,
+    help=(
+        "Seed of the randomly generated data, the same seed always generates "
+        "the same files. Defaults to 0"
+    )
+)
+@click.option(
+    '-sc', '--scale',
+    required=False,
+    default=1.0,
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Multiplies the size of the generated fixtures. At a scale of 1 "
+        "2000 survey svp files, a 100k section CARIS file, 1M row tracklines "
+        "files, and 1000 L0 and L2 casts are written. Defaults to 1"
+    )
+)
+@click.option(
+    '-f', '--fixture',
+    'fixtures',
+    required=False,
+    multiple=True,
+    type=click.Choice(FIXTURES),
+    help=(
+        "Fixture to generate, may be given multiple times. Defaults to all "
+        "fixtures"
+    )
+)
+@click.option(
+    '-l', '--levels',
+    required=False,
+    default=200,
+    type=click.IntRange(min=2),
+    help="Number of depth levels in each profile. Defaults to 200"
+)
+@click.option(
+    '-dr', '--duplicate-ratio',
+    required=False,
+    default=0.2,
+    type=click.FloatRange(min=0, max=1),
+    help=(
+        "Fraction of CARIS profiles that duplicate an earlier profile. "
+        "Defaults to 0.2"
+    )
+)
+@click.option(
+    '-j', '--jobs',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of worker processes used to write the fixtures. Use 0 for "
+        "all available CPUs. Defaults to 1"
+    )
+)
+def generate_fixtures(
+        output, seed, scale, fixtures, levels, duplicate_ratio, jobs):
+    """
+    Generates large input datasets for load testing; a survey folder of
+    CARIS svp files, a merged CARIS file, tracklines files in each date
+    format, and L0 and L2 casts with SVP list files.
+    """
+    generate_fixtures_process(
+        output=Path(output),
+        seed=seed,
+        scale=scale,
+        fixtures=list(fixtures) if len(fixtures) > 0 else FIXTURES,
+        levels=levels,
+        duplicate_ratio=duplicate_ratio,
+        jobs=jobs
     )
 
 
+@click.group()
+def cache():
+    """
+    Manage the persistent cache of synthetic SVP profiles that is shared
+    across runs of the supplement-svp and synthetic-svp commands.
+    """
+    pass
+
+
+@click.command(name='stats')
+def cache_stats():
+    """ Shows the number and size of the cached synthetic SVP profiles """
+    cache_path = get_cache_path()
+    click.echo(f"Cache location: {cache_path}")
+    if not cache_path.exists():
+        click.echo("Cache is empty")
+        return
+    profile_cache = PersistentSvpCache(cache_path)
+    stats = profile_cache.stats()
+    profile_cache.close()
+    if len(stats) == 0:
+        click.echo("Cache is empty")
+    for (atlas, atlas_stats) in stats.items():
+        size_mb = atlas_stats['size'] / 1024 / 1024
+        click.echo(
+            f"{atlas}: {atlas_stats['profiles']} profiles, {size_mb:.2f} MB")
+
+
+@click.command(name='clear')
+def cache_clear():
+    """ Removes all cached synthetic SVP profiles """
+    cache_path = get_cache_path()
+    if cache_path.exists():
+        profile_cache = PersistentSvpCache(cache_path)
+        profile_cache.clear()
+        profile_cache.close()
+    click.echo(f"Cleared cache {cache_path}")
+
+
+cache.add_command(cache_stats)
+cache.add_command(cache_clear)
+
+
 @click.group()
 @click.option(
     '-e', '--fail-on-error',
@@ -227,19 +771,78 @@ def synthetic_svp(ctx, tracklines, output, time_gap, no_summary, date_format):
         "or fail and exit the application"
     )
 )
+@click.option(
+    '--profile',
+    required=False,
+    default=None,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help=(
+        "Record the time, CPU time, peak memory and number of items "
+        "processed by each stage of the command. A JSON report is written "
+        "to this path, and a summary table is shown when the command ends"
+    )
+)
+@click.option(
+    '--metrics',
+    required=False,
+    default=None,
+    type=click.Path(file_okay=True, dir_okay=False),
+    help=(
+        "Write metrics of the run (eg; files and profiles read, duplicates "
+        "removed, synthetic profiles generated, cache hits, warnings, and "
+        "throughput) to this path when the command ends"
+    )
+)
+@click.option(
+    '--metrics-format',
+    required=False,
+    default='json',
+    type=click.Choice(METRICS_FORMATS),
+    help=(
+        "Format of the metrics file, json or prometheus (textfile collector "
+        "format). Defaults to json"
+    )
+)
+@click.option(
+    '-ct', '--compress-threads',
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help=(
+        "Number of threads used to compress output files, for outputs "
+        "with a gzip or zstd extension (eg; output.txt.gz). Use 0 for all "
+        "available CPUs. Defaults to 1"
+    )
+)
 @click.pass_context
-def cli(ctx, fail_on_error):
+def cli(
+        ctx, fail_on_error, profile, metrics, metrics_format,
+        compress_threads):
     ctx.obj['fail_on_error'] = fail_on_error
-    pass
+    configure_compression(compress_threads)
+    if profile is not None:
+        start_profiling()
+        ctx.call_on_close(lambda: stop_profiling(Path(profile)))
+    start_metrics(ctx.invoked_subcommand)
+    start_warnings()
+    if metrics is not None:
+        ctx.call_on_close(
+            lambda: write_metrics(Path(metrics), metrics_format))
+    # registered last so the summary is shown before the profiling table
+    ctx.call_on_close(report_warnings)
 
 
 cli.add_command(merge_raw_svp)
 cli.add_command(merge_caris_svp)
 cli.add_command(supplement_svp)
 cli.add_command(synthetic_svp)
+cli.add_command(extract_atlas)
+cli.add_command(generate_fixtures)
+cli.add_command(cache)
 
 
 def main():
+    configure_logger()
     cli(obj={})
 
 
@@ -51,3 +51,31 @@ svp_4 = SvpProfile(
         (5.5, 2.5),
     ]
 )
+
+
+def write_mock_woa18_files(folder, lon_idxs=range(1300, 1310)):
+    """ Writes WOA18 netCDF files for August (and its season) covering a
+    small region of the grid starting at global grid cell (290, 1300), or
+    the columns given by `lon_idxs`. All cells have a temperature of 20 and
+    salinity of 35.
+    """
+    import netCDF4
+    import numpy as np
+
+    lats = -89.875 + np.arange(290, 300) * 0.25
+    lons = -179.875 + np.array(lon_idxs) * 0.25
+    for (code, variable, value) in (('t', 't_an', 20.0), ('s', 's_an', 35.0)):
+        for (period, depths) in ((8, [0.0, 10.0]), (15, [0.0, 10.0, 50.0])):
+            filename = folder / f'woa18_decav_{code}{period:02d}_04.nc'
+            with netCDF4.Dataset(str(filename), 'w') as dataset:
+                dataset.createDimension('time', 1)
+                dataset.createDimension('depth', len(depths))
+                dataset.createDimension('lat', len(lats))
+                dataset.createDimension('lon', len(lons))
+                dataset.createVariable('depth', 'f4', ('depth',))[:] = depths
+                dataset.createVariable('lat', 'f4', ('lat',))[:] = lats
+                dataset.createVariable('lon', 'f4', ('lon',))[:] = lons
+                dataset.createVariable(
+                    variable, 'f4', ('time', 'depth', 'lat', 'lon'),
+                    fill_value=9.96921e+36
+                )[:] = value
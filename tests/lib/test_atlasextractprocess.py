@@ -0,0 +1,49 @@
+import pytest
+from datetime import datetime
+
+pytest.importorskip('numpy')
+pytest.importorskip('netCDF4')
+
+from mergesvp.lib import atlasextractprocess
+from mergesvp.lib.atlasextractprocess import atlas_extract_process, get_months
+from mergesvp.lib.atlasgrid import load_atlas_extract
+from tests.lib.mock_data import write_mock_woa18_files
+
+
+tracklines_csv = """Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)
+8/1/20,10:24:52.562,0000_20200801_102451_FK200804_EM710,146.1,-16.7,58.726
+8/1/20,10:34:52.874,0000_20200801_102451_FK200804_EM710,146.4,-16.6,58.644
+"""
+
+
+def test_get_months():
+    assert get_months(datetime(2020, 8, 1), datetime(2020, 8, 31)) == [8]
+    assert get_months(datetime(2020, 11, 30), datetime(2021, 2, 1)) == \
+        [1, 2, 11, 12]
+    assert get_months(datetime(2019, 1, 1), datetime(2021, 1, 1)) == \
+        list(range(1, 13))
+
+
+def test_atlas_extract_process(tmp_path, monkeypatch):
+    class MockAtlas:
+        data_folder = tmp_path
+
+    write_mock_woa18_files(tmp_path)
+    monkeypatch.setattr(
+        atlasextractprocess, 'get_ssm_atlas', lambda: MockAtlas())
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(tracklines_csv)
+    extract_file = tmp_path / 'region.mergesvp-atlas'
+
+    atlas_extract_process(
+        tracklines=[tracklines_file],
+        output=extract_file,
+        date_format=r'%m/%d/%y',
+        padding=0.5
+    )
+
+    extract = load_atlas_extract(extract_file)
+    assert extract.months == [8]
+    # tracklines cover cells (293, 1304) to (293, 1305), plus 2 cells padding
+    assert (extract.lat_idx0, extract.lon_idx0) == (291, 1302)
+    assert extract.shape == (5, 6)
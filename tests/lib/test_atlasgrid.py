@@ -0,0 +1,141 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('gsw')
+
+from mergesvp.lib.atlasgrid import \
+    AtlasGrid, \
+    get_region, \
+    load_atlas_extract, \
+    load_woa18_grid, \
+    sound_speed
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+from tests.lib.mock_data import write_mock_woa18_files
+
+
+def _mock_grid() -> AtlasGrid:
+    depths = np.array([0.0, 10.0, 20.0])
+    temperature = np.full((3, 3, 3), 20.0, dtype=np.float32)
+    salinity = np.full((3, 3, 3), 35.0, dtype=np.float32)
+    # cell (0, 0) is land
+    temperature[:, 0, 0] = np.nan
+    salinity[:, 0, 0] = np.nan
+    # cell (1, 1) is only 10m deep
+    temperature[2, 1, 1] = np.nan
+    return AtlasGrid(
+        lat_idx0=290,
+        lon_idx0=1300,
+        depths={8: depths},
+        temperature={8: temperature},
+        salinity={8: salinity}
+    )
+
+
+def test_sound_speed():
+    speeds = sound_speed(
+        np.array([0.0]),
+        np.array([[20.0]]),
+        np.array([[35.0]]),
+        np.array([-16.0]),
+        np.array([146.0])
+    )
+    assert speeds[0, 0] == pytest.approx(1521.4, abs=0.1)
+
+
+def test_atlas_grid_profiles():
+    grid = _mock_grid()
+    profiles = grid.profiles([
+        (291, 1301, 8),
+        (292, 1302, 8),
+        # land, so the nearest cell with data is used
+        (290, 1300, 8),
+        # no data for this month
+        (291, 1301, 9),
+        # too far from the grid
+        (200, 1301, 8),
+    ])
+
+    assert [depth for (depth, _) in profiles[0]] == [0.0, 10.0]
+    assert [depth for (depth, _) in profiles[1]] == [0.0, 10.0, 20.0]
+    assert profiles[1][0][1] == pytest.approx(1521.4, abs=0.1)
+    # speed increases with pressure
+    assert profiles[1][2][1] > profiles[1][0][1]
+    assert len(profiles[2]) == 3
+    assert profiles[3] is None
+    assert profiles[4] is None
+
+
+def test_load_woa18_grid(tmp_path):
+    pytest.importorskip('netCDF4')
+    write_mock_woa18_files(tmp_path)
+
+    grid = load_woa18_grid(tmp_path, [(293, 1304, 8)])
+    assert grid.months == [8]
+    assert (grid.lat_idx0, grid.lon_idx0) == (291, 1302)
+    assert grid.shape == (5, 5)
+    # monthly data is extended with the deeper seasonal data
+    assert grid.depths[8].tolist() == [0.0, 10.0, 50.0]
+
+    profile = grid.profiles([(293, 1304, 8)])[0]
+    assert [depth for (depth, _) in profile] == [0.0, 10.0, 50.0]
+
+
+def test_get_region():
+    assert get_region([291, 293], [1302, 1304], 1) == ((290, 295), (1301, 1306))
+    # regions crossing the antimeridian continue past the last column
+    assert get_region([291], [1439, 0, 1], 2) == ((289, 294), (1437, 1444))
+    assert get_region([291], [1440], 0) == ((291, 292), (0, 1))
+    # the whole globe
+    assert get_region([291], range(0, 1440, 4), 2)[1] == (0, 1440)
+
+
+def test_load_woa18_grid_antimeridian(tmp_path):
+    pytest.importorskip('netCDF4')
+    write_mock_woa18_files(tmp_path, lon_idxs=range(1440))
+
+    grid = load_woa18_grid(tmp_path, [(293, 1439, 8), (293, 0, 8)])
+    assert (grid.lat_idx0, grid.lon_idx0) == (291, 1437)
+    assert grid.shape == (5, 6)
+
+    profiles = grid.profiles([(293, 1439, 8), (293, 0, 8), (293, 1440, 8)])
+    assert all(
+        [depth for (depth, _) in profile] == [0.0, 10.0, 50.0]
+        for profile in profiles
+    )
+    # the same position, either side of the antimeridian
+    assert profiles[1] == profiles[2]
+
+
+def test_atlas_grid_profiles_wrap():
+    # the nearest cell with data is found across the antimeridian of a
+    # global grid
+    temperature = np.full((1, 1, 1440), np.nan, dtype=np.float32)
+    temperature[0, 0, 1439] = 20.0
+    grid = AtlasGrid(
+        lat_idx0=290,
+        lon_idx0=0,
+        depths={8: np.array([0.0])},
+        temperature={8: temperature},
+        salinity={8: np.full((1, 1, 1440), 35.0, dtype=np.float32)}
+    )
+    assert grid.profiles([(290, 1, 8)])[0] is not None
+    assert grid.profiles([(290, 5, 8)])[0] is None
+
+
+def test_atlas_extract(tmp_path):
+    grid = _mock_grid()
+    extract_file = tmp_path / 'region.mergesvp-atlas'
+    grid.save(extract_file)
+
+    extract = load_atlas_extract(extract_file)
+    assert (extract.lat_idx0, extract.lon_idx0) == (290, 1300)
+    assert extract.shape == (3, 3)
+    assert extract.months == [8]
+
+    cells = [(291, 1301, 8), (292, 1302, 8), (290, 1300, 8)]
+    assert extract.profiles(cells) == grid.profiles(cells)
+
+    other_file = tmp_path / 'other.bin'
+    other_file.write_bytes(b'not an atlas extract')
+    with pytest.raises(SyntheticSvpGenerationException):
+        load_atlas_extract(other_file)
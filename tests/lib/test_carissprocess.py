@@ -1,7 +1,13 @@
 import pytest
 
 from mergesvp.lib.carisprocess import \
-    depth_speed_compare, group_by_depth_speed
+    GroupSummarySink, \
+    TimeSummarySink, \
+    depth_speed_compare, \
+    group_by_depth_speed, \
+    write_dt_summary_data, \
+    write_grouping_summary_data
+from mergesvp.lib.outputs import write_outputs
 
 from tests.lib.mock_data import svp_1, svp_2, svp_3
 
@@ -21,3 +27,28 @@ def test_group_svps():
     assert svp_1 in groups[0]
     assert svp_2 in groups[0]
     assert svp_3 in groups[1]
+
+
+def test_summary_sinks(tmp_path):
+    groups = group_by_depth_speed([svp_1, svp_2, svp_3])
+    svp_no_dups = [group[0] for group in groups]
+
+    write_outputs(
+        svp_no_dups,
+        [
+            GroupSummarySink(tmp_path / 'group.csv', groups),
+            TimeSummarySink(tmp_path / 'time.csv'),
+        ]
+    )
+
+    # same as the summaries written from the complete lists
+    with (tmp_path / 'expected_group.csv').open('w') as output:
+        write_grouping_summary_data(groups, output)
+    with (tmp_path / 'expected_time.csv').open('w') as output:
+        write_dt_summary_data(svp_no_dups, output)
+    group_summary = (tmp_path / 'group.csv').read_text()
+    assert group_summary == (tmp_path / 'expected_group.csv').read_text()
+    assert len(group_summary.splitlines()) == 4
+    time_summary = (tmp_path / 'time.csv').read_text()
+    assert time_summary == (tmp_path / 'expected_time.csv').read_text()
+    assert len(time_summary.splitlines()) == 3
@@ -0,0 +1,66 @@
+import pytest
+from datetime import datetime, timedelta
+
+from mergesvp.lib.checkpoint import SvpCheckpoint, get_checkpoint_path
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+
+
+START = datetime(2020, 8, 1)
+POSITIONS = [
+    (-16.0 - i / 10, 146.0 + i / 10, START + timedelta(hours=i))
+    for i in range(5)
+]
+
+
+def _generate(positions):
+    for (latitude, _, _) in positions:
+        yield [(0.0, 1500.0 + latitude), (10.0, 1510.5)]
+
+
+def test_checkpoint_resume(tmp_path):
+    path = get_checkpoint_path(tmp_path / 'output.txt')
+    assert path.name == 'output.txt_checkpoint.jsonl'
+    settings = {'command': 'synthetic-svp'}
+
+    # the run fails after generating 3 profiles
+    with pytest.raises(SyntheticSvpGenerationException):
+        with SvpCheckpoint(path, settings) as checkpoint:
+            for (i, _) in enumerate(
+                    checkpoint.iter_profiles(POSITIONS, _generate)):
+                if i == 2:
+                    raise SyntheticSvpGenerationException("atlas failed")
+    assert path.is_file()
+    # simulate a profile that was partially written when the process died
+    with path.open('a') as f:
+        f.write('{"timestamp": "2020-')
+
+    generated = []
+
+    def generate(positions):
+        generated.extend(positions)
+        return _generate(positions)
+
+    with SvpCheckpoint(path, settings, resume=True) as checkpoint:
+        assert len(checkpoint.completed) == 3
+        profiles = list(checkpoint.iter_profiles(POSITIONS, generate))
+
+    # only the profiles missing from the checkpoint are generated
+    assert generated == POSITIONS[3:]
+    assert profiles == list(_generate(POSITIONS))
+    # removed once the run succeeds
+    assert not path.exists()
+
+
+def test_checkpoint_settings(tmp_path):
+    path = tmp_path / 'output.txt_checkpoint.jsonl'
+    with pytest.raises(RuntimeError):
+        with SvpCheckpoint(path, {'atlas_engine': 'ssm'}) as checkpoint:
+            list(checkpoint.iter_profiles(POSITIONS, _generate))
+            raise RuntimeError()
+
+    with pytest.raises(SyntheticSvpGenerationException):
+        SvpCheckpoint(path, {'atlas_engine': 'batch'}, resume=True).open()
+
+    # without resume the checkpoint is replaced
+    with SvpCheckpoint(path, {'atlas_engine': 'batch'}) as checkpoint:
+        assert len(checkpoint.completed) == 0
@@ -0,0 +1,76 @@
+import gzip
+import pytest
+from datetime import datetime
+
+from mergesvp.lib import compression
+from mergesvp.lib.compression import \
+    configure_compression, \
+    get_compression_from_content, \
+    open_file, \
+    strip_compression_suffix
+from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.rawprocess import find_svp_profile_file
+from mergesvp.lib.svpprofile import SvpProfile
+
+TEXT = ''.join(f"{i} {i * 0.5:.6f}\n" for i in range(50000))
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.bz2', '.xz', '.zst'])
+def test_open_file(tmp_path, suffix):
+    if suffix == '.zst':
+        pytest.importorskip('zstandard')
+    path = tmp_path / f'output.txt{suffix}'
+    with open_file(path, 'w') as f:
+        f.write(TEXT)
+    with open_file(path) as f:
+        assert f.name == str(path)
+        assert f.read() == TEXT
+
+    # compression is detected from the content, not the extension
+    renamed = path.rename(tmp_path / 'renamed.txt')
+    expected = None if suffix == '' else \
+        compression.get_compression_from_name(path)
+    assert get_compression_from_content(renamed) == expected
+    with open_file(renamed) as f:
+        assert f.read() == TEXT
+
+
+def test_parallel_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, 'GZIP_BLOCK_SIZE', 1000)
+    configure_compression(4)
+    try:
+        path = tmp_path / 'output.txt.gz'
+        with open_file(path, 'w') as f:
+            f.write(TEXT)
+    finally:
+        configure_compression(1)
+    # written as multiple gzip members, read as a single stream
+    data = path.read_bytes()
+    assert data.count(b'\x1f\x8b\x08') > 1
+    assert gzip.decompress(data).decode() == TEXT
+    with open_file(path) as f:
+        assert f.read() == TEXT
+
+
+def test_compressed_svp_files(tmp_path):
+    assert strip_compression_suffix('output.txt.gz') == 'output.txt'
+    assert strip_compression_suffix('output.txt') == 'output.txt'
+
+    svp = SvpProfile(
+        timestamp=datetime(2020, 1, 1),
+        latitude=-12.5,
+        longitude=130.25,
+        depth_speed=[(0.0, 1500.0), (10.0, 1510.0)]
+    )
+    output = tmp_path / 'merged.txt.gz'
+    CarisSvpParser().write_many(output, [svp])
+    with gzip.open(output, 'rt') as f:
+        assert f.read().splitlines()[:2] == ['[SVP_VERSION_2]', 'merged.txt']
+
+    svps = CarisSvpParser().read_many(output)
+    assert svps[0].depth_speed == svp.depth_speed
+
+    (tmp_path / 'L0').mkdir()
+    l0_file = tmp_path / 'L0' / 'V000001.TXT.gz'
+    l0_file.write_bytes(b'')
+    assert find_svp_profile_file('V000001.TXT', tmp_path) == l0_file
@@ -0,0 +1,61 @@
+from mergesvp.lib.carisprocess import \
+    find_svp_files, \
+    group_by_depth_speed, \
+    load_svps
+from mergesvp.lib.fixtureprocess import FixtureProcessor
+from mergesvp.lib.parsers import CarisSvpParser, L0SvpParser
+from mergesvp.lib.rawprocess import find_svp_profile_file, get_svp_list
+from mergesvp.lib.tracklines import TracklinesParser
+from mergesvp.lib.utils import dateformat_to_pythondateformat
+
+
+def _generate(output, seed=0):
+    processor = FixtureProcessor(
+        output, seed=seed, scale=0.001, levels=20, duplicate_ratio=0.5)
+    processor.process()
+    return processor
+
+
+def test_generate_fixtures(tmp_path):
+    processor = _generate(tmp_path)
+
+    svp_files = find_svp_files(tmp_path / 'survey', None)
+    assert len(svp_files) == processor.survey_files
+    svps = load_svps(svp_files, fail_on_error=True)
+    assert len(svps) == \
+        processor.survey_files * processor.survey_profiles_per_file
+    assert all(len(svp.depth_speed) == 20 for svp in svps)
+    # duplicates are included
+    assert len(group_by_depth_speed(svps)) < len(svps)
+
+    caris_svps = CarisSvpParser().read_many(tmp_path / 'merged_caris.txt')
+    assert len(caris_svps) == processor.caris_sections
+    assert abs(caris_svps[0].latitude) < 20
+
+    for date_format in ['dmy', 'mdy', 'ymd']:
+        parser = TracklinesParser()
+        parser.date_format = dateformat_to_pythondateformat(date_format)
+        tracklines = parser.read(tmp_path / f'tracklines_{date_format}.csv')
+        assert sum(len(tl.points) for tl in tracklines) == \
+            processor.trackline_rows
+        assert tracklines[0].points[0].timestamp.year == 2020
+
+    svp_list_file = tmp_path / 'casts' / 'svp_list_l0.csv'
+    with svp_list_file.open() as f:
+        sources = get_svp_list(f)
+    assert len(sources) == processor.casts
+    path = find_svp_profile_file(sources[0].filename, svp_list_file.parent)
+    svp = L0SvpParser().read(path)
+    assert svp.timestamp == sources[0].timestamp
+    assert abs(svp.latitude - sources[0].latitude) < 0.0001
+    assert len(svp.depth_speed) == 20
+
+
+def test_generate_fixtures_seed(tmp_path):
+    _generate(tmp_path / 'a')
+    _generate(tmp_path / 'b')
+    _generate(tmp_path / 'c', seed=1)
+    for name in ['merged_caris.txt', 'tracklines_dmy.csv']:
+        a = (tmp_path / 'a' / name).read_text()
+        assert a == (tmp_path / 'b' / name).read_text()
+        assert a != (tmp_path / 'c' / name).read_text()
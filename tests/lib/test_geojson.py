@@ -0,0 +1,66 @@
+import io
+import json
+import pytest
+
+from mergesvp.lib.geojson import \
+    GeojsonLineStringFeature, \
+    GeojsonPointFeature, \
+    GeojsonRoot, \
+    GeojsonWriter
+
+
+def _features():
+    point = GeojsonPointFeature()
+    point.point = [130.123456789, -12.987654321]
+    point.properties = {'timestamp': '2020-01-01 00:00:00'}
+    line = GeojsonLineStringFeature()
+    line.points = [[130.123456789, -12.5], [130.2, -12.456789123]]
+    line.properties = {'line_id': 'L1'}
+    return [point, line]
+
+
+def _write(format, precision=None, features=None):
+    output = io.StringIO()
+    with GeojsonWriter(output, format, precision) as writer:
+        writer.write_features(_features() if features is None else features)
+    return output.getvalue()
+
+
+def test_geojson_writer_indent():
+    for features in [[], _features()]:
+        root = GeojsonRoot()
+        for feature in features:
+            root.feature_collection.add_feature(feature)
+        # same as the complete object tree written in one go
+        assert _write('indent', features=features) == \
+            json.dumps(root.to_geojson(), indent=2)
+
+
+def test_geojson_writer_compact():
+    assert _write('compact', features=[]) == \
+        '{"type":"FeatureCollection","features":[]}'
+    data = json.loads(_write('compact', precision=3))
+    assert data['type'] == 'FeatureCollection'
+    assert data['features'][0]['geometry']['coordinates'] == \
+        [130.123, -12.988]
+    assert data['features'][1]['geometry']['coordinates'] == \
+        [[130.123, -12.5], [130.2, -12.457]]
+
+
+def test_geojson_writer_ndjson():
+    lines = _write('ndjson').splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])['properties'] == {'line_id': 'L1'}
+    assert ' ' not in lines[1]
+
+
+def test_geojson_writer_error():
+    output = io.StringIO()
+    with pytest.raises(RuntimeError):
+        with GeojsonWriter(output, 'compact') as writer:
+            writer.write_features(_features())
+            raise RuntimeError("failed")
+    # the FeatureCollection is only ended if all features were written
+    assert output.getvalue().startswith(
+        '{"type":"FeatureCollection","features":[')
+    assert not output.getvalue().endswith(']}')
@@ -0,0 +1,57 @@
+import json
+
+from mergesvp.lib.metrics import \
+    add_files_read, \
+    add_metric, \
+    start_metrics, \
+    write_metrics
+
+
+def test_metrics_json(tmp_path):
+    metrics = start_metrics('merge-caris-svp')
+    input_file = tmp_path / 'svp'
+    input_file.write_text('0123456789')
+    add_files_read([input_file, input_file])
+    add_metric('profiles_parsed', 20)
+    add_metric('warnings', 2, category='svp_parse')
+    add_metric('warnings', category='trackline_cache')
+    add_metric('warnings', category='svp_parse')
+    assert metrics.get('warnings', category='svp_parse') == 3
+    assert metrics.total('warnings') == 4
+
+    output = tmp_path / 'metrics.json'
+    write_metrics(output)
+    with output.open() as f:
+        data = json.load(f)
+
+    assert data['command'] == 'merge-caris-svp'
+    values = data['metrics']
+    assert values['files_read'] == 2
+    assert values['bytes_read'] == 20
+    assert values['warnings'] == {'svp_parse': 3, 'trackline_cache': 1}
+    assert values['duration_seconds'] > 0
+    assert values['profiles_parsed_per_second'] > 0
+    # no rate for metrics that weren't recorded
+    assert 'synthetic_profiles_per_second' not in values
+
+
+def test_metrics_prometheus(tmp_path):
+    start_metrics('synthetic-svp')
+    add_metric('synthetic_profiles_generated', 123456789)
+    add_metric('atlas_cache_hits', 5, cache='memory')
+
+    output = tmp_path / 'mergesvp.prom'
+    write_metrics(output, 'prometheus')
+    lines = output.read_text().splitlines()
+
+    assert "# TYPE mergesvp_synthetic_profiles_generated_total counter" \
+        in lines
+    assert (
+        'mergesvp_synthetic_profiles_generated_total'
+        '{command="synthetic-svp"} 123456789'
+    ) in lines
+    assert (
+        'mergesvp_atlas_cache_hits_total'
+        '{command="synthetic-svp",cache="memory"} 5'
+    ) in lines
+    assert "# TYPE mergesvp_duration_seconds gauge" in lines
@@ -0,0 +1,69 @@
+import pytest
+from datetime import datetime
+
+from mergesvp.lib.outputs import \
+    CarisSink, \
+    GeojsonSink, \
+    SvpSink, \
+    write_outputs
+from mergesvp.lib.parsers import CarisSvpParser
+from mergesvp.lib.svpprofile import SvpProfile, svps_to_geojson_file
+
+
+def _get_svps():
+    return [
+        SvpProfile(
+            timestamp=datetime(2015, 5, 26, i, 1, 18),
+            latitude=-10.5 + i,
+            longitude=150.25 + i,
+            depth_speed=[(0.0, 1539.6 + i), (1.41, 1539.1 + i)]
+        )
+        for i in range(5)
+    ]
+
+
+def test_write_outputs(tmp_path):
+    svps = _get_svps()
+    caris_path = tmp_path / 'out' / 'svp.txt'
+    caris_path.parent.mkdir()
+    geojson_path = tmp_path / 'svp.geojson'
+
+    count = write_outputs(
+        (svp for svp in svps),
+        [CarisSink(caris_path), GeojsonSink(geojson_path, 'compact')]
+    )
+
+    assert count == 5
+    # same as each output written separately
+    expected_caris_path = tmp_path / 'svp.txt'
+    CarisSvpParser().write_many(expected_caris_path, svps)
+    assert caris_path.read_text() == expected_caris_path.read_text()
+    expected_geojson_path = tmp_path / 'expected.geojson'
+    svps_to_geojson_file(svps, expected_geojson_path, 'compact')
+    assert geojson_path.read_text() == expected_geojson_path.read_text()
+
+
+def test_write_outputs_error(tmp_path):
+    def iter_svps():
+        yield from _get_svps()
+        raise RuntimeError("failed")
+
+    geojson_path = tmp_path / 'svp.geojson'
+    sinks = [CarisSink(tmp_path / 'svp.txt'), GeojsonSink(geojson_path)]
+    with pytest.raises(RuntimeError):
+        write_outputs(iter_svps(), sinks)
+
+    # outputs are closed, the profiles already buffered are not written
+    assert (tmp_path / 'svp.txt').read_text() == "[SVP_VERSION_2]\nsvp.txt\n"
+    # the FeatureCollection is not ended, so is not valid GeoJSON
+    geojson = geojson_path.read_text()
+    assert geojson.startswith('{\n  "type": "FeatureCollection"')
+    assert not geojson.endswith(']\n}')
+
+
+def test_svp_sink_write_required():
+    class NoWriteSink(SvpSink):
+        pass
+
+    with pytest.raises(TypeError):
+        NoWriteSink()
@@ -2,6 +2,7 @@ import pytest
 from datetime import datetime
 
 from mergesvp.lib.svpprofile import SvpProfile
+from mergesvp.lib.errors import SvpParsingException
 from mergesvp.lib.parsers import CarisSvpParser, L0SvpParser, L2SvpParser
 
 
@@ -203,3 +204,42 @@ def test_parse_caris_read_many():
     assert len(svp2.depth_speed) == 4
     assert svp2.depth_speed[2][0] == 2.6
     assert svp2.depth_speed[2][1] == 1539.32
+
+
+def test_parse_caris_read_many_invalid_header():
+    lines = [
+        "[SVP_VERSION_2]",
+        "Section  2015-146 00:01:18 00:00:00 000:00:00",
+        "    0.000  1539.60",
+        "Section  2015-147 00:01:18",
+        "    0.000  1539.60",
+    ]
+    parser = CarisSvpParser()
+    with pytest.raises(SvpParsingException, match=r"line number ?4 "):
+        parser._read_many(lines)
+
+
+def test_caris_write_many_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr('mergesvp.lib.parsers.WRITE_CHUNK_SIZE', 2)
+    svps = []
+    for i in range(5):
+        svp = SvpProfile()
+        svp.timestamp = datetime(2015, 5, 26, i, 1, 18)
+        svp.latitude = -10.5 + i
+        svp.longitude = 150.25 + i
+        svp.depth_speed = [(0.0, 1539.6 + i), (1.41, 1539.1 + i)]
+        svps.append(svp)
+
+    serial_path = tmp_path / 'svp.txt'
+    parser = CarisSvpParser()
+    parser.write_many(serial_path, svps)
+
+    parallel_path = tmp_path / 'svp_parallel.txt'
+    parser.jobs = 2
+    parser.write_many(parallel_path, svps)
+
+    serial_lines = serial_path.read_text().splitlines()
+    parallel_lines = parallel_path.read_text().splitlines()
+    # header lines include the filename
+    assert serial_lines[2:] == parallel_lines[2:]
+    assert len(CarisSvpParser().read_many(parallel_path)) == 5
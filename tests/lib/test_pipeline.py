@@ -0,0 +1,76 @@
+import pytest
+import threading
+
+from mergesvp.lib.pipeline import BackgroundTasks, iter_in_background
+
+
+def test_iter_in_background():
+    threads = set()
+
+    def produce():
+        for i in range(100):
+            threads.add(threading.current_thread())
+            yield i
+
+    assert list(iter_in_background(produce(), maxsize=4)) == list(range(100))
+    # items were produced in a different thread
+    assert threading.current_thread() not in threads
+
+
+def test_iter_in_background_error():
+    def produce():
+        yield 1
+        raise ValueError("failed")
+
+    items = iter_in_background(produce())
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_iter_in_background_stop():
+    produced = []
+
+    def produce():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    items = iter_in_background(produce(), maxsize=2)
+    assert next(items) == 0
+    # stopping the consumer early also stops the producer
+    items.close()
+    assert len(produced) < 10
+
+
+def test_iter_in_background_close():
+    closed_by = []
+
+    def produce():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed_by.append(threading.current_thread())
+
+    items = iter_in_background(produce(), maxsize=2)
+    assert next(items) == 0
+    items.close()
+    # the producer is closed in its own thread before the consumer returns
+    assert len(closed_by) == 1
+    assert closed_by[0] is not threading.current_thread()
+
+
+def test_background_tasks():
+    results = []
+    with BackgroundTasks() as background:
+        background.submit(results.append, 1)
+        background.submit(results.append, 2)
+    assert results == [1, 2]
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        with BackgroundTasks() as background:
+            background.submit(fail)
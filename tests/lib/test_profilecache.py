@@ -0,0 +1,83 @@
+import sqlite3
+
+from mergesvp.lib import profilecache
+from mergesvp.lib.profilecache import PersistentSvpCache
+
+
+def test_persistent_cache(tmp_path):
+    cache_path = tmp_path / 'cache.sqlite'
+    profile = [(0.0, 1500.0), (10.0, 1510.5)]
+
+    cache = PersistentSvpCache(cache_path)
+    assert cache.get('woa18', (1, 2, 3)) is None
+    cache.put('woa18', (1, 2, 3), profile)
+    cache.close()
+
+    # profiles are available after the cache is reopened
+    cache = PersistentSvpCache(cache_path)
+    assert cache.get('woa18', (1, 2, 3)) == profile
+    # keyed on atlas as well as the grid cell
+    assert cache.get('other', (1, 2, 3)) is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    assert cache.stats() == {'woa18': {'profiles': 1, 'size': 32}}
+
+    cache.clear()
+    assert cache.stats() == {}
+    cache.close()
+
+
+def test_persistent_cache_eviction(tmp_path):
+    profile = [(float(i), 1500.0) for i in range(1000)]
+    # each profile is 16000 bytes, so only 3 will fit
+    cache = PersistentSvpCache(tmp_path / 'cache.sqlite', max_size=0.05)
+
+    for i in range(3):
+        cache.put('woa18', (i, 0, 1), profile)
+    # use the first profile, so the second is the least recently used
+    assert cache.get('woa18', (0, 0, 1)) is not None
+    cache.put('woa18', (3, 0, 1), profile)
+
+    assert cache.stats()['woa18']['profiles'] == 3
+    assert cache.get('woa18', (0, 0, 1)) is not None
+    assert cache.get('woa18', (1, 0, 1)) is None
+    cache.close()
+
+
+def test_persistent_cache_total_size(tmp_path):
+    cache_path = tmp_path / 'cache.sqlite'
+    cache = PersistentSvpCache(cache_path)
+    cache.put('woa18', (1, 2, 3), [(0.0, 1500.0), (10.0, 1510.5)])
+    cache.put('woa18', (1, 2, 4), [(0.0, 1500.0)])
+    assert cache.total_size() == 48
+    # replacing a profile only counts the new size
+    cache.put('woa18', (1, 2, 3), [(0.0, 1500.0)])
+    assert cache.total_size() == 32
+    cache.close()
+
+    # caches without the running total are summed when opened
+    connection = sqlite3.connect(str(cache_path))
+    connection.execute('DROP TABLE cache_info')
+    connection.commit()
+    connection.close()
+    cache = PersistentSvpCache(cache_path)
+    assert cache.total_size() == 32
+    cache.clear()
+    assert cache.total_size() == 0
+    cache.close()
+
+
+def test_persistent_cache_eviction_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(profilecache, 'EVICT_BATCH_SIZE', 2)
+    cache = PersistentSvpCache(tmp_path / 'cache.sqlite')
+    for i in range(10):
+        cache.put('woa18', (i, 0, 1), [(0.0, 1500.0)])
+
+    # evicting more profiles than are read in one batch
+    cache.max_size = 48 / (1024 * 1024)
+    assert cache.evict() == 7
+    assert cache.total_size() == 48
+    assert cache.get('woa18', (6, 0, 1)) is None
+    assert cache.get('woa18', (7, 0, 1)) is not None
+    cache.close()
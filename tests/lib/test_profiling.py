@@ -0,0 +1,45 @@
+import json
+
+from mergesvp.lib import profiling
+from mergesvp.lib.profiling import stage, start_profiling, stop_profiling
+
+
+def test_stage_disabled():
+    # stages can be used without profiling enabled
+    with stage('parse') as parse_stage:
+        parse_stage.items += 10
+    assert profiling.profiler is None
+
+
+def test_profiling(tmp_path):
+    profiler = start_profiling()
+    try:
+        for _ in range(2):
+            with stage('parse') as parse_stage:
+                parse_stage.items += 5
+                with stage('allocate'):
+                    data = bytearray(4 * 1024 * 1024)
+                del data
+        with stage('write'):
+            pass
+    finally:
+        report = tmp_path / 'profile.json'
+        stop_profiling(report)
+
+    assert profiling.profiler is None
+    assert [s.name for s in profiler.stages.values()] == \
+        ['parse', 'allocate', 'write']
+    parse_stage = profiler.stages['parse']
+    assert parse_stage.calls == 2
+    assert parse_stage.items == 10
+    # memory allocated by a nested stage counts towards the enclosing stage
+    assert profiler.stages['allocate'].peak_memory >= 4 * 1024 * 1024
+    assert parse_stage.peak_memory >= 4 * 1024 * 1024
+    assert profiler.stages['write'].peak_memory < 4 * 1024 * 1024
+    assert profiler.peak_memory >= 4 * 1024 * 1024
+
+    with report.open() as f:
+        report_data = json.load(f)
+    assert [s['name'] for s in report_data['stages']] == \
+        ['parse', 'allocate', 'write']
+    assert report_data['stages'][0]['items'] == 10
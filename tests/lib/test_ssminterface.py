@@ -0,0 +1,198 @@
+import pytest
+from datetime import datetime
+
+from mergesvp.lib import ssminterface
+from mergesvp.lib.errors import SyntheticSvpGenerationException
+from mergesvp.lib.ssminterface import \
+    SyntheticSvpCache, \
+    configure_atlas_extract, \
+    configure_persistent_cache, \
+    configure_svp_cache, \
+    get_atlas_cell, \
+    iter_ssm_synthetic_svps
+
+
+def test_get_atlas_cell():
+    ts = datetime(2020, 8, 1, 10, 0, 0)
+    cell = get_atlas_cell(-16.7456360, 146.1588473, ts)
+    assert cell == (293, 1304, 8)
+
+    # within the same grid cell
+    assert get_atlas_cell(-16.7, 146.2, datetime(2020, 8, 20)) == cell
+    # different month
+    assert get_atlas_cell(-16.7, 146.2, datetime(2020, 9, 1)) != cell
+    # next grid cell
+    assert get_atlas_cell(-16.5, 146.2, ts) != cell
+
+
+def test_synthetic_svp_cache():
+    cache = SyntheticSvpCache(max_size=2)
+
+    assert cache.get('a') is None
+    cache.put('a', [(0.0, 1500.0)])
+    cache.put('b', [(0.0, 1510.0)])
+    assert cache.get('a') == [(0.0, 1500.0)]
+
+    # 'b' is the least recently used, so it is removed
+    cache.put('c', [(0.0, 1520.0)])
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('c') == [(0.0, 1520.0)]
+
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+    # size of 0 disables the cache
+    cache = SyntheticSvpCache(max_size=0)
+    cache.put('a', [(0.0, 1500.0)])
+    assert cache.get('a') is None
+
+
+def test_iter_ssm_synthetic_svps(monkeypatch):
+    queries = []
+
+    def mock_query(latitude, longitude, timestamp):
+        queries.append((latitude, longitude, timestamp))
+        return [(0.0, 1500.0 + latitude)]
+
+    monkeypatch.setattr(ssminterface, '_query_ssm_synthetic_svp', mock_query)
+    configure_svp_cache(1024)
+    configure_persistent_cache(0)
+
+    positions = [
+        (-16.1, 146.0, datetime(2020, 8, 1)),
+        (-17.0, 146.0, datetime(2020, 8, 1)),
+        # same grid cell and month as the first position
+        (-16.05, 146.01, datetime(2020, 8, 2)),
+    ]
+    svps_data = list(iter_ssm_synthetic_svps(positions))
+
+    assert svps_data == [
+        [(0.0, 1500.0 - 16.1)],
+        [(0.0, 1483.0)],
+        [(0.0, 1500.0 - 16.1)],
+    ]
+    # the atlas is only queried once for each grid cell
+    assert len(queries) == 2
+
+
+def test_iter_ssm_synthetic_svps_jobs(monkeypatch):
+    # the atlas queries of the worker processes are replaced, the workers
+    # are spawned so would not see a patched `_query_ssm_synthetic_svp`
+    queried = []
+    closed = []
+
+    def mock_query_many(to_query, jobs):
+        queried.append((dict(to_query), jobs))
+        try:
+            for (key, (latitude, _, _)) in to_query.items():
+                yield (key, [(0.0, 1500.0 + latitude)])
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(
+        ssminterface, '_query_ssm_synthetic_svps', mock_query_many)
+    configure_svp_cache(1024)
+    configure_persistent_cache(0)
+
+    positions = [
+        (-20.1, 146.0, datetime(2020, 8, 1)),
+        (-21.0, 146.0, datetime(2020, 8, 1)),
+        # same grid cell and month as the first position
+        (-20.05, 146.01, datetime(2020, 8, 2)),
+    ]
+    svps = iter_ssm_synthetic_svps(positions, jobs=2)
+    # nothing is queried until the first profile is needed
+    assert queried == []
+    assert next(svps) == [(0.0, 1500.0 - 20.1)]
+    assert list(svps) == [[(0.0, 1479.0)], [(0.0, 1500.0 - 20.1)]]
+    # each grid cell is queried once, by 2 workers
+    assert len(queried) == 1
+    (to_query, jobs) = queried[0]
+    assert jobs == 2
+    assert list(to_query.values()) == positions[0:2]
+
+    # profiles are cached, so only the new cell is queried. Stopping early
+    # also stops the workers.
+    positions = [
+        (-20.1, 146.0, datetime(2020, 8, 1)),
+        (-22.0, 146.0, datetime(2020, 8, 1)),
+        (-23.0, 146.0, datetime(2020, 8, 1)),
+    ]
+    svps = iter_ssm_synthetic_svps(positions, jobs=2)
+    assert next(svps) == [(0.0, 1500.0 - 20.1)]
+    assert next(svps) == [(0.0, 1478.0)]
+    svps.close()
+    assert list(queried[1][0].values()) == positions[1:]
+    assert closed == [True, True]
+
+
+def test_iter_ssm_synthetic_svps_batch(monkeypatch):
+    ssm_queries = []
+
+    def mock_query(latitude, longitude, timestamp):
+        ssm_queries.append((latitude, longitude, timestamp))
+        return [(0.0, 1400.0)]
+
+    no_data_cell = get_atlas_cell(-17.0, 146.0, datetime(2020, 8, 1))
+
+    def mock_batch_query(cells):
+        # no data for the second cell
+        return [
+            None if cell == no_data_cell else [(0.0, 1500.0)]
+            for cell in cells
+        ]
+
+    monkeypatch.setattr(ssminterface, '_query_ssm_synthetic_svp', mock_query)
+    monkeypatch.setattr(
+        ssminterface, '_query_batch_synthetic_svps', mock_batch_query)
+    configure_svp_cache(1024)
+    configure_persistent_cache(0)
+
+    positions = [
+        (-16.1, 146.0, datetime(2020, 8, 1)),
+        (-17.0, 146.0, datetime(2020, 8, 1)),
+        (-16.05, 146.01, datetime(2020, 8, 2)),
+    ]
+    svps_data = list(iter_ssm_synthetic_svps(positions, engine='batch'))
+
+    assert svps_data == [[(0.0, 1500.0)], [(0.0, 1400.0)], [(0.0, 1500.0)]]
+    # SSM is only used for cells the batch engine has no data for
+    assert ssm_queries == [positions[1]]
+
+    # SSM profiles are cached as SSM profiles, whichever engine is used
+    assert list(iter_ssm_synthetic_svps([positions[1]])) == \
+        [[(0.0, 1400.0)]]
+    assert list(iter_ssm_synthetic_svps(
+        [positions[1]], engine='batch')) == [[(0.0, 1400.0)]]
+    assert ssm_queries == [positions[1]]
+
+
+def test_iter_ssm_synthetic_svps_extract(tmp_path):
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('gsw')
+    from mergesvp.lib.atlasgrid import AtlasGrid
+
+    grid = AtlasGrid(
+        lat_idx0=290,
+        lon_idx0=1300,
+        depths={8: np.array([0.0, 10.0])},
+        temperature={8: np.full((2, 10, 10), 20.0, dtype=np.float32)},
+        salinity={8: np.full((2, 10, 10), 35.0, dtype=np.float32)}
+    )
+    grid.save(tmp_path / 'region.mergesvp-atlas')
+    configure_svp_cache(1024)
+    configure_persistent_cache(0)
+    configure_atlas_extract(tmp_path / 'region.mergesvp-atlas')
+
+    try:
+        svps_data = list(iter_ssm_synthetic_svps(
+            [(-16.7, 146.1, datetime(2020, 8, 1))]))
+        assert [depth for (depth, _) in svps_data[0]] == [0.0, 10.0]
+
+        # outside of the extract
+        with pytest.raises(SyntheticSvpGenerationException):
+            list(iter_ssm_synthetic_svps(
+                [(-30.0, 146.1, datetime(2020, 8, 1))]))
+    finally:
+        configure_atlas_extract(None)
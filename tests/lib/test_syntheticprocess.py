@@ -2,6 +2,8 @@ import pytest
 from datetime import datetime, timedelta
 from mergesvp.lib.svpprofile import SvpProfile
 from mergesvp.lib.tracklines import Trackline, TracklinePoint
+from mergesvp.lib.ssminterface import get_atlas_cell
+from mergesvp.lib.warningsummary import start_warnings
 from tests.lib.mock_data import svp_1, svp_2, svp_3, svp_4
 from mergesvp.lib.syntheticprocess import \
     SyntheticSvpProcessor
@@ -36,10 +38,9 @@ def test_validate_tracklines():
     # should pass without exception
     processor._validate_trackline()
 
-    tl1_pt1.timestamp = datetime(2000, 1, 3, 12, 0, 0)
+    trackline1.points = [tl1_pt1]
 
-    # should fail with exception as the timestamp of the first point is after
-    # the second point
+    # should fail with exception as there's only a single point
     with pytest.raises(RuntimeError) as e_info:
         processor._validate_trackline()
 
@@ -71,3 +72,107 @@ def test_get_svp_times():
     # start and end (hence 25, and not 24)
     assert len(svp_times) == 25
 
+
+
+def _adaptive_processor(atlas_engine='ssm'):
+    start = datetime(2000, 1, 1, 0, 0, 0)
+    trackline1 = Trackline(None, None)
+    # travels 0.25 degrees (one atlas grid cell) each hour
+    trackline1.points = [
+        TracklinePoint(start, -16.0, 146.0, 200),
+        TracklinePoint(start + timedelta(hours=24), -16.0, 152.0, 200),
+    ]
+
+    processor = SyntheticSvpProcessor(None, None, None, None, None)
+    processor.trackline = trackline1
+    processor.atlas_engine = atlas_engine
+    processor.time_gap = 4
+    processor.min_time_gap = 1
+    processor.max_time_gap = 6
+    processor.speed_tolerance = 1
+    return processor
+
+
+def _hours(svp_times):
+    start = datetime(2000, 1, 1, 0, 0, 0)
+    return [(svp_time - start) // timedelta(hours=1) for svp_time in svp_times]
+
+
+def test_get_adaptive_svp_times(monkeypatch):
+    from mergesvp.lib import syntheticprocess
+
+    ssm_queries = []
+
+    def mock_get_ssm_synthetic_svp(latitude, longitude, timestamp):
+        # sharp change in sound speed at longitude 148.5
+        ssm_queries.append(timestamp)
+        return [(0.0, 1510.0 if longitude >= 148.5 else 1500.0)]
+
+    def mock_get_atlas_grid_profiles(cells):
+        raise AssertionError("the atlas grid is not used by the ssm engine")
+
+    monkeypatch.setattr(
+        syntheticprocess, 'get_ssm_synthetic_svp', mock_get_ssm_synthetic_svp)
+    monkeypatch.setattr(
+        syntheticprocess,
+        'get_atlas_grid_profiles',
+        mock_get_atlas_grid_profiles
+    )
+
+    processor = _adaptive_processor()
+    assert _hours(processor._get_adaptive_svp_times()) == [0, 6, 10, 16, 22]
+    # each cell compared is only generated once
+    assert len(ssm_queries) == len(set(ssm_queries))
+    assert len(ssm_queries) < 25
+
+    # the maximum time gap may be longer than the fixed time gap
+    processor.max_time_gap = 12
+    assert _hours(processor._get_adaptive_svp_times()) == [0, 10, 22]
+
+
+def test_get_adaptive_svp_times_batch(monkeypatch):
+    from mergesvp.lib import syntheticprocess
+
+    no_data_cell = get_atlas_cell(-16.0, 148.5, datetime(2000, 1, 1))
+
+    def mock_get_atlas_grid_profiles(cells):
+        # sharp change in sound speed at longitude 148.5, where the grid
+        # has no data
+        return [
+            None if cell == no_data_cell else
+            [(0.0, 1510.0 if cell[1] >= 1314 else 1500.0)]
+            for cell in cells
+        ]
+
+    def mock_get_ssm_synthetic_svp(latitude, longitude, timestamp):
+        raise AssertionError("SSM profiles are not compared to grid profiles")
+
+    monkeypatch.setattr(
+        syntheticprocess,
+        'get_atlas_grid_profiles',
+        mock_get_atlas_grid_profiles
+    )
+    monkeypatch.setattr(
+        syntheticprocess, 'get_ssm_synthetic_svp', mock_get_ssm_synthetic_svp)
+
+    processor = _adaptive_processor('batch')
+    # the cell without data (hours 10 and 11) is not compared, the change
+    # is found at the next cell
+    assert _hours(processor._get_adaptive_svp_times()) == [0, 6, 12, 18, 24]
+
+
+def test_get_adaptive_svp_times_no_atlas_grid(tmp_path, monkeypatch):
+    from mergesvp.lib import ssminterface
+
+    class MockAtlas:
+        data_folder = tmp_path
+
+    # no WOA18 files in the atlas data folder
+    monkeypatch.setattr(ssminterface, 'get_ssm_atlas', lambda: MockAtlas())
+    warnings = start_warnings()
+
+    processor = _adaptive_processor('batch')
+    # SVPs are placed every time gap instead
+    assert _hours(processor._get_adaptive_svp_times()) == \
+        [0, 4, 8, 12, 16, 20, 24]
+    assert warnings.count('adaptive_spacing') == 1
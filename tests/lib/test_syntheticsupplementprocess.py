@@ -1,10 +1,13 @@
 import pytest
 from datetime import datetime, timedelta
+from mergesvp.lib.parsers import CarisSvpParser
 from mergesvp.lib.svpprofile import SvpProfile
 from mergesvp.lib.tracklines import Trackline, TracklinePoint
+from mergesvp.lib.warningsummary import start_warnings
 from tests.lib.mock_data import svp_1, svp_2, svp_3, svp_4
 from mergesvp.lib.syntheticsupplementprocess import \
     find_gaps, \
+    get_trackline_time_windows, \
     SyntheticSupplementSvpProcessor, \
     calc_interval
 
@@ -27,6 +30,24 @@ def test_find_gaps():
     assert gap2[2] == 24 + 1 / 60  # 1 day and 1 minute
 
 
+def test_get_trackline_time_windows():
+    svps = [svp_1, svp_2, svp_3, svp_4]
+    gaps = find_gaps(svps, 1)
+
+    windows = get_trackline_time_windows(svps, gaps, 0.5)
+
+    # one window per SVP, and one per gap
+    assert len(windows) == 6
+    assert windows[0] == (
+        svp_1.timestamp - timedelta(hours=0.5),
+        svp_1.timestamp + timedelta(hours=0.5)
+    )
+    assert windows[5] == (
+        svp_3.timestamp - timedelta(hours=0.5),
+        svp_4.timestamp + timedelta(hours=0.5)
+    )
+
+
 def test_get_supplement_coords():
     processor = SyntheticSupplementSvpProcessor(None, None, None)
 
@@ -49,39 +70,213 @@ def test_get_supplement_coords():
     assert coords_2[0] == svp_1.timestamp + 2 * timedelta(hours=0.5)
 
 
+def _mock_atlas(monkeypatch):
+    from mergesvp.lib import syntheticsupplementprocess
+
+    def mock_iter_ssm_synthetic_svps(positions, jobs=1, engine='ssm'):
+        for _ in positions:
+            yield [(0.0, 1500.0)]
+
+    monkeypatch.setattr(
+        syntheticsupplementprocess,
+        'iter_ssm_synthetic_svps',
+        mock_iter_ssm_synthetic_svps
+    )
+
+
+def test_iter_filled_svps(monkeypatch):
+    _mock_atlas(monkeypatch)
+
+    t1 = datetime(2000, 1, 1, 0, 0, 0)
+    trackline = Trackline(None, None)
+    trackline.append(TracklinePoint(t1, 10, 20, 30))
+    trackline.append(TracklinePoint(t1 + timedelta(hours=24), 90, 40, 10))
+
+    svps = [
+        SvpProfile(timestamp=t1),
+        SvpProfile(timestamp=t1 + timedelta(hours=1)),
+        SvpProfile(timestamp=t1 + timedelta(hours=6)),
+        SvpProfile(timestamp=t1 + timedelta(hours=24)),
+    ]
+
+    processor = SyntheticSupplementSvpProcessor(None, None, None)
+    processor.tracklines = [trackline]
+    processor.time_threshold = 2
+
+    gaps_coords = processor._get_gaps_coords(svps)
+    filled = list(processor._iter_filled_svps(svps, gaps_coords))
+
+    # 2 SVPs in the 5 hour gap, and 8 in the 18 hour gap
+    assert len(filled) == 14
+    assert filled[0:2] == svps[0:2]
+    assert filled[4] is svps[2]
+    assert filled[-1] is svps[3]
+    timestamps = [svp.timestamp for svp in filled]
+    assert timestamps == sorted(timestamps)
+    assert filled[2].depth_speed == [(0.0, 1500.0)]
+    # locations of the existing SVPs are also set
+    assert svps[3].latitude == 90
+    assert svps[1].latitude == pytest.approx(10 + 80 / 24)
+
+
+def test_process(tmp_path, monkeypatch):
+    _mock_atlas(monkeypatch)
+
+    svps_file = tmp_path / 'svps.txt'
+    svps_file.write_text("\n".join([
+        "[SVP_VERSION_2]",
+        "svps.txt",
+        "Section  2020-001 00:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+        "    1.000  1539.20",
+        "Section  2020-001 06:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+        "    1.000  1539.20",
+    ]) + "\n")
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(
+        "Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)\n"
+        "1/1/20,00:00:00.000,line_1,150.0,-10.0,10.0\n"
+        "1/1/20,06:00:00.000,line_1,156.0,-16.0,10.0\n"
+    )
+    output_file = tmp_path / 'output.txt'
+
+    with output_file.open('w') as output:
+        processor = SyntheticSupplementSvpProcessor(
+            svps_file,
+            [tracklines_file],
+            output,
+            time_threshold=2,
+            date_format=r'%d/%m/%y'
+        )
+        processor.process()
+
+    svps = CarisSvpParser().read_many(output_file)
+    # 2 synthetic SVPs fill the 6 hour gap
+    assert len(svps) == 4
+    assert [svp.timestamp.hour for svp in svps] == [0, 2, 4, 6]
+    assert svps[0].depth_speed == [(0.0, 1539.6), (1.0, 1539.2)]
+    assert svps[1].depth_speed == [(0.0, 1500.0)]
+    assert svps[1].latitude == pytest.approx(-12.0)
+    assert svps[3].longitude == pytest.approx(156.0)
+
+
 def test_calc_interval():
 
     interval = calc_interval(svp_1, svp_2, 1)
     assert interval == pytest.approx(0.5, rel=1e-2)
 
-## 
-## The hyo2.abc.lib.gdal_aux.GdalAux function performs some interesting
-## operations (removes env vars fr GDAL_DATA) that cause this test to
-## fail when running on GitHub actions.
-## 
-# def test_processor_fill_gap():
-#     t1 = datetime(2000, 1, 1, 0, 0, 0)
-#     t2 = datetime(2000, 1, 2, 0, 0, 0)
-
-#     trackline = Trackline(None, None)
-#     trackline.append(TracklinePoint(t1, 10, 20, 30))
-#     trackline.append(TracklinePoint(t2, 90, 40, 10))
-
-#     svp1 = SvpProfile(None, t1)
-#     svp2 = SvpProfile(None, t2)
-#     svps = [svp1, svp2]
-
-#     processor = SyntheticSupplementSvpProcessor(None, None, None)
-#     processor.tracklines = [trackline]
-#     processor.svps = svps
-#     processor.time_threshold = 2
-
-#     processor._fill_gaps()
-
-#     # there should now be 11 new SVPs
-#     assert len(processor.svps) == 13
-#     # all new SVPs should be in between the initial SVPs
-#     # we can check this by making sure the first and last
-#     # items are still the same
-#     assert processor.svps[0] == svp1
-#     assert processor.svps[-1] == svp2
+
+def test_process_sparse_tracklines(tmp_path, monkeypatch):
+    _mock_atlas(monkeypatch)
+
+    svps_file = tmp_path / 'svps.txt'
+    svps_file.write_text("\n".join([
+        "[SVP_VERSION_2]",
+        "svps.txt",
+        "Section  2020-001 01:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+        "Section  2020-001 09:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+    ]) + "\n")
+    # a trackline point every 2 hours, none within half an hour of the SVPs
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(
+        "Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)\n" +
+        "".join(
+            f"1/1/20,{hour:02d}:00:00.000,line_1,150.0,{-hour}.0,10.0\n"
+            for hour in range(0, 12, 2)
+        )
+    )
+
+    for (trackline_padding, located) in [(0.5, False), (1, True)]:
+        warnings = start_warnings()
+        output_file = tmp_path / 'output.txt'
+        with output_file.open('w') as output:
+            processor = SyntheticSupplementSvpProcessor(
+                svps_file,
+                [tracklines_file],
+                output,
+                time_threshold=2,
+                date_format=r'%d/%m/%y',
+                trackline_padding=trackline_padding
+            )
+            processor.process()
+
+        svps = CarisSvpParser().read_many(output_file)
+        assert [svp.timestamp.hour for svp in svps] == [1, 3, 5, 7, 9]
+        # the synthetic SVPs are always located, the gap between the SVPs
+        # includes enough trackline points
+        assert svps[1].latitude == pytest.approx(-3.0)
+        if located:
+            assert warnings.count('trackline_coverage') == 0
+            assert svps[0].latitude == pytest.approx(-1.0)
+            assert svps[-1].latitude == pytest.approx(-9.0)
+        else:
+            assert warnings.count('trackline_coverage') == 2
+
+
+def test_process_write_fails(tmp_path, monkeypatch):
+    from mergesvp.lib import syntheticsupplementprocess
+    from mergesvp.lib.checkpoint import SvpCheckpoint
+
+    events = []
+
+    def mock_iter_ssm_synthetic_svps(positions, jobs=1, engine='ssm'):
+        try:
+            for _ in positions:
+                yield [(0.0, 1500.0)]
+        finally:
+            events.append('atlas closed')
+
+    def failing_write_outputs(svps, sinks):
+        svps_iter = iter(svps)
+        next(svps_iter)
+        raise OSError("disk full")
+
+    checkpoint_close = SvpCheckpoint.close
+
+    def close(checkpoint):
+        events.append('checkpoint closed')
+        checkpoint_close(checkpoint)
+
+    monkeypatch.setattr(
+        syntheticsupplementprocess,
+        'iter_ssm_synthetic_svps',
+        mock_iter_ssm_synthetic_svps
+    )
+    monkeypatch.setattr(
+        syntheticsupplementprocess, 'write_outputs', failing_write_outputs)
+    monkeypatch.setattr(SvpCheckpoint, 'close', close)
+
+    svps_file = tmp_path / 'svps.txt'
+    svps_file.write_text("\n".join([
+        "[SVP_VERSION_2]",
+        "svps.txt",
+        "Section  2020-001 00:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+        "Section  2020-001 06:00:00 00:00:00 000:00:00",
+        "    0.000  1539.60",
+    ]) + "\n")
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(
+        "Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)\n"
+        "1/1/20,00:00:00.000,line_1,150.0,-10.0,10.0\n"
+        "1/1/20,06:00:00.000,line_1,156.0,-16.0,10.0\n"
+    )
+
+    with (tmp_path / 'output.txt').open('w') as output:
+        # more synthetic SVPs than the background queue holds, so the
+        # background thread is still running when writing fails
+        processor = SyntheticSupplementSvpProcessor(
+            svps_file,
+            [tracklines_file],
+            output,
+            time_threshold=0.02,
+            date_format=r'%d/%m/%y'
+        )
+        with pytest.raises(OSError):
+            processor.process()
+
+    # the atlas queries are stopped before the checkpoint is closed
+    assert events == ['atlas closed', 'checkpoint closed']
@@ -0,0 +1,261 @@
+import pytest
+from datetime import datetime
+
+from mergesvp.lib.errors import SvpMissingDataException
+from mergesvp.lib import tracklinecache
+from mergesvp.lib.metrics import start_metrics
+from mergesvp.lib.tracklines import \
+    TracklineNormalisationReport, \
+    normalise_trackline_list
+from mergesvp.lib.tracklinecache import \
+    find_tracklines_files, \
+    get_cache_path, \
+    load_tracklines, \
+    load_tracklines_files, \
+    read_cache, \
+    get_cache_key
+from mergesvp.lib.warningsummary import start_warnings
+
+
+tracklines_csv = """Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)
+8/4/20,21:59:11.007,0079_20200804_214711_FK200804_EM710,146.1261365,-16.7575085,55.163
+8/4/20,21:59:10.710,0079_20200804_214711_FK200804_EM710,146.1261428,-16.7575014,55.086
+8/4/20,21:59:10.710,0079_20200804_214711_FK200804_EM710,146.1261428,-16.7575014,55.086
+8/4/20,21:59:11.305,0079_20200804_214711_FK200804_EM710,146.1261253,-16.7575218,55.036
+8/1/20,10:24:52.562,0000_20200801_102451_FK200804_EM710,146.1588473,-16.7456360,58.726
+8/1/20,10:24:52.874,0000_20200801_102451_FK200804_EM710,146.1588615,-16.7456253,58.644
+"""
+
+
+def _points(tracklines):
+    return [
+        [(pt.timestamp, pt.latitude, pt.longitude, pt.depth) for pt in tl.points]
+        for tl in tracklines
+    ]
+
+
+def test_load_tracklines_cache(tmp_path):
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(tracklines_csv)
+    date_format = r'%m/%d/%y'
+
+    parsed = load_tracklines(tracklines_file, date_format, use_cache=False)
+    assert not get_cache_path(tracklines_file).exists()
+    # returned as parsed
+    assert len(parsed[0].points) == 4
+    assert not parsed[0].is_normalised
+
+    # sorted, and the duplicate point removed
+    parsed, _ = normalise_trackline_list(parsed)
+    assert [tl.line_id for tl in parsed] == [
+        '0000_20200801_102451_FK200804_EM710',
+        '0079_20200804_214711_FK200804_EM710'
+    ]
+    assert len(parsed[1].points) == 3
+    assert parsed[1].points[0].timestamp == datetime(2020, 8, 4, 21, 59, 10, 710000)
+
+    # first load writes the cache, second load reads it
+    cached = load_tracklines(tracklines_file, date_format, use_cache=True)
+    assert get_cache_path(tracklines_file).exists()
+    assert _points(cached) == _points(parsed)
+    # the cache holds the normalised tracklines
+    assert all(tl.is_normalised for tl in cached)
+
+    key = get_cache_key(tracklines_file, date_format)
+    from_cache = read_cache(get_cache_path(tracklines_file), key)
+    assert _points(from_cache) == _points(parsed)
+    assert from_cache[0].line_id == parsed[0].line_id
+
+    # cache is stale if the date format changes
+    other_key = get_cache_key(tracklines_file, r'%d/%m/%y')
+    assert read_cache(get_cache_path(tracklines_file), other_key) is None
+
+
+def test_load_tracklines_cache_time_windows(tmp_path):
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(tracklines_csv)
+    date_format = r'%m/%d/%y'
+    windows = [
+        (datetime(2020, 8, 4, 21, 59, 11), datetime(2020, 8, 4, 22, 0, 0))
+    ]
+
+    # once when cache is written, then again when read from the cache
+    for _ in range(2):
+        tracklines = load_tracklines(
+            tracklines_file, date_format, windows, use_cache=True)
+        assert len(tracklines) == 1
+        assert len(tracklines[0].points) == 2
+        assert tracklines[0].points[0].timestamp == \
+            datetime(2020, 8, 4, 21, 59, 11, 7000)
+
+
+def test_load_tracklines_cache_not_written(tmp_path, monkeypatch):
+    tracklines_file = tmp_path / 'tracklines.csv'
+    tracklines_file.write_text(tracklines_csv)
+    date_format = r'%m/%d/%y'
+    windows = [
+        (datetime(2020, 8, 4, 21, 59, 11), datetime(2020, 8, 4, 22, 0, 0))
+    ]
+
+    def write_cache_fails(cache_file, key, tracklines, report):
+        raise OSError("read only")
+
+    # the time windows are applied when writing the cache fails
+    monkeypatch.setattr(tracklinecache, 'write_cache', write_cache_fails)
+    tracklines = load_tracklines(
+        tracklines_file, date_format, windows, use_cache=True)
+    assert _points(tracklines) == [[
+        (datetime(2020, 8, 4, 21, 59, 11, 7000), -16.7575085, 146.1261365,
+            55.163),
+        (datetime(2020, 8, 4, 21, 59, 11, 305000), -16.7575218, 146.1261253,
+            55.036),
+    ]]
+
+    # if the folder is not writable only rows within the windows are parsed
+    monkeypatch.setattr(tracklinecache.os, 'access', lambda path, mode: False)
+    tracklines = load_tracklines(
+        tracklines_file, date_format, windows, use_cache=True)
+    assert not get_cache_path(tracklines_file).exists()
+    assert len(tracklines) == 1
+    assert len(tracklines[0].points) == 2
+
+
+def test_load_tracklines_cache_report(tmp_path):
+    tracklines_file = tmp_path / 'tracklines.csv'
+    # the second line is split in two by the first, and includes a
+    # duplicate point
+    tracklines_file.write_text(
+        tracklines_csv +
+        "8/1/20,10:24:53.100,0000_20200801_102451_FK200804_EM710,146.1588700,-16.7456200,58.600\n"
+        "8/1/20,10:24:53.100,0000_20200801_102451_FK200804_EM710,146.1588700,-16.7456200,58.600\n"
+    )
+    date_format = r'%m/%d/%y'
+    windows = [
+        (datetime(2020, 8, 1, 10, 24, 53), datetime(2020, 8, 4, 21, 59, 11))
+    ]
+
+    for time_windows in [None, windows]:
+        get_cache_path(tracklines_file).unlink(missing_ok=True)
+        expected, expected_report = normalise_trackline_list(load_tracklines(
+            tracklines_file, date_format, time_windows, use_cache=False))
+
+        # once when cache is written, then again when read from the cache
+        for _ in range(2):
+            report = TracklineNormalisationReport()
+            tracklines = load_tracklines(
+                tracklines_file,
+                date_format,
+                time_windows,
+                use_cache=True,
+                report=report
+            )
+            tracklines, report = normalise_trackline_list(tracklines, report)
+            assert _points(tracklines) == _points(expected)
+            assert report.input_points == expected_report.input_points
+            assert report.duplicate_points == \
+                expected_report.duplicate_points
+            if time_windows is None:
+                assert str(report) == str(expected_report)
+
+
+def test_find_tracklines_files(tmp_path):
+    (tmp_path / 'day1.csv').write_text(tracklines_csv)
+    (tmp_path / 'day2.csv').write_text(tracklines_csv)
+    (tmp_path / 'notes.txt').write_text('not a tracklines file')
+    (tmp_path / 'day1.csv.mergesvp-cache').write_text('')
+
+    # single file
+    assert find_tracklines_files(str(tmp_path / 'day1.csv')) == \
+        [(tmp_path / 'day1.csv').resolve()]
+
+    # all csv files in folder
+    assert find_tracklines_files(str(tmp_path)) == [
+        (tmp_path / 'day1.csv').resolve(),
+        (tmp_path / 'day2.csv').resolve()
+    ]
+
+    # glob pattern, excludes cache files
+    assert len(find_tracklines_files(str(tmp_path / 'day*'))) == 2
+
+    with pytest.raises(SvpMissingDataException):
+        find_tracklines_files(str(tmp_path / 'missing*.csv'))
+
+
+def test_load_tracklines_files(tmp_path):
+    header = "Date,Time,Line,Long (DD),Lat (DD),Depth (Proc)\n"
+    line_id = '0079_20200804_214711_FK200804_EM710'
+    # one trackline split over two files, and a trackline in the second file
+    # that starts before the first file
+    file_1 = tmp_path / 'day1.csv'
+    file_1.write_text(
+        header +
+        f"8/4/20,23:59:58.000,{line_id},146.1261365,-16.7575085,55.163\n"
+        f"8/4/20,23:59:59.000,{line_id},146.1261428,-16.7575014,55.086\n"
+        f"8/4/20,23:59:59.000,{line_id},146.1261428,-16.7575014,55.086\n"
+    )
+    file_2 = tmp_path / 'day2.csv'
+    file_2.write_text(
+        header +
+        f"8/5/20,00:00:00.000,{line_id},146.1261253,-16.7575218,55.036\n"
+        "8/1/20,10:24:52.562,0000_20200801_102451_FK200804_EM710,146.1588473,-16.7456360,58.726\n"
+        "8/1/20,10:24:52.874,0000_20200801_102451_FK200804_EM710,146.1588615,-16.7456253,58.644\n"
+    )
+
+    for jobs in [1, 2]:
+        tracklines = load_tracklines_files(
+            [file_2, file_1], r'%m/%d/%y', jobs=jobs)
+        # as parsed, in the order of the files
+        assert [tl.file for tl in tracklines] == [file_2, file_2, file_1]
+
+        tracklines, report = normalise_trackline_list(tracklines)
+        assert len(tracklines) == 2
+        assert tracklines[0].line_id == '0000_20200801_102451_FK200804_EM710'
+        assert tracklines[1].line_id == line_id
+        assert len(tracklines[1].points) == 3
+        assert tracklines[1].points[-1].timestamp == datetime(2020, 8, 5)
+        assert report.duplicate_points == 1
+
+    # the same report when the tracklines are read from the cache, which
+    # is written by the workers of the first run
+    for jobs in [2, 2, 1]:
+        report = TracklineNormalisationReport()
+        tracklines = load_tracklines_files(
+            [file_2, file_1],
+            r'%m/%d/%y',
+            use_cache=True,
+            jobs=jobs,
+            report=report
+        )
+        tracklines, report = normalise_trackline_list(tracklines, report)
+        assert report.tracklines == 3
+        assert report.input_points == 6
+        assert report.duplicate_points == 1
+        assert get_cache_path(file_1).exists()
+
+
+def test_load_tracklines_files_worker_warnings(tmp_path):
+    files = []
+    for name in ['day1.csv', 'day2.csv']:
+        tracklines_file = tmp_path / name
+        tracklines_file.write_text(tracklines_csv)
+        files.append(tracklines_file)
+
+    # warnings and metrics of the worker processes are added to those of
+    # the command
+    for jobs in [1, 2]:
+        for tracklines_file in files:
+            get_cache_path(tracklines_file).write_bytes(
+                tracklinecache.CACHE_MAGIC + b'invalid')
+        metrics = start_metrics('synthetic-svp')
+        warnings = start_warnings()
+        tracklines = load_tracklines_files(
+            files, r'%m/%d/%y', use_cache=True, jobs=jobs)
+        assert len(tracklines) == 4
+        assert warnings.count('trackline_cache') == 2
+        assert warnings.count(
+            'trackline_cache', get_cache_path(files[1])) == 1
+        assert metrics.get('warnings', category='trackline_cache') == 2
+        # the caches were rewritten
+        assert read_cache(
+            get_cache_path(files[0]),
+            get_cache_key(files[0], r'%m/%d/%y')) is not None
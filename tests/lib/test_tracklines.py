@@ -1,11 +1,14 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from mergesvp.lib.tracklines import \
     TracklinesParser, \
     TracklinePoint, \
     Trackline, \
-    sort_tracklines
+    TracklineIndex, \
+    join_tracklines, \
+    merge_time_windows, \
+    normalise_trackline_list
 
 
 def test_parse_line():
@@ -61,6 +64,50 @@ def test_parse_lines():
     assert len(tracklines[2].points) == 6
 
 
+def test_parse_lines_time_windows():
+    lines = [
+        "8/1/20,10:24:52.562,0000_20200801_102451_FK200804_EM710,146.1588473,-16.7456360,58.726",
+        "8/1/20,10:24:52.874,0000_20200801_102451_FK200804_EM710,146.1588615,-16.7456253,58.644",
+        "8/4/20,21:59:10.710,0079_20200804_214711_FK200804_EM710,146.1261428,-16.7575014,55.086",
+        "8/4/20,21:59:11.007,0079_20200804_214711_FK200804_EM710,146.1261365,-16.7575085,55.163",
+        "8/4/20,21:59:11.305,0079_20200804_214711_FK200804_EM710,146.1261253,-16.7575218,55.036",
+        # bad data on a day outside the windows is never parsed
+        "8/9/20,bad time,0200_20200809_000000_FK200804_EM710,bad,bad,bad",
+        "8/27/20,23:04:32.134,0493_20200827_223127_FK200804_EM710,153.5227069,-22.1081210,372.932",
+    ]
+
+    parser = TracklinesParser()
+    parser.date_format = r'%m/%d/%y'
+    parser.set_time_windows([
+        (datetime(2020, 8, 4, 21, 59, 11), datetime(2020, 8, 4, 22, 0, 0)),
+        (datetime(2020, 8, 27, 0, 0, 0), datetime(2020, 8, 28, 0, 0, 0)),
+    ])
+    parser._process_lines(lines)
+
+    tracklines = parser.tracklines
+
+    assert len(tracklines) == 2
+    assert tracklines[0].line_id == '0079_20200804_214711_FK200804_EM710'
+    assert len(tracklines[0].points) == 2
+    assert tracklines[1].line_id == '0493_20200827_223127_FK200804_EM710'
+    assert len(tracklines[1].points) == 1
+
+
+def test_merge_time_windows():
+    windows = [
+        (datetime(2000, 1, 3), datetime(2000, 1, 4)),
+        (datetime(2000, 1, 1), datetime(2000, 1, 2)),
+        (datetime(2000, 1, 1, 12), datetime(2000, 1, 2, 12)),
+    ]
+
+    merged = merge_time_windows(windows)
+
+    assert merged == [
+        (datetime(2000, 1, 1), datetime(2000, 1, 2, 12)),
+        (datetime(2000, 1, 3), datetime(2000, 1, 4)),
+    ]
+
+
 def test_trackline_is_in():
     lines = [
         "8/27/20,20:04:35.240,0493_20200827_223127_FK200804_EM710,153.5228547,-22.1082284,372.311",
@@ -151,7 +198,7 @@ def test_trackline_lerp():
     assert pt_lerp.depth == 207.5
 
 
-def test_trackline_merge():
+def test_join_tracklines():
 
     tl1_pt1 = TracklinePoint(
         datetime(2000, 1, 1, 12, 0, 0),
@@ -195,14 +242,15 @@ def test_trackline_merge():
     trackline2 = Trackline(None, None)
     trackline2.points = [tl2_pt1, tl2_pt2, tl2_pt3]
 
-    merged = Trackline.merge_tracklines([trackline1, trackline2])
+    merged = join_tracklines([trackline1, trackline2])
 
+    assert merged.line_id == 'None,None'
     assert len(merged.points) == 6
     assert merged.points[0] == tl1_pt1
     assert merged.points[5] == tl2_pt3
 
 
-def test_trackline_filter_duplicates():
+def test_normalise_trackline_list_duplicates():
 
     tl1_pt1 = TracklinePoint(
         datetime(2000, 1, 1, 12, 0, 0),
@@ -232,14 +280,16 @@ def test_trackline_filter_duplicates():
     trackline1.points = [tl1_pt1, tl1_pt2, tl1_pt2_dup, tl1_pt3]
 
 
-    no_dups = Trackline.filter_duplicate_points(trackline1)
+    normalised, report = normalise_trackline_list([trackline1])
+    no_dups = normalised[0]
 
     assert len(no_dups.points) == 3
+    assert report.duplicate_points == 1
     assert no_dups.points[0] == tl1_pt1
     assert no_dups.points[2] == tl1_pt3
 
 
-def test_tracklines_sorting():
+def test_normalise_trackline_list_sorting():
 
     tl1_pt1 = TracklinePoint(
         datetime(2000, 1, 3, 12, 0, 0),
@@ -259,7 +309,7 @@ def test_tracklines_sorting():
         30,
         220
     )
-    trackline1 = Trackline(None, None)
+    trackline1 = Trackline('1', None)
     trackline1.points = [tl1_pt1, tl1_pt2, tl1_pt3]
 
     tl2_pt1 = TracklinePoint(
@@ -280,15 +330,146 @@ def test_tracklines_sorting():
         30,
         220
     )
-    trackline2 = Trackline(None, None)
+    trackline2 = Trackline('2', None)
     trackline2.points = [tl2_pt1, tl2_pt2, tl2_pt3]
 
     tracklines = [trackline2, trackline1]
 
-    sort_tracklines(tracklines)
+    tracklines, _ = normalise_trackline_list(tracklines)
 
     assert len(tracklines) == 2
     assert tracklines[0] == trackline1
     assert tracklines[1] == trackline2
     assert tracklines[0].points[0] == tl1_pt2
     assert tracklines[1].points[0] == tl2_pt3
+
+
+def test_trackline_simplified_points():
+    trackline = Trackline(None, None)
+    # vessel travelling north along a straight line, one point every
+    # 10th of a second
+    for i in range(100):
+        trackline.append(TracklinePoint(
+            datetime(2000, 1, 1, 12, 0, 0) + timedelta(seconds=i / 10),
+            -16.0 + i * 0.00001,
+            146.0,
+            50
+        ))
+
+    simplified = trackline.simplified_points(1.0)
+    assert len(simplified) == 2
+    assert simplified[0] == trackline.points[0]
+    assert simplified[1] == trackline.points[-1]
+
+    # zero tolerance returns all the points
+    assert len(trackline.simplified_points(0)) == 100
+
+
+def test_normalise_and_join_tracklines():
+    tl1_pt1 = TracklinePoint(datetime(2000, 1, 3, 12, 0, 0), 20, 30, 200)
+    tl1_pt2 = TracklinePoint(datetime(2000, 1, 1, 12, 0, 0), 60, 10, 210)
+    tl1_pt2_dup = TracklinePoint(datetime(2000, 1, 1, 12, 0, 0), 61, 11, 211)
+    trackline1 = Trackline('1', None)
+    trackline1.points = [tl1_pt1, tl1_pt2, tl1_pt2_dup]
+
+    tl2_pt1 = TracklinePoint(datetime(2000, 1, 5, 12, 0, 0), 120, 30, 200)
+    tl2_pt2 = TracklinePoint(datetime(2000, 1, 4, 12, 0, 0), 160, 10, 210)
+    trackline2 = Trackline('2', None)
+    trackline2.points = [tl2_pt1, tl2_pt2]
+
+    empty_trackline = Trackline('3', None)
+
+    normalised, report = normalise_trackline_list(
+        [trackline2, empty_trackline, trackline1])
+    merged = join_tracklines(normalised, report)
+
+    assert merged.line_id == '1,2'
+    assert merged.points == [tl1_pt2, tl1_pt1, tl2_pt2, tl2_pt1]
+
+    assert report.tracklines == 3
+    assert report.empty_tracklines == 1
+    assert report.input_points == 5
+    assert report.duplicate_points == 1
+    assert report.output_points == 4
+
+    # tracklines that overlap in time can not be merged
+    tl2_pt2.timestamp = datetime(2000, 1, 2, 12, 0, 0)
+    normalised, _ = normalise_trackline_list([trackline1, trackline2])
+    with pytest.raises(RuntimeError):
+        join_tracklines(normalised)
+
+
+def test_normalise_trackline_list():
+    # one line split across two files, the last point of the first part is
+    # repeated at the start of the second
+    part1 = Trackline('1', None)
+    part1.points = [
+        TracklinePoint(datetime(2000, 1, 1, 2, 0, 0), 0, 0, 0),
+        TracklinePoint(datetime(2000, 1, 1, 1, 0, 0), 0, 0, 0),
+    ]
+    part2 = Trackline('1', None)
+    part2.points = [
+        TracklinePoint(datetime(2000, 1, 1, 2, 0, 0), 0, 0, 0),
+        TracklinePoint(datetime(2000, 1, 1, 3, 0, 0), 0, 0, 0),
+    ]
+    other = Trackline('2', None)
+    other.points = [TracklinePoint(datetime(2000, 1, 1, 4, 0, 0), 0, 0, 0)]
+
+    normalised, report = normalise_trackline_list([other, part2, part1])
+
+    assert [tl.line_id for tl in normalised] == ['1', '2']
+    assert [pt.timestamp.hour for pt in normalised[0].points] == [1, 2, 3]
+    assert all(tl.is_normalised for tl in normalised)
+    assert report.duplicate_points == 1
+
+    # points of normalised tracklines are not processed again
+    unsorted = Trackline('3', None)
+    unsorted.points = list(reversed(normalised[0].points))
+    unsorted.is_normalised = True
+    normalised, _ = normalise_trackline_list([unsorted])
+    assert normalised[0].points[0].timestamp.hour == 3
+
+
+def test_trackline_lerp_later_segment():
+    trackline = Trackline(None, None)
+    trackline.points = [
+        TracklinePoint(datetime(2000, 1, 1, 0, 0, 0), 0, 0, 0),
+        TracklinePoint(datetime(2000, 1, 1, 1, 0, 0), 10, 10, 10),
+        TracklinePoint(datetime(2000, 1, 1, 2, 0, 0), 20, 30, 10),
+    ]
+
+    # halfway between the second and third points
+    pt_lerp = trackline.get_lerp_point(datetime(2000, 1, 1, 1, 30, 0))
+    assert pt_lerp.latitude == 15
+    assert pt_lerp.longitude == 20
+
+    # end of the trackline
+    pt_lerp = trackline.get_lerp_point(datetime(2000, 1, 1, 2, 0, 0))
+    assert pt_lerp.latitude == 20
+    assert pt_lerp.longitude == 30
+
+
+def test_trackline_index():
+    tl1 = Trackline('1', None)
+    tl1.points = [
+        TracklinePoint(datetime(2000, 1, 1, 0, 0, 0), 0, 0, 0),
+        TracklinePoint(datetime(2000, 1, 1, 2, 0, 0), 20, 20, 0),
+    ]
+    tl2 = Trackline('2', None)
+    tl2.points = [
+        TracklinePoint(datetime(2000, 1, 1, 4, 0, 0), 40, 40, 0),
+        TracklinePoint(datetime(2000, 1, 1, 6, 0, 0), 60, 60, 0),
+    ]
+    empty = Trackline('3', None)
+    tracklines = [tl1, empty, tl2]
+
+    index = TracklineIndex(tracklines)
+    for hours in range(0, 7):
+        timestamp = datetime(2000, 1, 1, hours, 0, 0)
+        assert index.get_containing_trackline(timestamp) is \
+            Trackline.get_containing_trackline([tl1, tl2], timestamp)
+
+    assert index.get_lerp_point(datetime(2000, 1, 1, 3, 0, 0)) is None
+    pt_lerp = index.get_lerp_point(datetime(2000, 1, 1, 5, 0, 0))
+    assert pt_lerp.latitude == 50
+    assert pt_lerp.longitude == 50
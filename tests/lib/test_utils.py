@@ -1,4 +1,5 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import math
 import pytest
 
 from mergesvp.lib.utils import \
@@ -8,7 +9,11 @@ from mergesvp.lib.utils import \
     trim_to_longest_dive, \
     sort_svp_list, \
     timedelta_to_hours, \
-    lerp
+    lerp, \
+    douglas_peucker, \
+    max_speed_difference, \
+    format_caris_section_headers, \
+    parse_caris_section_headers
 
 from tests.lib.mock_data import svp_1, svp_2, svp_3
 
@@ -56,6 +61,60 @@ def test_decimal_to_dms_neg():
     assert seconds == pytest.approx(35)
 
 
+def test_format_caris_section_headers():
+    timestamps = [
+        datetime(2015, 5, 28, 23, 49, 31) + timedelta(hours=i * 7)
+        for i in range(6)
+    ]
+    latitudes = [-12.24305556, 0.0, -0.5, 89.99999999, 1e-9, -45.25]
+    longitudes = [130.9277778, -179.5, 180.0, 0.016666666, -1e-9, 45.0]
+
+    headers = format_caris_section_headers(timestamps, latitudes, longitudes)
+
+    # identical to formatting each header individually
+    for (header, timestamp, latitude, longitude) in zip(
+            headers, timestamps, latitudes, longitudes):
+        lat = decimal_to_dms(latitude)
+        lng = decimal_to_dms(longitude)
+        assert header == (
+            f"Section {timestamp.strftime('%Y-%j %H:%M:%S')} "
+            f"{lat[0]}:{lat[1]}:{lat[2]} {lng[0]}:{lng[1]}:{lng[2]}\n"
+        )
+
+    # and parsing the headers gives the same values as before
+    (parsed_timestamps, parsed_latitudes, parsed_longitudes) = \
+        parse_caris_section_headers(headers)
+    assert parsed_timestamps == timestamps
+    assert parsed_latitudes == pytest.approx(latitudes, abs=1e-9)
+    assert parsed_longitudes == pytest.approx(longitudes, abs=1e-9)
+
+
+def test_parse_caris_section_headers():
+    lines = [
+        "Section  2015-146 00:01:18 01:01:01 002:02:02",
+        "Section 2015-146 1:2:3 -12:14:35 130 Datagram time: 1",
+        "Section 2016-366 23:59:59 -0:30:00 10:30",
+    ]
+    (timestamps, latitudes, longitudes) = parse_caris_section_headers(lines)
+
+    assert timestamps == [
+        datetime(2015, 5, 26, 0, 1, 18),
+        datetime(2015, 5, 26, 1, 2, 3),
+        datetime(2016, 12, 31, 23, 59, 59),
+    ]
+    for (line, latitude, longitude) in zip(lines, latitudes, longitudes):
+        lat_vals = [float(s) for s in line.split()[3].split(':')]
+        lng_vals = [float(s) for s in line.split()[4].split(':')]
+        assert latitude == dms_to_decimal(*lat_vals)
+        assert longitude == dms_to_decimal(*lng_vals)
+    assert latitudes[2] == -0.5
+
+    with pytest.raises(ValueError):
+        parse_caris_section_headers(["Section 2015-146 24:00:00 0:0:0 0:0:0"])
+    with pytest.raises(ValueError):
+        parse_caris_section_headers(["Section 2015-146 00:00:00"])
+
+
 def test_get_all_dives():
     # note the actual sound speed has no impact on this function, so we
     # just use the same speed value because it's easier to copy/paste
@@ -148,3 +207,26 @@ def test_lerp():
     assert lerp(5, 10, 0.5) == 7.5
     assert lerp(5, 15, 0.25) == 7.5
     assert lerp(5, 15, 0.75) == 12.5
+
+
+def test_douglas_peucker():
+    # a straight line with a small wobble, then a sharp corner
+    xs = [0.0, 1.0, 2.0, 3.0, 4.0, 4.0, 4.0]
+    ys = [0.0, 0.1, 0.0, -0.1, 0.0, 1.0, 2.0]
+
+    # wobble is within the tolerance, so only the corner is kept
+    assert douglas_peucker(xs, ys, 0.5) == [0, 4, 6]
+    # only points that lie exactly on the simplified line are removed
+    assert douglas_peucker(xs, ys, 0.01) == [0, 1, 3, 4, 6]
+    # zero tolerance disables simplification
+    assert douglas_peucker(xs, ys, 0) == [0, 1, 2, 3, 4, 5, 6]
+
+
+def test_max_speed_difference():
+    profile_a = [(0.0, 1500.0), (10.0, 1502.0), (20.0, 1504.0)]
+    profile_b = [(0.0, 1501.0), (10.0, 1499.0)]
+
+    # only depths in both profiles are compared
+    assert max_speed_difference(profile_a, profile_b) == 3.0
+    assert max_speed_difference(profile_a, profile_a) == 0.0
+    assert max_speed_difference(profile_a, [(5.0, 1500.0)]) == math.inf
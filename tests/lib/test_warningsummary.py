@@ -0,0 +1,71 @@
+from mergesvp.lib.metrics import RunMetrics, merge_metrics, start_metrics
+from mergesvp.lib.parsers import L0SvpParser
+from mergesvp.lib.warningsummary import \
+    MAX_SAMPLES, \
+    WarningSummary, \
+    add_warning, \
+    merge_warnings, \
+    start_warnings
+
+
+def test_warning_summary():
+    metrics = start_metrics('merge-raw-svp')
+    warnings = start_warnings()
+    for line in range(1, 1001):
+        add_warning('svp_parse', "Failed to parse line", 'a.TXT', line)
+    add_warning('svp_parse', "Missing date", 'b.TXT')
+    add_warning('trackline_coverage', "No trackline")
+
+    assert warnings.count() == 1002
+    assert warnings.count('svp_parse') == 1001
+    assert warnings.count('svp_parse', 'a.TXT') == 1000
+    assert metrics.get('warnings', category='svp_parse') == 1001
+    # only a sample of the line numbers is kept
+    counts = list(warnings.warnings.values())
+    assert counts[0].samples == list(range(1, MAX_SAMPLES + 1))
+
+    lines = warnings.summary().splitlines()
+    assert lines == [
+        "svp_parse: 1001 warnings",
+        "    a.TXT: Failed to parse line (1000 times, eg; 1, 2, 3, 4, 5)",
+        "    b.TXT: Missing date (1 times)",
+        "trackline_coverage: 1 warnings",
+        "    No trackline (1 times)",
+    ]
+
+
+def test_l0_parse_warnings():
+    warnings = start_warnings()
+    lines = [
+        "Now: 28/05/2015 23:49:31",
+        "00.040\t24.047\t1539.508",
+    ] + ["bad line"] * 100
+    parser = L0SvpParser()
+    parser.fail_on_error = False
+    svp = parser._parse_l0(lines, 'V1.TXT')
+
+    assert len(svp.depth_speed) == 1
+    # missing lat and lng
+    assert len(svp.warnings) == 2
+    assert warnings.count('svp_parse', 'V1.TXT') == 102
+
+
+
+def test_merge_warnings():
+    metrics = start_metrics('synthetic-svp')
+    warnings = start_warnings()
+    add_warning('trackline_cache', "Invalid cache", 'a.csv', 1)
+
+    # warnings of a worker process
+    worker_metrics = RunMetrics()
+    worker_warnings = WarningSummary()
+    for sample in range(2, 10):
+        worker_warnings.add('trackline_cache', "Invalid cache", 'a.csv', sample)
+        worker_metrics.add('warnings', category='trackline_cache')
+    merge_warnings(worker_warnings)
+    merge_metrics(worker_metrics)
+
+    assert warnings.count('trackline_cache', 'a.csv') == 9
+    counts = list(warnings.warnings.values())
+    assert counts[0].samples == list(range(1, MAX_SAMPLES + 1))
+    assert metrics.get('warnings', category='trackline_cache') == 9